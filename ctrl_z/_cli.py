@@ -4,13 +4,21 @@ Command line interface for CTRL-Z
 import argparse
 import logging
 import os
+import signal
 import sys
+from contextlib import nullcontext
+from datetime import datetime, timezone
+from typing import Optional
 
 import django
 from django.conf import settings
 
+from . import benchmark
 from .backup import Backup, configure_logging
 from .config import DEFAULT_CONFIG_FILE
+from .profiling import Profiler
+from .server import Server
+from .summary import EXIT_SUCCESS
 
 logger = logging.getLogger(__name__)
 
@@ -19,17 +27,6 @@ def noop(*args, **kwargs):
     pass
 
 
-class readable_dir(argparse.Action):
-    def __call__(self, parser, namespace, values, option_string=None):
-        prospective_dir = values
-        if not os.path.isdir(prospective_dir):
-            raise argparse.ArgumentTypeError(f"{prospective_dir} is not a valid path")
-        if os.access(prospective_dir, os.R_OK):
-            setattr(namespace, self.dest, prospective_dir)
-        else:
-            raise argparse.ArgumentTypeError(f"{prospective_dir} is not a readable dir")
-
-
 class db_alias(argparse.Action):
     def __call__(self, parser, namespace, values, option_string=None):
         _values = getattr(namespace, self.dest) or []
@@ -49,6 +46,16 @@ class db_alias(argparse.Action):
         setattr(namespace, self.dest, _values)
 
 
+def timestamp(value: str) -> datetime:
+    try:
+        moment = datetime.fromisoformat(value)
+    except ValueError:
+        raise argparse.ArgumentTypeError(f"{value} is not a valid ISO 8601 timestamp")
+    if moment.tzinfo is None:
+        moment = moment.replace(tzinfo=timezone.utc)
+    return moment
+
+
 class CLI:
     """
     Core CLI implementation.
@@ -79,6 +86,17 @@ class CLI:
         parser = argparse.ArgumentParser(description="CTRL-Z CLI")
         parser.add_argument("--config-file", help="Config file to use")
         parser.add_argument("--base-dir", help="Base directory override")
+        parser.add_argument(
+            "--profile",
+            action="store_true",
+            help="Profile the phases of a backup or restore and the subprocesses, and write the "
+            "results to the profile directory in the backup",
+        )
+        parser.add_argument(
+            "--summary",
+            metavar="PATH",
+            help="Write a JSON summary of the backup or restore to this file, or to stdout with '-'",
+        )
 
         subparsers = parser.add_subparsers(help="Sub commands", dest="subcommand")
 
@@ -115,10 +133,17 @@ class CLI:
             default=True,
             help="Do not backup files",
         )
+        parser_backup.add_argument(
+            "--changed-files",
+            help="Feed of the paths changed since the previous backup - only those are copied "
+            "on top of the previous backup if the feed covers the full period",
+        )
 
         # backup restoration
         parser_restore = subparsers.add_parser("restore", help="Restore a backup")
-        parser_restore.add_argument("backup_dir", action=readable_dir, help="Directory containing the backups")
+        parser_restore.add_argument(
+            "backup_dir", help="Directory containing the backups, or the name of a backup in any storage tier"
+        )
         parser_restore.add_argument(
             "--db-name",
             dest="db_names",
@@ -175,9 +200,78 @@ class CLI:
             default=True,
             help="Do not restore files",
         )
+        parser_restore.add_argument(
+            "--files-only",
+            action="store_true",
+            help="Only restore files, not the databases",
+        )
+        parser_restore.add_argument(
+            "--path",
+            dest="paths",
+            metavar="PATTERN",
+            action="append",
+            help="Only restore the files matching this pattern, relative to the file directory "
+            "(e.g. 'uploads/customer-123/**'), leaving the other files in place. Use multiple "
+            "times for multiple patterns.",
+        )
+        parser_restore.add_argument(
+            "--restore-profile",
+            metavar="NAME",
+            help="Only restore the tables selected by this profile from the restore_profiles "
+            "config, with or without their data (PostgreSQL only)",
+        )
+        parser_restore.add_argument(
+            "--pgdata",
+            help="Restore the base backup into this (empty) data directory for point-in-time "
+            "recovery, instead of restoring the database dumps",
+        )
+        parser_restore.add_argument(
+            "--target-time",
+            type=timestamp,
+            help="ISO 8601 timestamp to recover to with --pgdata, defaults to the end of the WAL "
+            "archive. Without timezone, UTC is assumed.",
+        )
+        parser_restore.add_argument(
+            "--cluster",
+            help="Cluster (host.port) to restore with --pgdata, if the backup contains multiple",
+        )
+
+        # compression benchmark
+        parser_benchmark = subparsers.add_parser(
+            "benchmark_compression",
+            help="Dump a sample of a database with different compression settings and recommend one",
+        )
+        parser_benchmark.add_argument("alias", nargs="?", default="default", help="Database alias to sample")
+        parser_benchmark.add_argument(
+            "--candidates",
+            nargs="+",
+            default=benchmark.DEFAULT_CANDIDATES,
+            help="Compression settings (method[:level]) to try, lz4 and zstd require pg_dump 16+",
+        )
+        parser_benchmark.add_argument(
+            "--max-ratio",
+            type=float,
+            default=0.5,
+            help="Maximum size of the compressed dump, relative to the uncompressed dump",
+        )
+        parser_benchmark.add_argument(
+            "--sample-size",
+            type=int,
+            default=benchmark.DEFAULT_SAMPLE_SIZE // (1024 * 1024),
+            help="Dump the largest tables fitting in this many megabytes",
+        )
 
         # retention policy inspection
         subparsers.add_parser("show_backup_dir", help="Echo the backup directory")
+        subparsers.add_parser("list_backups", help="List the backups in the backup root and all storage tiers")
+        subparsers.add_parser("migrate_tiers", help="Move the backups that are due to slower storage tiers")
+
+        # long-running mode
+        parser_serve = subparsers.add_parser(
+            "serve", help="Run scheduled and requested backups and restores, with a status endpoint"
+        )
+        parser_serve.add_argument("--socket", help="Unix socket to serve the status endpoint on")
+        parser_serve.add_argument("--port", type=int, help="Serve the status endpoint on 127.0.0.1 at this port")
 
         self.parser = parser
 
@@ -215,7 +309,8 @@ class CLI:
             conf_overrides["base_dir"] = options.base_dir
 
         if subcommand == "restore":
-            self._backup = Backup.prepare_restore(config_file, options.backup_dir)
+            backup_dir = self._locate_backup(config_file, options.backup_dir)
+            self._backup = Backup.prepare_restore(config_file, backup_dir)
         else:
             self._backup = Backup.from_config(config_file, **conf_overrides)
 
@@ -227,11 +322,34 @@ class CLI:
             self.backup(options)
         elif subcommand == "restore":
             self.restore(options)
+        elif subcommand == "benchmark_compression":
+            self.benchmark_compression(options)
         elif subcommand == "show_backup_dir":
             self.show_backup_dir()
+        elif subcommand == "list_backups":
+            self.list_backups()
+        elif subcommand == "migrate_tiers":
+            self.migrate_tiers()
+        elif subcommand == "serve":
+            self.serve(options, config_file)
         else:
             self.parser.print_help()
 
+    def _locate_backup(self, config_file: str, backup_dir: str) -> str:
+        """
+        Resolve a backup directory, or the name of a backup in any tier.
+        """
+        if not os.path.isdir(backup_dir):
+            found = None
+            if os.sep not in backup_dir:
+                found = Backup.from_config(config_file).find_backup(backup_dir)
+            if found is None:
+                raise argparse.ArgumentTypeError(f"{backup_dir} is not a valid path")
+            backup_dir = found
+        if not os.access(backup_dir, os.R_OK):
+            raise argparse.ArgumentTypeError(f"{backup_dir} is not a readable dir")
+        return backup_dir
+
     def generate_config(self, options):
         """
         Read the default config and write it to stdout or the requested
@@ -251,51 +369,137 @@ class CLI:
         skip_db = options.skip_db
         backup_files = options.backup_files
         version = options.version
+        changed_files = options.changed_files
 
         backup = self._backup
+        backup.profiler = Profiler() if options.profile else None
+        backup.summary.kind = "backup"
 
         # perform the backup
-        has_errors = False
+        error = None
         try:
-            backup.full(db=backup_db, skip_db=skip_db, files=backup_files, version=version)
-        except Exception:
-            has_errors = True
+            with backup.profiler or nullcontext():
+                backup.full(
+                    db=backup_db,
+                    skip_db=skip_db,
+                    files=backup_files,
+                    version=version,
+                    changed_files=changed_files,
+                )
+        except Exception as exc:
+            error = exc
             logger.exception("Backup failed")
-            raise
         finally:
-            backup.report(has_errors)
+            if backup.profiler:
+                backup.profiler.write(backup.base_dir)
+            backup.report(error is not None)
+        self._finish(backup, options, error)
 
     def restore(self, options):
-        restore_db = options.restore_db
+        restore_db = options.restore_db and not options.files_only
         skip_db = options.skip_db
         restore_files = options.restore_files
         db_names = dict(options.db_names or ())
         db_hosts = dict(options.db_hosts or ())
         db_ports = dict(options.db_ports or ())
+        pgdata = options.pgdata
+
+        if options.target_time and not pgdata:
+            self.parser.error("--target-time requires --pgdata")
+        if options.paths and not restore_files:
+            self.parser.error("--path cannot be combined with --no-files")
+        if options.restore_profile and not restore_db:
+            self.parser.error("--restore-profile cannot be combined with --no-db or --files-only")
 
         backup = self._backup
+        backup.profiler = Profiler() if options.profile else None
+        backup.summary.kind = "restore"
 
         # perform the restore
-        has_errors = False
+        error = None
         try:
-            backup.restore(
-                db=restore_db,
-                skip_db=skip_db,
-                files=restore_files,
-                db_names=db_names,
-                db_hosts=db_hosts,
-                db_ports=db_ports,
-            )
-        except Exception:
-            has_errors = True
+            with backup.profiler or nullcontext():
+                backup.restore(
+                    db=restore_db and not pgdata,
+                    skip_db=skip_db,
+                    files=restore_files,
+                    db_names=db_names,
+                    db_hosts=db_hosts,
+                    db_ports=db_ports,
+                    paths=options.paths,
+                    profile=options.restore_profile,
+                )
+                if pgdata and restore_db and not backup.lock_skipped:
+                    backup.restore_cluster(pgdata, target_time=options.target_time, cluster=options.cluster)
+        except Exception as exc:
+            error = exc
             logger.exception("Restore failed")
-            raise
         finally:
-            backup.report(has_errors)
+            if backup.profiler:
+                backup.profiler.write(backup.base_dir)
+            backup.report(error is not None)
+        self._finish(backup, options, error)
+
+    def _finish(self, backup: Backup, options, error: Optional[Exception]):
+        """
+        Write the summary of the run, and exit with the code matching its
+        outcome, see :mod:`ctrl_z.summary`.
+        """
+        summary = backup.finish_summary(error)
+        if options.summary == "-":
+            self.stdout.write(summary.to_json())
+        elif options.summary:
+            summary.write(options.summary)
+        if summary.exit_code != EXIT_SUCCESS:
+            self.stderr.write(f"{summary.kind.capitalize()} {summary.status}: {summary.error}\n")
+            sys.exit(summary.exit_code)
+
+    def benchmark_compression(self, options):
+        results = self._backup.benchmark_compression(
+            options.alias,
+            candidates=options.candidates,
+            sample_size=options.sample_size * 1024 * 1024,
+        )
+
+        baseline = next((result for result in results if result.spec == benchmark.BASELINE), None)
+        for result in results:
+            ratio = result.size / baseline.size if baseline and baseline.size else 1
+            self.stdout.write(f"{result.spec:<10} {result.seconds:8.2f}s {result.size:>14} bytes {ratio:6.1%}\n")
+
+        recommended = benchmark.recommend(results, options.max_ratio)
+        if recommended is None:
+            self.stdout.write(f"No setting compresses to {options.max_ratio:.0%} of the uncompressed size\n")
+        else:
+            self.stdout.write(f"Recommended: database.compression.{options.alias}: {recommended.spec}\n")
+
+    def serve(self, options, config_file: str):
+        config = self._backup.config
+        if options.socket:
+            config.serve["socket"] = options.socket
+        if options.port:
+            config.serve["port"] = options.port
+
+        server = Server(config_file, config)
+        signal.signal(signal.SIGTERM, lambda *args: server.stop())
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
 
     def show_backup_dir(self):
         self.stdout.write(self._backup.base_dir)
         self.stdout.write("\n")
 
+    def list_backups(self):
+        for name, path in self._backup.catalogue():
+            self.stdout.write(f"{name}\t{path}\n")
+
+    def migrate_tiers(self):
+        if not self._backup.config.tiers:
+            self.stderr.write("No storage tiers are configured\n")
+            return
+        for path in self._backup.migrate_tiers() or []:
+            self.stdout.write(f"{path}\n")
+
 
 cli = CLI()
@@ -1,24 +1,163 @@
+import json
 import logging
 import os
 import shutil
+import sqlite3
 import subprocess
+import tempfile
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
+from contextlib import ExitStack, contextmanager, nullcontext
 from datetime import datetime, timezone
-from typing import List, Optional
+from functools import partial, wraps
+from typing import List, Optional, Tuple
 
 from django.conf import settings
-from django.core.mail import send_mail
+from django.core.mail import EmailMessage
 from django.db import connections
 from django.utils.module_loading import import_string
 
+from ctrl_z import benchmark
+from ctrl_z.changes import ChangeFeed
+from ctrl_z.compression import Compression
 from ctrl_z.config import Config
+from ctrl_z.db_restore import get_row_counts, read_row_counts, write_row_counts
+from ctrl_z.drivers import (
+    DatabaseDriver, DriverError, PostgresDriver, get_driver
+)
+from ctrl_z.encryption import (
+    DEFAULT_CHUNK_SIZE, EncryptingWriter, EncryptionError, decrypt_chunks,
+    decrypt_file, encrypt_file, load_key
+)
+from ctrl_z.fastcopy import fast_copy, link_or_copy
+from ctrl_z.filters import PathFilter, expand_patterns, get_base_dirs
+from ctrl_z.hashing import (
+    CACHE_FILENAME, HashCache, hash_files, hash_tree, read_manifest,
+    write_manifest
+)
+from ctrl_z.lock import (
+    DEFAULT_HEARTBEAT, DEFAULT_STALE_AFTER, LockBrokenError, LockError,
+    backup_lock
+)
+from ctrl_z.profiling import Profiler, wait
+from ctrl_z.progress import (
+    DEFAULT_INTERVAL, DUMP_ITEM_PATTERN, RESTORE_ITEM_PATTERN, VERBOSE_PATTERN,
+    OutputFollower, Progress, count_toc_entries
+)
+from ctrl_z.report import get_report_handler, tail_file
+from ctrl_z.retry import RetryPolicy
+from ctrl_z.snapshot import SnapshotError, export_snapshot, freeze_directory
+from ctrl_z.streams import BoundedBuffer, drain, read_bounded, run_command
+from ctrl_z.summary import RunSummary
+from ctrl_z.tiers import Tier, TierError, find_backup, list_backups, migrate
+from ctrl_z.toc import RestoreProfile, select_entries
+from ctrl_z.wal import (
+    extract_base_backup, lsn_to_segment, parse_start_point, prune_archive,
+    read_info, write_info, write_recovery_config
+)
+from ctrl_z.walk import (
+    DEFAULT_WORKERS as DEFAULT_WALK_WORKERS, WalkEntry, iter_copy_tree,
+    measure, walk_tree
+)
 
 logger = logging.getLogger(__name__)
 
+ENCRYPTED_SUFFIX = ".enc"
+
+ROW_COUNTS_SUFFIX = ".rowcounts.json"
+
+# bytes kept of the end of a streamed dump, to check it is complete
+DUMP_TAIL_SIZE = 1024
+
 
 class BackupError(Exception):
     pass
 
 
+class PartialFailure(BackupError):
+    """
+    Some databases or directories failed, the others completed.
+    """
+
+
+class RestorePlan:
+    """
+    A dump to restore, and the database to restore it into.
+    """
+
+    __slots__ = [
+        "alias",
+        "db_config",
+        "backup_file",
+        "compression",
+        "encrypted",
+        "row_counts_file",
+        "driver",
+        "profile",
+    ]
+
+    def __init__(
+        self,
+        alias: str,
+        db_config: dict,
+        backup_file: str,
+        compression: Optional[Compression] = None,
+        encrypted: bool = False,
+        row_counts_file: Optional[str] = None,
+        driver: Optional[DatabaseDriver] = None,
+        profile: Optional[RestoreProfile] = None,
+    ):
+        self.alias = alias
+        self.db_config = db_config
+        self.backup_file = backup_file
+        # the external compression of the dump, if any
+        self.compression = compression
+        self.encrypted = encrypted
+        self.row_counts_file = row_counts_file
+        # PostgreSQL, unless another engine is used
+        self.driver = driver
+        # the tables to restore, all if not set
+        self.profile = profile
+
+    def __repr__(self):
+        return f"RestorePlan(alias={self.alias!r}, backup_file={self.backup_file!r})"
+
+
+def locked(method):
+    """
+    Run the method holding the lock on the backup root, see :mod:`ctrl_z.lock`.
+
+    Nested calls (``rotate`` during ``full``) run under the lock already held.
+    If the run is skipped because another run holds the lock, None is returned.
+    """
+
+    @wraps(method)
+    def wrapper(self, *args, **kwargs):
+        if self._lock_held:
+            return method(self, *args, **kwargs)
+        options = self.config.lock
+        self._lock_broken.clear()
+        with backup_lock(
+            self.base_dir,
+            mode=options.get("mode", "fail"),
+            timeout=options.get("timeout"),
+            heartbeat=options.get("heartbeat", DEFAULT_HEARTBEAT),
+            stale_after=options.get("stale_after", DEFAULT_STALE_AFTER),
+            broken=self._lock_broken,
+        ) as path:
+            if path is None:
+                self.lock_skipped = True
+                return None
+            self._lock_held = True
+            try:
+                return method(self, *args, **kwargs)
+            finally:
+                self._lock_held = False
+
+    return wrapper
+
+
 class Backup:
     def __init__(self, config: Config, restore=False):
         self.config = config
@@ -27,9 +166,21 @@ class Backup:
         self.db_dir = os.path.join(self.base_dir, "db")
         self.files_dir = os.path.join(self.base_dir, "files")
 
+        self._encryption_key = None
+        self._lock_held = False
+        # set by the heartbeat if another run broke the lock, the run then aborts
+        self._lock_broken = threading.Event()
+        self.lock_skipped = False
+        # set during full backups and restores, which continue with the other
+        # databases and directories if one fails
+        self._keep_going = False
+        self.summary = RunSummary(base_dir=self.base_dir)
+        # set to profile the phases of the run
+        self.profiler: Optional[Profiler] = None
+
     @classmethod
-    def from_config(cls, config_file):
-        config = Config.from_file(config_file)
+    def from_config(cls, config_file, **conf_overrides):
+        config = Config.from_file(config_file, **conf_overrides)
         return cls(config=config)
 
     @classmethod
@@ -37,6 +188,7 @@ class Backup:
         config = Config.from_file(config_file, base_dir=base_dir, restore=True)
         return cls(config=config)
 
+    @locked
     def restore(
         self,
         db=True,
@@ -45,16 +197,72 @@ class Backup:
         db_names: Optional[dict] = None,
         db_hosts: Optional[dict] = None,
         db_ports: Optional[dict] = None,
+        paths: Optional[List[str]] = None,
+        profile: Optional[str] = None,
     ):
+        """
+        :param paths: only restore the files matching these patterns, relative
+          to the file directories, leaving the other files in place
+        :param profile: name of the restore profile selecting the tables to
+          restore, see :mod:`ctrl_z.toc`
+        """
         logger.info("Starting restore of %s", self.base_dir)
 
-        if files:
-            self.restore_files()
-        if db:
-            self.restore_databases(skip_db=skip_db, db_names=db_names, db_hosts=db_hosts, db_ports=db_ports)
+        self._keep_going = True
+        try:
+            if files:
+                with self._phase("restore_files"):
+                    self.restore_files(paths=paths)
+            if db:
+                self.restore_databases(
+                    skip_db=skip_db, db_names=db_names, db_hosts=db_hosts, db_ports=db_ports, profile=profile
+                )
+        finally:
+            self._keep_going = False
+        self._check_units("restore")
 
         logger.info("Finished restore of %s", self.base_dir)
 
+    @locked
+    def restore_cluster(self, pgdata: str, target_time: Optional[datetime] = None, cluster: Optional[str] = None):
+        """
+        Prepare a data directory for point-in-time recovery from a base backup.
+
+        The base backup is unpacked into ``pgdata`` and recovery is configured
+        to replay the archived WAL up to ``target_time`` (or the end of the
+        archive). Recovery runs when the cluster is started on ``pgdata``.
+
+        :param pgdata: empty (or non-existing) data directory to restore into
+        :param target_time: moment to recover to, must be after the base backup
+        :param cluster: name (``host.port``) of the cluster to restore, only
+          required if the backup contains base backups of multiple clusters
+        """
+        basebackup_dir = os.path.join(self.base_dir, "basebackup")
+        clusters = sorted(os.listdir(basebackup_dir)) if os.path.isdir(basebackup_dir) else []
+        if cluster is None:
+            if len(clusters) != 1:
+                raise BackupError(f"Specify which cluster to restore, found base backups for: {clusters}")
+            cluster = clusters[0]
+        elif cluster not in clusters:
+            raise BackupError(f"There is no base backup of cluster '{cluster}' in {self.base_dir}")
+
+        backup_path = os.path.join(basebackup_dir, cluster)
+        info = read_info(backup_path)
+        if info is None:
+            raise BackupError(f"Base backup {backup_path} is incomplete")
+
+        finished = datetime.fromisoformat(info["finished"])
+        if target_time is not None and target_time < finished:
+            raise BackupError(
+                f"The base backup finished at {finished}, after the target time {target_time}. "
+                "Restore from an older backup."
+            )
+
+        logger.info("Restoring base backup %s into %s", backup_path, pgdata)
+        extract_base_backup(backup_path, pgdata)
+        write_recovery_config(pgdata, os.path.join(self.wal_archive_dir, cluster), target_time=target_time)
+        logger.info("Data directory %s is ready, start PostgreSQL on it to replay the archived WAL", pgdata)
+
     def create_directories(self, create_version_folder=False):
         logger.debug("Checking/creating folder tree for backups")
 
@@ -78,7 +286,8 @@ class Backup:
         with open(os.path.join(self.version_path, version + ".txt"), "w+") as fo:
             fo.write(version)
 
-    def full(self, db=True, skip_db=None, files=True, version=None):
+    @locked
+    def full(self, db=True, skip_db=None, files=True, version=None, changed_files=None):
         """
         Run all the components of the full backup.
 
@@ -86,22 +295,155 @@ class Backup:
         :param skip_db: if backing up databases, aliases of the db's NOT to
           backup
         :param files: whether to backup (uploaded) files or not
+        :param changed_files: path to a changed-file feed, see :mod:`ctrl_z.changes`
         """
         logger.info("Performing full backup")
-        self.rotate()
-        if version:
-            self.version_path = os.path.join(self.base_dir, "version")
-            self.create_directories(create_version_folder=True)
-            self.create_version_file(version)
-        else:
-            self.create_directories()
+        with self._phase("rotate"):
+            self.rotate()
+
+        migration = None
+        if self.config.tiers:
+            # older backups move to slower storage while this one is made
+            executor = ThreadPoolExecutor(max_workers=1)
+            migration = executor.submit(self.migrate_tiers)
+            executor.shutdown(wait=False)
+
+        self._keep_going = True
+        try:
+            if version:
+                self.version_path = os.path.join(self.base_dir, "version")
+                self.create_directories(create_version_folder=True)
+                self.create_version_file(version)
+            else:
+                self.create_directories()
 
-        if db:
-            self.databases(skip_db=skip_db)
-        if files:
-            self.files()
+            if self.config.snapshot["enabled"]:
+                self.consistent(db=db, skip_db=skip_db, files=files, changed_files=changed_files)
+            else:
+                if db:
+                    with self._phase("databases"):
+                        self.databases(skip_db=skip_db)
+                if files:
+                    with self._phase("files"):
+                        self.files(changed_files=changed_files)
+            if db and self.config.wal["enabled"]:
+                with self._phase("base_backups"):
+                    self.base_backups(skip_db=skip_db)
+        finally:
+            self._keep_going = False
+            if migration is not None:
+                with self._phase("migrate_tiers"):
+                    wait_futures([migration])
+        if migration is not None:
+            migration.result()
+        self._check_units("back up")
         logger.info("Full backup completed")
 
+    def consistent(self, db=True, skip_db=None, files=True, changed_files=None):
+        """
+        Dump the databases and copy the files from snapshots taken at the same
+        moment, in parallel. See :mod:`ctrl_z.snapshot`.
+        """
+        aliases = [alias for alias in settings.DATABASES if db and not (skip_db and alias in skip_db)]
+        directories = [directory for directory in self._get_file_directories() if files and os.path.exists(directory)]
+        feed = ChangeFeed.from_file(changed_files) if changed_files else None
+
+        with ExitStack() as stack:
+            with self._phase("snapshot"):
+                snapshots = {}
+                for alias in aliases:
+                    if self._is_postgres(settings.DATABASES[alias]):
+                        snapshots[alias] = stack.enter_context(export_snapshot(alias))
+                    else:
+                        logger.info("%s is not PostgreSQL, its snapshot is taken when its dump starts", alias)
+                command, release = self.config.snapshot.get("command"), self.config.snapshot.get("release")
+                sources = {}
+                for directory in directories:
+                    try:
+                        sources[directory] = stack.enter_context(freeze_directory(directory, command, release))
+                    except SnapshotError as exc:
+                        raise BackupError(f"Freezing {directory} failed: {exc}")
+
+            logger.info("Backing up %d databases and %d directories in parallel", len(aliases), len(directories))
+            with self._phase("consistent_backup"):
+                with ThreadPoolExecutor(max_workers=self.config.snapshot.get("workers", 4)) as executor:
+                    futures = [
+                        executor.submit(
+                            self._backup_database_unit, alias, settings.DATABASES[alias], snapshots.get(alias)
+                        )
+                        for alias in aliases
+                    ]
+                    futures += [
+                        executor.submit(self._backup_directory_unit, directory, feed=feed, source=sources[directory])
+                        for directory in directories
+                    ]
+                    if self.config.database.get("row_counts"):
+                        # counted in the exported snapshots, held by the connections of this thread
+                        for alias in snapshots:
+                            self._record_row_counts(alias, settings.DATABASES[alias])
+                    for future in futures:
+                        future.result()
+
+    @contextmanager
+    def _phase(self, name: str):
+        """
+        Context manager recording a phase of the run in the summary, and
+        profiling it if profiling is enabled.
+        """
+        self._check_lock()
+        with self.summary.phase(name), self.profiler.phase(name) if self.profiler else nullcontext():
+            yield
+
+    @contextmanager
+    def _unit(self, kind: str, name: str):
+        """
+        Context manager recording a database or directory of the run in the
+        summary. During full backups and restores a failing unit is logged, and
+        the run continues with the others.
+        """
+        self._check_lock()
+        record = self.summary.add_unit(kind, name)
+        start = time.monotonic()
+        try:
+            yield record
+        except Exception as exc:
+            record["status"] = "failed"
+            record["error"] = str(exc)
+            if not self._keep_going:
+                raise
+            logger.exception("The %s %s failed, continuing with the others", kind, name)
+        else:
+            record["status"] = "succeeded"
+        finally:
+            record["seconds"] = round(time.monotonic() - start, 3)
+
+    def _check_lock(self):
+        if self._lock_broken.is_set():
+            raise LockBrokenError("The lock on the backup root was broken by another run, aborting")
+
+    def _check_units(self, action: str):
+        failed = self.summary.failed_units
+        if failed:
+            names = ", ".join(f"{unit['kind']} '{unit['name']}'" for unit in failed)
+            raise PartialFailure(f"Failed to {action}: {names}")
+
+    def finish_summary(self, error: Optional[BaseException] = None) -> RunSummary:
+        """
+        Record the outcome of the run in the summary.
+
+        :param error: the error the run failed with
+        """
+        if error is None:
+            status = "skipped" if self.lock_skipped else "succeeded"
+        elif isinstance(error, LockError) and not isinstance(error, LockBrokenError):
+            status = "locked"
+        elif isinstance(error, PartialFailure) and len(self.summary.failed_units) < len(self.summary.units):
+            status = "partial"
+        else:
+            status = "failed"
+        self.summary.finish(status, str(error) if error is not None else None)
+        return self.summary
+
     def report(self, has_errors: bool) -> None:
         """
         Report on the success or failure of the backup.
@@ -112,15 +454,27 @@ class Backup:
             return
 
         recipients = self.config.report["to"]
+        tail_lines = self.config.report.get("tail_lines", 100)
 
         logger.info("Sending report to %s", recipients)
 
-        with open(os.path.join(self.base_dir, self.config.logging["filename"]), "r") as logfile:
-            log_content = logfile.read()
+        logfile = os.path.join(self.base_dir, self.config.logging["filename"])
+        handler = get_report_handler()
+        if handler is not None:
+            body = handler.render(has_errors)
+        else:
+            body = tail_file(logfile, tail_lines)
 
         now = datetime.now(timezone.utc)
-        subject = f"Backup {now} failed" if has_errors else "Backup {now} succeeded"
-        send_mail(subject, log_content, settings.DEFAULT_FROM_EMAIL, recipients)
+        subject = f"Backup {now} failed" if has_errors else f"Backup {now} succeeded"
+        message = EmailMessage(subject, body, settings.DEFAULT_FROM_EMAIL, recipients)
+
+        if handler is not None and self.config.report.get("attach_log", True):
+            compressed_log = handler.compressed_log()
+            if compressed_log is not None:
+                message.attach(f"{self.config.logging['filename']}.gz", compressed_log, "application/gzip")
+
+        message.send()
 
     def databases(self, skip_db=None):
         """
@@ -132,7 +486,117 @@ class Backup:
         for alias, db_config in settings.DATABASES.items():
             if skip_db and alias in skip_db:
                 continue
-            self._backup_database(db_config)
+            unit = self._backup_database_unit(alias, db_config)
+            if unit["status"] != "succeeded":
+                continue
+            if self.config.database.get("row_counts") and self._is_postgres(db_config):
+                self._record_row_counts(alias, db_config)
+
+    def _backup_database_unit(self, alias: str, db_config: dict, snapshot: Optional[str] = None) -> dict:
+        with self._unit("database", alias) as unit:
+            self._get_retry_policy("database").call(
+                self._backup_database,
+                alias,
+                db_config,
+                snapshot,
+                description=f"back up database {alias}",
+                cleanup=partial(self._remove_dump, alias, db_config),
+            )
+            unit["bytes"] = self._get_dump_size(alias, db_config)
+        return unit
+
+    def _get_dump_entries(self, alias: str, db_config: dict) -> List[os.DirEntry]:
+        filename = self._get_db_filename(alias, db_config)
+        with os.scandir(self.db_dir) as entries:
+            return [entry for entry in entries if entry.name.startswith(filename)]
+
+    def _get_dump_size(self, alias: str, db_config: dict) -> int:
+        size = 0
+        for entry in self._get_dump_entries(alias, db_config):
+            if entry.is_dir():
+                size += measure(walk_tree(entry.path))[1]
+            else:
+                size += entry.stat().st_size
+        return size
+
+    def _remove_dump(self, alias: str, db_config: dict):
+        """
+        Remove the partial output of a failed dump.
+        """
+        for entry in self._get_dump_entries(alias, db_config):
+            if entry.is_dir():
+                shutil.rmtree(entry.path)
+            else:
+                os.remove(entry.path)
+
+    def _get_retry_policy(self, kind: str) -> RetryPolicy:
+        return RetryPolicy.from_config(kind, self.config.retry.get(kind))
+
+    def _get_restore_profiles(self, name: str) -> dict:
+        """
+        Get the restore profile per database alias of the profile ``name``.
+        """
+        if name not in self.config.restore_profiles:
+            raise BackupError(f"Unknown restore profile '{name}', configure it under restore_profiles")
+        profiles = {}
+        for alias, config in (self.config.restore_profiles[name] or {}).items():
+            if alias not in settings.DATABASES:
+                raise BackupError(f"Restore profile '{name}' refers to unknown database alias '{alias}'")
+            try:
+                profiles[alias] = RestoreProfile.from_config(config)
+            except ValueError as exc:
+                raise BackupError(f"Restore profile '{name}', alias '{alias}': {exc}")
+        return profiles
+
+    def _record_row_counts(self, alias: str, db_config: dict):
+        path = os.path.join(self.db_dir, self._get_db_filename(alias, db_config) + ROW_COUNTS_SUFFIX)
+        logger.info("Recording the row counts of %s in %s", alias, path)
+        write_row_counts(path, get_row_counts(alias))
+
+    def base_backups(self, skip_db=None):
+        """
+        Take a base backup of every database cluster used.
+
+        :param skip_db: list of db aliases to skip
+        """
+        clusters = {}
+        for alias, db_config in settings.DATABASES.items():
+            if skip_db and alias in skip_db:
+                continue
+            if not self._is_postgres(db_config):
+                logger.info("Skipping base backup of %s, only PostgreSQL clusters are supported", alias)
+                continue
+            clusters.setdefault(self._get_cluster_name(db_config), db_config)
+
+        logger.info("Taking base backups of %d clusters", len(clusters))
+        for cluster, db_config in clusters.items():
+            self._base_backup(cluster, db_config)
+
+    def benchmark_compression(
+        self,
+        alias: str = "default",
+        candidates: Optional[List[str]] = None,
+        sample_size: int = benchmark.DEFAULT_SAMPLE_SIZE,
+    ) -> List[benchmark.BenchmarkResult]:
+        """
+        Dump a sample of the database with each candidate compression setting.
+
+        :param sample_size: dump the largest tables fitting in this many bytes
+        """
+        db_config = settings.DATABASES[alias]
+        if not self._is_postgres(db_config):
+            raise BackupError(f"Database '{alias}' is not PostgreSQL, only pg_dump compression can be benchmarked")
+        with connections[alias].cursor() as cursor:
+            cursor.execute(benchmark.TABLE_SIZES_SQL)
+            tables = benchmark.select_sample(cursor.fetchall(), sample_size)
+        if not tables:
+            raise BackupError(f"Database '{alias}' has no tables to sample")
+
+        logger.info("Benchmarking compression of %s on %d tables", alias, len(tables))
+        args = [self.config.pg_dump_binary, "-Fc"]
+        return benchmark.benchmark(
+            args, self._get_dump_env(db_config), tables, candidates or benchmark.DEFAULT_CANDIDATES
+        )
 
     def restore_databases(
         self,
@@ -140,36 +604,162 @@ class Backup:
         db_names: Optional[dict] = None,
         db_hosts: Optional[dict] = None,
         db_ports: Optional[dict] = None,
+        profile: Optional[str] = None,
     ):
         logger.info("Restoring %d databases", len(settings.DATABASES))
+        profiles = self._get_restore_profiles(profile) if profile else {}
+        plans = []
         for alias, db_config in settings.DATABASES.items():
             if skip_db and alias in skip_db:
                 continue
             source_db_name = db_names.get(alias) if db_names else None
             source_db_host = db_hosts.get(alias) if db_hosts else None
             source_db_port = db_ports.get(alias) if db_ports else None
-            self._restore_database(
-                alias,
-                db_config,
-                source_db_name=source_db_name,
-                source_db_host=source_db_host,
-                source_db_port=source_db_port,
+            plans.append(
+                self._plan_restore(
+                    alias,
+                    db_config,
+                    source_db_name=source_db_name,
+                    source_db_host=source_db_host,
+                    source_db_port=source_db_port,
+                    profile=profiles.get(alias),
+                )
             )
 
-    def files(self):
+        if self.config.database.get("preflight", True):
+            with self._phase("preflight"):
+                self.preflight(plans)
+
+        # no connections may be open to the databases that are dropped
+        connections.close_all()
+        restored = []
+        with self._phase("restore_databases"):
+            for plan in plans:
+                with self._unit("database", plan.alias) as unit:
+                    # the database is dropped and created again on every attempt
+                    self._get_retry_policy("database").call(
+                        self._restore_database, plan, description=f"restore database {plan.alias}"
+                    )
+                if unit["status"] == "succeeded":
+                    restored.append(plan)
+
+        with self._phase("verify_databases"):
+            self.verify_databases(restored)
+
+    def verify_databases(self, plans: List[RestorePlan]):
+        """
+        Run the ``test_function`` and ``checks`` on the restored databases, all
+        aliases concurrently.
+        """
+        logger.info("Verifying %d restored databases", len(plans))
+        workers = self.config.database.get("check_workers", 4)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            results = list(executor.map(self._verify_database, plans))
+
+        failed = [plan.db_config["NAME"] for plan, ok in zip(plans, results) if not ok]
+        if failed:
+            raise BackupError(f"Restore verification failed for: {', '.join(failed)}")
+        logger.info("All %d restored databases passed verification", len(plans))
+
+    def _verify_database(self, plan: RestorePlan) -> bool:
+        row_counts = read_row_counts(plan.row_counts_file) if plan.row_counts_file else None
+        if row_counts is not None and plan.profile is not None:
+            row_counts = plan.profile.get_expected_row_counts(row_counts)
+        context = {
+            "row_counts": row_counts,
+            "tolerance": self.config.database.get("row_count_tolerance", 0.1),
+        }
+        # the test_function only takes the alias
+        checks = [(self.config.database["test_function"], {})]
+        checks += [(check, context) for check in self.config.database.get("checks", [])]
+
+        ok = True
+        try:
+            for check, kwargs in checks:
+                try:
+                    passed = import_string(check)(plan.alias, **kwargs)
+                except Exception:
+                    logger.exception("Check %s raised an error for %s", check, plan.db_config["NAME"])
+                    passed = False
+                if not passed:
+                    logger.error("Check %s failed for %s", check, plan.db_config["NAME"])
+                    ok = False
+        finally:
+            # connections are per thread, close the ones opened in this worker
+            connections[plan.alias].close()
+        return ok
+
+    def preflight(self, plans: List[RestorePlan]):
+        """
+        Check that all dumps are readable and complete, before any database is
+        dropped.
+
+        The dumps are listed with ``pg_restore --list`` concurrently. If
+        ``database.preflight_scratch`` is enabled, every dump is also restored
+        into a scratch database and checked with the ``test_function``.
+        """
+        logger.info("Checking %d dumps before restoring", len(plans))
+        workers = self.config.database.get("preflight_workers", 4)
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            errors = list(executor.map(self._check_dump, plans))
+
+        failed = [f"{plan.backup_file}: {error}" for plan, error in zip(plans, errors) if error]
+        if failed:
+            raise BackupError("Dumps failed the pre-restore check, no database was dropped:\n" + "\n".join(failed))
+
+        if self.config.database.get("preflight_scratch"):
+            for plan in plans:
+                if plan.driver is not None and not isinstance(plan.driver, PostgresDriver):
+                    logger.info("Skipping scratch restore of %s, only supported for PostgreSQL", plan.alias)
+                    continue
+                self._restore_scratch(plan)
+        logger.info("All %d dumps passed the pre-restore check", len(plans))
+
+    def files(self, changed_files: Optional[str] = None):
         """
         Process all the 'uploaded' files.
+
+        :param changed_files: path to a changed-file feed. If the feed covers
+          all changes since the previous backup, only the changed paths are
+          copied on top of the previous backup instead of the full directories.
         """
         directories = self._get_file_directories()
+        feed = ChangeFeed.from_file(changed_files) if changed_files else None
         logger.info("Backing up %d directories", len(directories))
         for directory in directories:
-            self._backup_directory(directory)
+            self._backup_directory_unit(directory, feed=feed)
+
+    def _backup_directory_unit(self, directory: str, feed: Optional[ChangeFeed] = None, source=None) -> dict:
+        with self._unit("directory", directory) as unit:
+            unit["bytes"] = self._get_retry_policy("files").call(
+                self._backup_directory,
+                directory,
+                feed=feed,
+                source=source,
+                description=f"back up {directory}",
+                cleanup=partial(self._remove_directory_copy, directory),
+            )
+        return unit
+
+    def _remove_directory_copy(self, directory: str):
+        """
+        Remove the partial copy of a failed directory backup.
+        """
+        dest = os.path.join(self.files_dir, os.path.basename(directory))
+        if os.path.exists(dest):
+            shutil.rmtree(dest)
 
-    def restore_files(self):
+    def restore_files(self, paths: Optional[List[str]] = None):
         directories = self._get_file_directories()
         logger.info("Restoring %d directories...", len(directories))
         for path in directories:
-            self._restore_directory(path)
+            # both copy over what is already there, so a retry can start over
+            if paths:
+                restore_directory = partial(self._restore_matching, path, paths)
+            else:
+                restore_directory = partial(self._restore_directory, path)
+            with self._unit("directory", path):
+                self._get_retry_policy("files").call(restore_directory, description=f"restore {path}")
 
     def _get_file_directories(self) -> list:
         if not (self.config.files.get("directories")):
@@ -178,6 +768,70 @@ class Backup:
         directories = [getattr(settings, setting) for setting in self.config.files["directories"]]
         return directories
 
+    def _get_path_filter(self, directory: str) -> PathFilter:
+        filters = self.config.files.get("filters") or {}
+        for setting in self.config.files.get("directories") or []:
+            if setting in filters and getattr(settings, setting) == directory:
+                return PathFilter.from_config(filters[setting])
+        return PathFilter()
+
+    @property
+    def hash_cache_path(self) -> str:
+        # shared by all the backups in the root, backup and restore alike
+        return os.path.join(os.path.dirname(self.base_dir), CACHE_FILENAME)
+
+    def _get_manifest_path(self, dirname: str) -> str:
+        return os.path.join(self.files_dir, f"{dirname}.sha256")
+
+    @staticmethod
+    def _read_totals(copy: str) -> Tuple[Optional[int], Optional[int]]:
+        """
+        Read the amount of files and bytes recorded with the copy of a
+        directory, the totals of its progress without walking it first.
+        """
+        try:
+            with open(f"{copy}.totals", "r") as infile:
+                totals = json.load(infile)
+        except (OSError, ValueError):
+            # backups made before the totals were recorded
+            return None, None
+        return totals.get("files"), totals.get("bytes")
+
+    @staticmethod
+    def _write_totals(copy: str, files: Optional[int], size: Optional[int]):
+        if files is None:
+            return
+        with open(f"{copy}.totals", "w") as outfile:
+            json.dump({"files": files, "bytes": size}, outfile)
+
+    def _get_previous_copy(self, dirname: str) -> Optional[Tuple[str, datetime]]:
+        """
+        Find the most recent completed copy of a directory in an earlier backup.
+
+        :return: the path to the copy and the moment the copy started
+        """
+        root = os.path.dirname(self.base_dir)
+        if not os.path.isdir(root):
+            # the first backup
+            return None
+        current = os.path.basename(self.base_dir)
+        retention_policy = self.config.retention_policy
+        candidates = sorted(
+            (name for name in os.listdir(root) if name != current and retention_policy.is_backup_dir(name)),
+            key=retention_policy.get_timestamp,
+            reverse=True,
+        )
+        for name in candidates:
+            files_dir = os.path.join(root, name, "files")
+            marker = os.path.join(files_dir, f"{dirname}.started")
+            if not os.path.isfile(marker):
+                continue
+            with open(marker, "r") as infile:
+                started = datetime.fromisoformat(infile.read().strip())
+            return os.path.join(files_dir, dirname), started
+        return None
+
+    @locked
     def rotate(self):
         """
         Rotate the existing backups according to the retention policy.
@@ -185,6 +839,146 @@ class Backup:
         logger.info("Rotating backups")
         rotate_base = os.path.dirname(self.config.base_dir)
         self.config.retention_policy.rotate(rotate_base)
+        for tier in Tier.from_config(self.config.tiers):
+            if os.path.isdir(tier.path):
+                self.config.retention_policy.rotate(tier.path)
+
+        if self.config.wal["enabled"]:
+            self.prune_wal_archive()
+
+    @locked
+    def migrate_tiers(self) -> List[str]:
+        """
+        Move the backups that are due to slower storage tiers, see :mod:`ctrl_z.tiers`.
+
+        :return: the new paths of the moved backups
+        """
+        root = os.path.dirname(self.config.base_dir)
+        tiers = Tier.from_config(self.config.tiers)
+        try:
+            return migrate(root, tiers, self.config.retention_policy, exclude=self.base_dir)
+        except TierError as exc:
+            raise BackupError(str(exc))
+
+    def catalogue(self) -> List[Tuple[str, str]]:
+        """
+        List the backups in the backup root and all tiers, oldest first.
+
+        :return: ``(name, path)`` pairs
+        """
+        root = os.path.dirname(self.config.base_dir)
+        return list_backups(root, Tier.from_config(self.config.tiers), self.config.retention_policy)
+
+    def find_backup(self, name: str) -> Optional[str]:
+        """
+        Find the directory of a backup by its name, in whichever tier holds it.
+        """
+        root = os.path.dirname(self.config.base_dir)
+        return find_backup(name, root, Tier.from_config(self.config.tiers), self.config.retention_policy)
+
+    @property
+    def wal_archive_dir(self) -> str:
+        return os.path.join(os.path.dirname(self.base_dir), self.config.wal["archive_dir"])
+
+    def prune_wal_archive(self):
+        """
+        Remove the archived WAL that no retained base backup needs anymore.
+
+        The base backups of all tiers count, also the ones moved to slower
+        storage.
+        """
+        if not os.path.isdir(self.wal_archive_dir):
+            return
+
+        oldest = {}
+        for _name, path in self.catalogue():
+            basebackup_dir = os.path.join(path, "basebackup")
+            if not os.path.isdir(basebackup_dir):
+                continue
+            for cluster in os.listdir(basebackup_dir):
+                info = read_info(os.path.join(basebackup_dir, cluster))
+                if info is None:
+                    continue
+                if cluster not in oldest or info["start_segment"] < oldest[cluster]:
+                    oldest[cluster] = info["start_segment"]
+
+        for cluster, segment in oldest.items():
+            archive_dir = os.path.join(self.wal_archive_dir, cluster)
+            if os.path.isdir(archive_dir):
+                prune_archive(archive_dir, segment)
+
+    def _get_cluster_name(self, db_config: dict) -> str:
+        host, port, _name = self._get_conn_params(db_config)
+        return f"{host}.{port}"
+
+    def _base_backup(self, cluster: str, db_config: dict):
+        host, port, _name = self._get_conn_params(db_config)
+        dest = os.path.join(self.base_dir, "basebackup", cluster)
+        if os.path.exists(dest):
+            logger.info("Replacing existing base backup %s", dest)
+            shutil.rmtree(dest)
+
+        args = [
+            self.config.pg_basebackup_binary,
+            f"-D{dest}",
+            "-Ft",  # tar format, compressed below
+            "-z",
+            "--checkpoint=fast",
+            "--label=ctrl-z",
+            "--verbose",
+        ]
+
+        logger.info("Taking base backup of cluster %s", cluster)
+
+        env = os.environ.copy()
+        env.update(
+            {
+                "PGHOST": host,
+                "PGPORT": str(port),
+                "PGPASSWORD": db_config["PASSWORD"],
+                "PGUSER": db_config["USER"],
+            }
+        )
+
+        (returncode, stdout, stderr) = run_command(args, env=env)
+
+        if stdout:
+            logger.info("stdout: %s", stdout.decode())
+
+        # verbose output goes to stderr, so rely on the exit code
+        if stderr:
+            logger.info("stderr: %s", stderr.decode())
+        if returncode != 0:
+            raise BackupError(stderr.decode(errors="replace").strip())
+
+        start_lsn, timeline = parse_start_point(stderr.decode())
+        segment_size = self.config.wal.get("segment_size", 16 * 1024 * 1024)
+        write_info(
+            dest,
+            cluster=cluster,
+            start_lsn=start_lsn,
+            timeline=timeline,
+            start_segment=lsn_to_segment(start_lsn, timeline, segment_size),
+            finished=datetime.now(timezone.utc).isoformat(),
+        )
+
+        logger.info("Base backup saved to %s", dest)
+
+    def _get_encryption_key(self) -> bytes:
+        if self._encryption_key is None:
+            self._encryption_key = load_key(self.config.encryption)
+        return self._encryption_key
+
+    def _get_copy_function(self, encrypt=False, decrypt=False):
+        """
+        Get the function to copy files with for :func:`shutil.copytree`.
+        """
+        if encrypt:
+            chunk_size = self.config.encryption.get("chunk_size", DEFAULT_CHUNK_SIZE)
+            return partial(encrypt_file, key=self._get_encryption_key(), chunk_size=chunk_size)
+        if decrypt:
+            return partial(decrypt_file, key=self._get_encryption_key())
+        return fast_copy
 
     def _get_conn_params(self, db_config: dict) -> tuple:
         host = db_config.get("HOST", "") or "localhost"
@@ -192,24 +986,47 @@ class Backup:
         name = db_config["NAME"]
         return host, port, name
 
-    def _get_db_filename(self, db_config: dict) -> str:
-        host, port, name = self._get_conn_params(db_config)
-        return f"{host}.{port}.{name}.custom"
+    def _get_driver(self, db_config: dict) -> DatabaseDriver:
+        try:
+            return get_driver(db_config, self.config)
+        except DriverError as exc:
+            raise BackupError(str(exc))
 
-    def _backup_database(self, db_config: dict):
-        program = self.config.pg_dump_binary
-        host, port, name = self._get_conn_params(db_config)
-        filename = self._get_db_filename(db_config)
-        outfile = os.path.join(self.db_dir, filename)
+    def _is_postgres(self, db_config: dict) -> bool:
+        return isinstance(self._get_driver(db_config), PostgresDriver)
 
-        args = [
-            program,
-            "-Fc",  # custom format, guaranteed that it can be loaded in newer Postgres versions
-            f"-f{outfile}",
-        ]
+    def _get_db_filename(self, alias: str, db_config: dict) -> str:
+        return self._get_driver(db_config).get_filename(db_config, alias)
 
-        logger.info("Dumping database %s (%s:%s)", name, host, port)
+    def _get_progress(self, label: str, **kwargs) -> Progress:
+        interval = self.config.logging.get("progress_interval", DEFAULT_INTERVAL)
+        return Progress(label, interval=interval, **kwargs)
+
+    def _run_followed(self, args: list, env: dict, progress: Progress, item_pattern) -> Tuple[bytes, bytes]:
+        """
+        Run pg_dump/pg_restore with ``--verbose``, following its progress.
 
+        :return: the stdout output, and the stderr output without the verbose chatter
+        """
+        process = subprocess.Popen([*args, "--verbose"], env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+        follower = OutputFollower(process.stderr, progress, item_pattern)
+        follower.start()
+        stdout = drain(process.stdout, BoundedBuffer()).getvalue()
+        process.stdout.close()
+        wait(process)
+        follower.join()
+        progress.finish()
+
+        stderr = follower.output
+        if process.returncode != 0 and not stderr:
+            stderr = f"{args[0]} exited with code {process.returncode}".encode()
+        return stdout, stderr
+
+    def _get_compression(self, alias: str) -> Compression:
+        return Compression.from_config((self.config.database.get("compression") or {}).get(alias))
+
+    def _get_dump_env(self, db_config: dict) -> dict:
+        host, port, name = self._get_conn_params(db_config)
         env = os.environ.copy()
         env.update(
             {
@@ -220,29 +1037,268 @@ class Backup:
                 "PGDATABASE": name,
             }
         )
+        return env
+
+    def _backup_database(self, alias: str, db_config: dict, snapshot: Optional[str] = None):
+        """
+        :param snapshot: an exported snapshot to dump, see :mod:`ctrl_z.snapshot`
+        """
+        driver = self._get_driver(db_config)
+        if not isinstance(driver, PostgresDriver):
+            self._backup_with_driver(alias, db_config, driver)
+            return
+
+        program = self.config.pg_dump_binary
+        host, port, name = self._get_conn_params(db_config)
+        filename = self._get_db_filename(alias, db_config)
+        outfile = os.path.join(self.db_dir, filename)
+        encrypt = self.config.encryption["enabled"]
+        compression = self._get_compression(alias)
 
-        process = subprocess.Popen(args, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        (stdout, stderr) = process.communicate()
+        args = [
+            program,
+            "-Fc",  # custom format, guaranteed that it can be loaded in newer Postgres versions
+            *compression.dump_args,
+        ]
+        if snapshot:
+            args.append(f"--snapshot={snapshot}")
+        streaming = encrypt or compression.external
+        if streaming:
+            # the dump is written to stdout and compressed/encrypted while streaming to disk
+            outfile += compression.extension + (ENCRYPTED_SUFFIX if encrypt else "")
+        else:
+            args.append(f"-f{outfile}")
+
+        logger.info("Dumping database %s (%s:%s)", name, host, port)
+
+        env = self._get_dump_env(db_config)
+        progress = self._get_progress(f"Dumping {name}", unit="tables")
+        if streaming:
+            stdout = b""
+            stderr = self._dump_streaming([*args, "--verbose"], env, outfile, compression, encrypt, progress)
+        else:
+            (stdout, stderr) = self._run_followed(args, env, progress, DUMP_ITEM_PATTERN)
 
         if stdout:
             logger.info("stdout: %s", stdout.decode())
 
         if stderr:
             logger.info("stderr: %s", stderr.decode())
-            raise BackupError(stderr)
+            raise BackupError(stderr.decode(errors="replace").strip())
+
+        logger.info("Database backup saved to %s", outfile)
+
+    def _backup_with_driver(self, alias: str, db_config: dict, driver: DatabaseDriver):
+        """
+        Dump a database of another engine than PostgreSQL.
+        """
+        outfile = os.path.join(self.db_dir, driver.get_filename(db_config, alias))
+        encrypt = self.config.encryption["enabled"]
+        compression = self._get_compression(alias)
+        if compression.dump_args and not compression.external:
+            logger.warning("Ignoring the pg_dump compression setting of %s, a %s database", alias, driver.name)
+            compression = Compression()
+
+        logger.info("Dumping %s database %s", driver.name, db_config["NAME"])
+        if driver.streaming:
+            outfile += compression.extension + (ENCRYPTED_SUFFIX if encrypt else "")
+            progress = self._get_progress(f"Dumping {db_config['NAME']}", unit="tables")
+            stderr = self._dump_streaming(
+                driver.get_dump_args(db_config),
+                driver.get_env(db_config),
+                outfile,
+                compression,
+                encrypt,
+                progress,
+                item_pattern=driver.dump_item_pattern,
+                verbose_pattern=driver.verbose_pattern,
+            )
+            if stderr:
+                logger.info("stderr: %s", stderr.decode())
+                raise BackupError(stderr.decode(errors="replace").strip())
+        else:
+            if compression.external:
+                logger.warning("Ignoring the external compression of %s, a %s database", alias, driver.name)
+            dest = outfile + ".partial" if encrypt else outfile
+            try:
+                driver.dump(db_config, dest)
+            except (DriverError, sqlite3.Error) as exc:
+                raise BackupError(f"Dumping {db_config['NAME']} failed: {exc}")
+            if encrypt:
+                outfile += ENCRYPTED_SUFFIX
+                copy_function = self._get_copy_function(encrypt=True)
+                if os.path.isdir(dest):
+                    shutil.copytree(dest, outfile, copy_function=copy_function)
+                    shutil.rmtree(dest)
+                else:
+                    copy_function(dest, outfile)
+                    os.remove(dest)
 
         logger.info("Database backup saved to %s", outfile)
 
-    def _restore_database(
+    def _dump_streaming(
+        self,
+        args: list,
+        env: dict,
+        outfile: str,
+        compression: Compression,
+        encrypt: bool,
+        progress: Progress,
+        item_pattern=DUMP_ITEM_PATTERN,
+        verbose_pattern=VERBOSE_PATTERN,
+    ) -> bytes:
+        """
+        Run the dump command, streaming its output through the external
+        compression command and/or the encryption into ``outfile``.
+
+        :return: the stderr output of the commands
+        """
+        chunk_size = self.config.encryption.get("chunk_size", DEFAULT_CHUNK_SIZE)
+        with open(outfile, "wb") as output, tempfile.TemporaryFile() as errors:
+            piped = encrypt or compression.external
+            dump = subprocess.Popen(args, env=env, stdout=subprocess.PIPE if piped else output, stderr=subprocess.PIPE)
+            follower = OutputFollower(dump.stderr, progress, item_pattern, verbose_pattern)
+            follower.start()
+            processes = [dump]
+            if compression.external:
+                compressor = subprocess.Popen(
+                    compression.external,
+                    stdin=processes[0].stdout,
+                    stdout=subprocess.PIPE if encrypt else output,
+                    stderr=errors,
+                )
+                # the compressor owns the pipe now, so the dump notices if it stops reading
+                processes[0].stdout.close()
+                processes.append(compressor)
+
+            if encrypt:
+                source = processes[-1].stdout
+                with EncryptingWriter(output, self._get_encryption_key(), chunk_size=chunk_size) as writer:
+                    shutil.copyfileobj(source, writer, chunk_size)
+                source.close()
+
+            for process in processes:
+                wait(process)
+            follower.join()
+            progress.finish()
+            stderr = follower.output + read_bounded(errors)
+
+        failed = [process for process in processes if process.returncode != 0]
+        if failed and not stderr:
+            stderr = f"{failed[0].args[0]} exited with code {failed[0].returncode}".encode()
+        return stderr
+
+    def _find_dump(self, filename: str, compression: Compression) -> Tuple[str, bool, bool]:
+        """
+        Find the dump file, which may be externally compressed and/or encrypted.
+
+        :return: the path to the dump, and whether it is compressed and encrypted
+        """
+        candidates = [(filename, False)]
+        if compression.extension:
+            candidates.insert(0, (filename + compression.extension, True))
+
+        for name, compressed in candidates:
+            for encrypted in (False, True):
+                path = os.path.join(self.db_dir, name + (ENCRYPTED_SUFFIX if encrypted else ""))
+                # mydumper dumps are directories
+                if os.path.exists(path):
+                    return path, compressed, encrypted
+        return os.path.join(self.db_dir, filename), False, False
+
+    def _restore_streaming(
+        self,
+        args: list,
+        env: dict,
+        backup_file: str,
+        compression: Optional[Compression],
+        decrypt: bool,
+        progress: Progress,
+        item_pattern=RESTORE_ITEM_PATTERN,
+        verbose_pattern=VERBOSE_PATTERN,
+    ) -> Tuple[int, bytes, bytes]:
+        """
+        Run the restore command, feeding it the decrypted and/or decompressed
+        ``backup_file``.
+
+        :return: the exit code of the first command that failed (0 if none
+          did), and the stdout and stderr output of the commands
+        """
+        with (
+            open(backup_file, "rb") as infile,
+            tempfile.TemporaryFile() as output,
+            tempfile.TemporaryFile() as errors,
+        ):
+            if compression is not None:
+                decompressor = subprocess.Popen(
+                    compression.decompress,
+                    stdin=subprocess.PIPE if decrypt else infile,
+                    stdout=subprocess.PIPE,
+                    stderr=errors,
+                )
+                process = subprocess.Popen(
+                    args,
+                    env=env,
+                    stdin=decompressor.stdout,
+                    stdout=output,
+                    stderr=subprocess.PIPE,
+                )
+                decompressor.stdout.close()
+                processes = [decompressor, process]
+                sink = decompressor.stdin
+            else:
+                process = subprocess.Popen(
+                    args,
+                    env=env,
+                    stdin=subprocess.PIPE,
+                    stdout=output,
+                    stderr=subprocess.PIPE,
+                )
+                processes = [process]
+                sink = process.stdin
+            follower = OutputFollower(process.stderr, progress, item_pattern, verbose_pattern)
+            follower.start()
+
+            if decrypt or compression is None:
+                # the items are counted by the follower, the bytes read of the dump here
+                progress.total_bytes = os.path.getsize(backup_file)
+                position = infile.tell()
+                if decrypt:
+                    chunks = decrypt_chunks(infile, self._get_encryption_key())
+                else:
+                    chunks = iter(partial(infile.read, DEFAULT_CHUNK_SIZE), b"")
+                try:
+                    for chunk in chunks:
+                        sink.write(chunk)
+                        progress.update(0, infile.tell() - position)
+                        position = infile.tell()
+                except BrokenPipeError:
+                    logger.error("%s stopped reading its input", processes[0].args[0])
+                finally:
+                    try:
+                        sink.close()
+                    except BrokenPipeError:
+                        pass
+
+            for process in processes:
+                wait(process)
+            follower.join()
+            progress.finish()
+            returncode = next((process.returncode for process in processes if process.returncode != 0), 0)
+            return returncode, read_bounded(output), follower.output + read_bounded(errors)
+
+    def _plan_restore(
         self,
         alias: str,
         db_config: dict,
         source_db_name: Optional[str] = None,
         source_db_host: Optional[str] = None,
         source_db_port: Optional[str] = None,
-    ):
-        program = self.config.pg_restore_binary
-
+        profile: Optional[RestoreProfile] = None,
+    ) -> RestorePlan:
+        """
+        Find the dump to restore into the database of ``alias``.
+        """
         source_db_config = db_config.copy()
         if source_db_name:
             source_db_config["NAME"] = source_db_name
@@ -251,23 +1307,48 @@ class Backup:
         if source_db_port:
             source_db_config["PORT"] = source_db_port
 
-        host, port, name = self._get_conn_params(db_config)
-        filename = self._get_db_filename(source_db_config)
-        backup_file = os.path.join(self.db_dir, filename)
-
-        if not os.path.isfile(backup_file):
+        driver = self._get_driver(db_config)
+        if profile is not None and not isinstance(driver, PostgresDriver):
+            raise BackupError(f"Database '{alias}' is not PostgreSQL, restore profiles need pg_restore")
+        filename = driver.get_filename(source_db_config, alias)
+        compression = self._get_compression(alias)
+        backup_file, compressed, encrypted = self._find_dump(filename, compression)
+        if encrypted:
+            # fail early on a missing key, the dump is decrypted while streaming to pg_restore
+            self._get_encryption_key()
+
+        if not os.path.exists(backup_file):
             raise BackupError(
                 f"Dump file '{backup_file}' does not exist. Possibly you need "
                 "to provide the alias mapping if you're restoring to a "
                 "different database name."
             )
+        return RestorePlan(
+            alias,
+            db_config,
+            backup_file,
+            compression=compression if compressed else None,
+            encrypted=encrypted,
+            row_counts_file=os.path.join(self.db_dir, filename + ROW_COUNTS_SUFFIX),
+            driver=driver,
+            profile=profile,
+        )
+
+    def _restore_database(self, plan: RestorePlan):
+        if plan.driver is not None and not isinstance(plan.driver, PostgresDriver):
+            self._restore_with_driver(plan)
+            return
+
+        program = self.config.pg_restore_binary
+        db_config, backup_file = plan.db_config, plan.backup_file
+        streaming = plan.compression is not None or plan.encrypted
+
+        host, port, name = self._get_conn_params(db_config)
 
         dropdb_args = [self.config.dropdb_binary, "--if-exists", db_config["NAME"]]
 
         createdb_args = [self.config.createdb_binary, db_config["NAME"]]
 
-        args = [program, "-d%s" % db_config["NAME"], "-O", backup_file]
-
         logger.info("Restoring database %s (%s:%s)", name, host, port)
 
         env = os.environ.copy()
@@ -281,48 +1362,343 @@ class Backup:
             }
         )
 
-        logger.info("Dropping the target database, if it exists")
+        # selected before the database is dropped, a bad profile leaves it intact
+        with self._use_list(plan, env) as (use_list, entries):
+            args = [program, "-d%s" % db_config["NAME"], "-O"]
+            if use_list is not None:
+                args.append(f"--use-list={use_list}")
+            if not streaming:
+                args.append(backup_file)
 
-        for conn in connections.all():
-            conn.close()
+            logger.info("Dropping the target database, if it exists")
 
-        process = subprocess.Popen(dropdb_args, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        (stdout, stderr) = process.communicate()
+            (_returncode, stdout, stderr) = run_command(dropdb_args, env=env)
 
-        if stdout:  # noqa
-            logger.info("stdout: %s", stdout.decode())
+            if stdout:  # noqa
+                logger.info("stdout: %s", stdout.decode())
 
-        if stderr:  # noqa
-            logger.info("stderr: %s", stderr.decode())
+            if stderr:  # noqa
+                logger.info("stderr: %s", stderr.decode())
 
-        logger.info("Creating the target database")
-        process = subprocess.Popen(createdb_args, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        (stdout, stderr) = process.communicate()
+            logger.info("Creating the target database")
+            (_returncode, stdout, stderr) = run_command(createdb_args, env=env)
 
-        if stdout:  # noqa
-            logger.info("stdout: %s", stdout.decode())
+            if stdout:  # noqa
+                logger.info("stdout: %s", stdout.decode())
 
-        if stderr:  # noqa
-            logger.info("stderr: %s", stderr.decode())
+            if stderr:  # noqa
+                logger.info("stderr: %s", stderr.decode())
 
-        logger.info("Restoring the target database")
-        process = subprocess.Popen(args, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
-        (stdout, stderr) = process.communicate()
+            logger.info("Restoring the target database")
+            progress = self._get_progress(f"Restoring {db_config['NAME']}", unit="TOC entries")
+            if streaming:
+                (_returncode, stdout, stderr) = self._restore_streaming(
+                    [*args, "--verbose"],
+                    env,
+                    backup_file,
+                    plan.compression,
+                    decrypt=plan.encrypted,
+                    progress=progress,
+                )
+            else:
+                progress.total_items = entries if use_list is not None else self._count_toc_entries(backup_file, env)
+                (stdout, stderr) = self._run_followed(args, env, progress, RESTORE_ITEM_PATTERN)
 
-        if stdout:
-            logger.info("stdout: %s", stdout.decode())
+            if stdout:
+                logger.info("stdout: %s", stdout.decode())
 
-        if stderr:
-            logger.info("stderr: %s", stderr.decode())
+            if stderr:
+                logger.info("stderr: %s", stderr.decode())
 
-        # test if the restore was okay
-        test_function = import_string(self.config.database["test_function"])
-        if not test_function(alias):
-            raise BackupError("Restore of '%s' database failed" % name)
+            logger.info("Database backup %s restored", backup_file)
 
-        logger.info("Database backup %s restored", backup_file)
+    def _restore_with_driver(self, plan: RestorePlan):
+        """
+        Restore a database of another engine than PostgreSQL.
+        """
+        driver, db_config = plan.driver, plan.db_config
+        logger.info("Restoring %s database %s", driver.name, db_config["NAME"])
+        try:
+            driver.prepare_restore(db_config)
+            if driver.streaming:
+                progress = self._get_progress(f"Restoring {db_config['NAME']}", unit="statements")
+                args = driver.get_restore_args(db_config)
+                (returncode, stdout, stderr) = self._restore_streaming(
+                    args,
+                    driver.get_env(db_config),
+                    plan.backup_file,
+                    plan.compression,
+                    decrypt=plan.encrypted,
+                    progress=progress,
+                    item_pattern=None,
+                    verbose_pattern=driver.verbose_pattern,
+                )
+                if stdout:
+                    logger.info("stdout: %s", stdout.decode())
+                if returncode != 0:
+                    raise DriverError(stderr.decode().strip() or f"{args[0]} exited with code {returncode}")
+                if stderr:
+                    logger.info("stderr: %s", stderr.decode())
+            else:
+                with self._decrypted(plan) as path:
+                    driver.restore(db_config, path)
+        except (DriverError, sqlite3.Error) as exc:
+            raise BackupError(f"Restoring {db_config['NAME']} failed: {exc}")
+
+        logger.info("Database backup %s restored", plan.backup_file)
 
-    def _backup_directory(self, directory: str):
+    @contextmanager
+    def _decrypted(self, plan: RestorePlan):
+        """
+        Yield the path of the dump, decrypted into a temporary location if needed.
+        """
+        if not plan.encrypted:
+            yield plan.backup_file
+            return
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            path = os.path.join(tmpdir, os.path.basename(plan.backup_file)[: -len(ENCRYPTED_SUFFIX)])
+            copy_function = self._get_copy_function(decrypt=True)
+            if os.path.isdir(plan.backup_file):
+                shutil.copytree(plan.backup_file, path, copy_function=copy_function)
+            else:
+                copy_function(plan.backup_file, path)
+            yield path
+
+    def _iter_dump(self, plan: RestorePlan, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        """
+        Yield the content of a dump, decrypted and decompressed.
+        """
+        with open(plan.backup_file, "rb") as infile:
+            if plan.encrypted:
+                chunks = decrypt_chunks(infile, self._get_encryption_key())
+            else:
+                chunks = iter(partial(infile.read, chunk_size), b"")
+
+            if plan.compression is None:
+                yield from chunks
+                return
+
+            with tempfile.TemporaryFile() as errors:
+                decompressor = subprocess.Popen(
+                    plan.compression.decompress,
+                    stdin=subprocess.PIPE,
+                    stdout=subprocess.PIPE,
+                    stderr=errors,
+                )
+                failures = []
+
+                def feed():
+                    try:
+                        for chunk in chunks:
+                            decompressor.stdin.write(chunk)
+                    except (EncryptionError, OSError) as exc:
+                        failures.append(exc)
+                    finally:
+                        try:
+                            decompressor.stdin.close()
+                        except BrokenPipeError:
+                            pass
+
+                feeder = threading.Thread(target=feed, daemon=True)
+                feeder.start()
+                try:
+                    yield from iter(partial(decompressor.stdout.read, chunk_size), b"")
+                finally:
+                    # also when the consumer stops early
+                    decompressor.stdout.close()
+                    wait(decompressor)
+                    feeder.join()
+
+                if failures and not isinstance(failures[0], BrokenPipeError):
+                    raise failures[0]
+                if decompressor.returncode != 0:
+                    message = read_bounded(errors).decode().strip()
+                    raise BackupError(f"{plan.compression.decompress[0]} failed: {message}")
+
+    def _check_dump(self, plan: RestorePlan) -> Optional[str]:
+        """
+        Check that a dump can be read by pg_restore.
+
+        Encrypted and compressed dumps are read completely, which verifies their
+        authentication and checksums as well.
+
+        :return: the error, if the dump is not usable
+        """
+        if plan.driver is not None and not isinstance(plan.driver, PostgresDriver):
+            return self._check_driver_dump(plan)
+
+        args = [self.config.pg_restore_binary, "--list"]
+        if plan.compression is None and not plan.encrypted:
+            (returncode, _stdout, stderr) = run_command([*args, plan.backup_file])
+            if returncode != 0:
+                return stderr.decode().strip() or f"pg_restore exited with code {returncode}"
+            return None
+
+        with tempfile.TemporaryFile() as errors:
+            lister = subprocess.Popen(args, stdin=subprocess.PIPE, stdout=subprocess.DEVNULL, stderr=errors)
+            sink = lister.stdin
+            try:
+                for chunk in self._iter_dump(plan):
+                    if sink is None:
+                        continue
+                    try:
+                        sink.write(chunk)
+                    except BrokenPipeError:
+                        # pg_restore is done with the TOC, the rest is still verified
+                        sink = None
+            except (BackupError, EncryptionError) as exc:
+                lister.kill()
+                wait(lister)
+                return str(exc)
+            finally:
+                try:
+                    lister.stdin.close()
+                except BrokenPipeError:
+                    pass
+
+            wait(lister)
+            if lister.returncode != 0:
+                return read_bounded(errors).decode().strip() or f"pg_restore exited with code {lister.returncode}"
+        return None
+
+    def _check_driver_dump(self, plan: RestorePlan) -> Optional[str]:
+        driver = plan.driver
+        try:
+            if driver.streaming:
+                tail = b""
+                for chunk in self._iter_dump(plan):
+                    tail = (tail + chunk)[-DUMP_TAIL_SIZE:]
+                return None if driver.is_complete(tail) else "the dump is incomplete"
+            with self._decrypted(plan) as path:
+                return driver.check(path)
+        except (BackupError, EncryptionError) as exc:
+            return str(exc)
+
+    def _restore_scratch(self, plan: RestorePlan):
+        """
+        Restore a dump into a scratch database next to the target, and run the
+        ``test_function`` on it. The scratch database is dropped afterwards.
+        """
+        scratch_alias = f"{plan.alias}_ctrl_z_preflight"
+        scratch_config = {**plan.db_config, "NAME": f"{plan.db_config['NAME']}_ctrl_z_preflight"}
+        connections.settings[scratch_alias] = {**connections.settings[plan.alias], "NAME": scratch_config["NAME"]}
+
+        logger.info("Test restoring %s into scratch database %s", plan.backup_file, scratch_config["NAME"])
+        scratch_plan = RestorePlan(
+            scratch_alias,
+            scratch_config,
+            plan.backup_file,
+            compression=plan.compression,
+            encrypted=plan.encrypted,
+            row_counts_file=plan.row_counts_file,
+        )
+        try:
+            self._restore_database(scratch_plan)
+            self.verify_databases([scratch_plan])
+        except BackupError as exc:
+            raise BackupError(f"Pre-restore check of {plan.backup_file} in a scratch database failed: {exc}")
+        finally:
+            connections[scratch_alias].close()
+            del connections[scratch_alias]
+            del connections.settings[scratch_alias]
+            run_command(
+                [self.config.dropdb_binary, "--if-exists", scratch_config["NAME"]],
+                env=self._get_dump_env(scratch_config),
+            )
+
+    @contextmanager
+    def _use_list(self, plan: RestorePlan, env: dict):
+        """
+        Write the entries selected by the restore profile of ``plan`` to a
+        ``pg_restore --use-list`` file.
+
+        :return: the path of the file and the amount of entries to restore,
+          ``None`` if the plan has no profile
+        """
+        if plan.profile is None:
+            yield None, None
+            return
+
+        with tempfile.TemporaryFile() as listing:
+            self._list_toc(plan, env, listing)
+            listing.seek(0)
+            selection = select_entries(listing, plan.profile)
+        modes = list(selection.tables.values())
+        logger.info(
+            "Restore profile of %s: %d tables with data, %d without, %d skipped, leaving out %d of %d TOC entries",
+            plan.alias,
+            modes.count("full"),
+            modes.count("schema_only"),
+            modes.count("skip"),
+            selection.dropped,
+            selection.entries + selection.dropped,
+        )
+        with tempfile.NamedTemporaryFile(prefix="ctrl-z-", suffix=".list") as use_list:
+            selection.write(use_list)
+            use_list.flush()
+            yield use_list.name, selection.entries
+
+    def _list_toc(self, plan: RestorePlan, env: dict, outfile):
+        """
+        Write the ``pg_restore --list --verbose`` output of a dump, with the
+        dependencies of the entries, to ``outfile``.
+        """
+        args = [self.config.pg_restore_binary, "--list", "--verbose"]
+        streaming = plan.compression is not None or plan.encrypted
+        with tempfile.TemporaryFile() as errors:
+            process = subprocess.Popen(
+                args if streaming else [*args, plan.backup_file],
+                env=env,
+                stdin=subprocess.PIPE if streaming else subprocess.DEVNULL,
+                stdout=outfile,
+                stderr=errors,
+            )
+            if streaming:
+                chunks = self._iter_dump(plan)
+                try:
+                    for chunk in chunks:
+                        process.stdin.write(chunk)
+                except BrokenPipeError:
+                    # pg_restore is done with the TOC
+                    pass
+                finally:
+                    chunks.close()
+                    try:
+                        process.stdin.close()
+                    except BrokenPipeError:
+                        pass
+            wait(process)
+            if process.returncode != 0:
+                raise BackupError(
+                    f"Could not list the contents of {plan.backup_file}: {read_bounded(errors).decode().strip()}"
+                )
+
+    def _count_toc_entries(self, backup_file: str, env: dict) -> Optional[int]:
+        with tempfile.TemporaryFile() as errors:
+            process = subprocess.Popen(
+                [self.config.pg_restore_binary, "--list", backup_file],
+                env=env,
+                stdout=subprocess.PIPE,
+                stderr=errors,
+            )
+            # the listing has a line per TOC entry, so count while reading
+            count = count_toc_entries(process.stdout)
+            process.stdout.close()
+            wait(process)
+            if process.returncode != 0:
+                logger.warning("Could not list the contents of %s: %s", backup_file, read_bounded(errors).decode())
+                return None
+        return count
+
+    def _backup_directory(
+        self, directory: str, feed: Optional[ChangeFeed] = None, source: Optional[str] = None
+    ) -> Optional[int]:
+        """
+        :param source: a frozen copy of ``directory`` to copy from, see :mod:`ctrl_z.snapshot`
+        :return: the amount of bytes copied, None if nothing was backed up
+        """
+        source = source or directory
         if not os.path.exists(directory):
             logger.info("Source directory %s does not exist, skipping", directory)
             return
@@ -342,9 +1718,117 @@ class Backup:
                 logger.info("Skipping %s", dest)
                 return
 
-        shutil.copytree(directory, dest)
+        path_filter = self._get_path_filter(directory)
+        encrypt = self.config.encryption["enabled"]
+        progress = self._get_progress(f"Copying {directory}")
+        copy_function = self._get_copy_function(encrypt=encrypt)
+        encrypted_marker = os.path.join(self.files_dir, f"{dirname}.encrypted")
+        started = datetime.now(timezone.utc)
+
+        checksums = self.config.files.get("checksums")
+        hash_workers = self.config.files.get("hash_workers", 4)
+        walk_workers = self.config.files.get("walk_workers", DEFAULT_WALK_WORKERS)
+        digests = None
+
+        last_copy = self._get_previous_copy(dirname)
+        previous = last_copy if feed is not None else None
+        if previous is not None and os.path.exists(f"{previous[0]}.encrypted") != encrypt:
+            logger.info("The previous backup of %s was made with different encryption settings", directory)
+            previous = None
+
+        if previous is not None and feed.covers(previous[1]):
+            self._copy_changes(
+                source,
+                previous[0],
+                dest,
+                feed.get_changes(directory),
+                path_filter,
+                copy_function=progress.wrap_copy(copy_function),
+            )
+            # the unchanged files are linked, the previous totals are close enough
+            totals = self._read_totals(previous[0])
+        else:
+            if feed is not None:
+                logger.info("Change feed does not cover all changes since the previous backup, copying everything")
+            # estimated from the previous copy, a walk just to count the files would double the work
+            if last_copy is not None:
+                progress.total_items, progress.total_bytes = self._read_totals(last_copy[0])
+            entries = walk_tree(source, path_filter=path_filter, workers=walk_workers)
+            copied = progress.track(iter_copy_tree(entries, dest, copy_function=copy_function))
+            if checksums:
+                # hash the files while they are copied, in the page cache, from the same walk
+                with HashCache(self.hash_cache_path) as cache:
+                    digests = hash_tree(source, cache=cache, workers=hash_workers, entries=copied)
+            else:
+                for _entry in copied:
+                    pass
+            totals = progress.items, progress.bytes
+        progress.finish()
+        self._write_totals(dest, *totals)
+
+        if encrypt:
+            open(encrypted_marker, "w").close()
+        elif os.path.exists(encrypted_marker):
+            os.remove(encrypted_marker)
+
+        # marks the copy as complete, and usable as base for incremental copies
+        with open(os.path.join(self.files_dir, f"{dirname}.started"), "w") as marker:
+            marker.write(started.isoformat())
+
+        if checksums:
+            manifest = self._get_manifest_path(dirname)
+            logger.info("Writing checksums of %s to %s", directory, manifest)
+            if digests is None:
+                with HashCache(self.hash_cache_path) as cache:
+                    digests = hash_tree(source, cache=cache, workers=hash_workers, path_filter=path_filter)
+            write_manifest(manifest, digests)
 
         logger.info("Backed up %s to %s", directory, dest)
+        return progress.bytes
+
+    def _copy_changes(
+        self,
+        directory: str,
+        previous: str,
+        dest: str,
+        changes: List[str],
+        path_filter: PathFilter,
+        copy_function=fast_copy,
+    ):
+        """
+        Build the copy of ``directory`` from the previous copy and the changed paths.
+
+        Unchanged files are hard-linked to the previous backup. Changed files
+        are unlinked before they are copied, so the previous backup is never
+        modified.
+        """
+        logger.info("Copying %d changed paths on top of %s", len(changes), previous)
+        shutil.copytree(previous, dest, copy_function=link_or_copy)
+
+        for relpath in changes:
+            src_path = os.path.join(directory, relpath)
+            dest_path = os.path.join(dest, relpath)
+
+            if os.path.isdir(dest_path) and not os.path.islink(dest_path):
+                shutil.rmtree(dest_path)
+            elif os.path.lexists(dest_path):
+                os.remove(dest_path)
+
+            is_dir = os.path.isdir(src_path)
+            size = os.path.getsize(src_path) if os.path.isfile(src_path) else None
+            if path_filter.is_excluded(relpath, is_dir=is_dir, size=size):
+                continue
+
+            if is_dir:
+                shutil.copytree(
+                    src_path,
+                    dest_path,
+                    ignore=path_filter.get_ignore(directory) if path_filter else None,
+                    copy_function=copy_function,
+                )
+            elif size is not None:
+                os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+                copy_function(src_path, dest_path)
 
     def _restore_directory(self, dest: str):
         dirname = os.path.basename(dest)
@@ -355,6 +1839,17 @@ class Backup:
 
         logger.info("Restoring %s to %s", src, dest)
 
+        path_filter = self._get_path_filter(dest)
+        progress = self._get_progress(f"Restoring {dest}")
+        copy_function = self._get_copy_function(decrypt=os.path.exists(f"{src}.encrypted"))
+        manifest = self._get_manifest_path(dirname)
+        if self.config.files.get("checksums") and os.path.exists(manifest) and os.path.isdir(dest):
+            digests = read_manifest(manifest)
+            self._sync_directory(src, dest, digests, path_filter, progress, copy_function=copy_function)
+            progress.finish()
+            logger.info("Restored %s to %s", src, dest)
+            return
+
         if os.path.exists(dest):
             logger.debug("Target destination exists, removing...")
 
@@ -363,28 +1858,129 @@ class Backup:
             try:
                 shutil.rmtree(dest)
             except OSError:
-                for item in os.listdir(dest):
-                    full_path = os.path.join(dest, item)
-                    if os.path.isdir(full_path):
-                        shutil.rmtree(full_path)
-                    else:
-                        os.remove(full_path)
+                # walk_tree descends and skips special files, only the top level is listed here
+                with os.scandir(dest) as entries:
+                    for entry in entries:
+                        if entry.is_dir(follow_symlinks=False):
+                            shutil.rmtree(entry.path)
+                        else:
+                            os.remove(entry.path)
 
         # similarly to above, tree copy may fail if we couldn't clean up properly
         # since the dest may not exist
         if not os.path.exists(dest):
             os.mkdir(dest)
 
-        for item in os.listdir(src):
-            full_sr_path = os.path.join(src, item)
-            full_dest_path = os.path.join(dest, item)
-            if os.path.isdir(full_sr_path):
-                shutil.copytree(full_sr_path, full_dest_path)
-            else:
-                shutil.copy(full_sr_path, full_dest_path)
+        walk_workers = self.config.files.get("walk_workers", DEFAULT_WALK_WORKERS)
+        progress.total_items, progress.total_bytes = self._read_totals(src)
+        entries = walk_tree(src, path_filter=path_filter, workers=walk_workers)
+        for _entry in progress.track(iter_copy_tree(entries, dest, copy_function=copy_function)):
+            pass
+        progress.finish()
 
         logger.info("Restored %s to %s", src, dest)
 
+    def _restore_matching(self, dest: str, patterns: List[str]):
+        """
+        Restore only the files matching the patterns, without removing anything.
+
+        Only the subtrees of the backup that can hold matches are walked, so
+        the work is proportional to the restored subset.
+        """
+        dirname = os.path.basename(dest)
+        src = os.path.join(self.files_dir, dirname)
+        if not os.path.exists(src):
+            logger.info("Not restoring %s - directory doesn't exist!", src)
+            return
+
+        patterns = expand_patterns(patterns)
+        matcher = PathFilter(include=patterns)
+        path_filter = self._get_path_filter(dest)
+
+        walk_workers = self.config.files.get("walk_workers", DEFAULT_WALK_WORKERS)
+        matches = []
+        for base in get_base_dirs(patterns):
+            top = os.path.join(src, base)
+            if os.path.isfile(top):
+                relpath = os.path.normpath(base)
+                candidates = [] if path_filter.is_excluded(relpath) else [WalkEntry(top, relpath, False, os.stat(top))]
+            elif os.path.isdir(top):
+                reldir = os.path.normpath(base) if base else ""
+                candidates = walk_tree(top, path_filter=path_filter, workers=walk_workers, prefix=reldir)
+            else:
+                continue
+            for entry in candidates:
+                if not entry.is_dir and not matcher.is_excluded(entry.relpath):
+                    matches.append(entry)
+
+        logger.info("Restoring %d files matching %s from %s to %s", len(matches), ", ".join(patterns), src, dest)
+        progress = self._get_progress(f"Restoring {dest}")
+        progress.total_items = len(matches)
+        progress.total_bytes = measure(matches)[1]
+        copy_function = self._get_copy_function(decrypt=os.path.exists(f"{src}.encrypted"))
+        for entry in matches:
+            dest_path = os.path.join(dest, entry.relpath)
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            copy_function(entry.path, dest_path)
+            progress.update(1, entry.stat.st_size)
+        progress.finish()
+
+        logger.info("Restored %d files to %s", len(matches), dest)
+
+    def _sync_directory(
+        self,
+        src: str,
+        dest: str,
+        digests: dict,
+        path_filter: PathFilter,
+        progress: Progress,
+        copy_function=fast_copy,
+    ):
+        """
+        Restore only the files that differ from the backup, according to the
+        checksum manifest, and remove the files that are not in the backup.
+        """
+        candidates = [
+            os.path.join(dest, relpath) for relpath in digests if os.path.isfile(os.path.join(dest, relpath))
+        ]
+        with HashCache(self.hash_cache_path) as cache:
+            current = hash_files(candidates, cache=cache, workers=self.config.files.get("hash_workers", 4))
+
+        copied = 0
+        for relpath, digest in digests.items():
+            dest_path = os.path.join(dest, relpath)
+            if current.get(dest_path) == digest:
+                continue
+            size = os.path.getsize(os.path.join(src, relpath))
+            if path_filter.is_excluded(relpath, size=size):
+                continue
+            os.makedirs(os.path.dirname(dest_path), exist_ok=True)
+            copy_function(os.path.join(src, relpath), dest_path)
+            progress.update(1, size)
+            copied += 1
+
+        removed = 0
+        directories = []
+        walk_workers = self.config.files.get("walk_workers", DEFAULT_WALK_WORKERS)
+        # symlinks are left alone, their targets may be outside of the directory;
+        # excluded files, such as caches, as well
+        for entry in walk_tree(dest, path_filter=path_filter, workers=walk_workers, follow_symlinks=False):
+            if entry.is_dir:
+                if not os.path.isdir(os.path.join(src, entry.relpath)):
+                    directories.append(entry.path)
+            elif entry.relpath not in digests:
+                os.remove(entry.path)
+                removed += 1
+        # subdirectories are walked after their parents
+        for path in reversed(directories):
+            try:
+                os.rmdir(path)
+            except OSError:
+                # not empty
+                continue
+
+        logger.info("Copied %d changed files, removed %d files not in the backup", copied, removed)
+
 
 def configure_logging(config: Config):
     level = config.logging["level"]
@@ -416,8 +2012,15 @@ def configure_logging(config: Config):
                     "formatter": "default",
                     "filename": logfile,
                 },
+                "report": {
+                    "level": level,
+                    "()": "ctrl_z.report.ReportHandler",
+                    "formatter": "default",
+                    "tail_lines": config.report.get("tail_lines", 100),
+                    "logfile": logfile,
+                },
             },
-            "loggers": {"ctrl_z": {"level": level, "handlers": ["console", "file"]}},
+            "loggers": {"ctrl_z": {"level": level, "handlers": ["console", "file", "report"]}},
             "disable_existing_loggers": False,
         }
     )
@@ -0,0 +1,120 @@
+"""
+Benchmark pg_dump compression settings on a sample of a database.
+
+The largest tables that fit in the sample size are dumped once per candidate
+setting. The fastest candidate whose output is at most ``max_ratio`` of the
+uncompressed dump is recommended for the ``database.compression`` config.
+"""
+import logging
+import os
+import subprocess
+import tempfile
+import time
+from typing import List, Optional
+
+from .compression import CompressionError, get_dump_args
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_CANDIDATES = ["gzip:1", "gzip:6", "lz4:1", "zstd:1", "zstd:3", "zstd:9"]
+
+DEFAULT_SAMPLE_SIZE = 256 * 1024 * 1024
+
+BASELINE = "none"
+
+TABLE_SIZES_SQL = """
+SELECT n.nspname, c.relname, pg_total_relation_size(c.oid)
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+WHERE c.relkind IN ('r', 'm')
+  AND n.nspname NOT IN ('pg_catalog', 'information_schema')
+  AND n.nspname NOT LIKE 'pg_toast%%'
+ORDER BY 3 DESC
+"""
+
+
+class BenchmarkResult:
+    __slots__ = ["spec", "seconds", "size"]
+
+    def __init__(self, spec: str, seconds: float, size: int):
+        self.spec = spec
+        self.seconds = seconds
+        self.size = size
+
+    def __repr__(self):
+        return f"BenchmarkResult(spec={self.spec!r}, seconds={self.seconds:.2f}, size={self.size})"
+
+
+def select_sample(table_sizes: List[tuple], sample_size: int) -> List[str]:
+    """
+    Pick the largest tables that together fit in ``sample_size`` bytes.
+
+    :param table_sizes: ``(schema, table, size)`` tuples, largest first
+    :return: qualified table names, usable as ``pg_dump -t``
+    """
+    sample, remaining = [], sample_size
+    for schema, table, size in table_sizes:
+        if size <= remaining:
+            sample.append(f'"{schema}"."{table}"')
+            remaining -= size
+    if not sample and table_sizes:
+        # everything is larger than the sample size, settle for the smallest table
+        schema, table, _size = table_sizes[-1]
+        sample.append(f'"{schema}"."{table}"')
+    return sample
+
+
+def run_candidate(args: List[str], env: dict, spec: str) -> Optional[BenchmarkResult]:
+    """
+    Dump the sample with a single compression setting.
+
+    :return: the result, or None if pg_dump does not support the setting
+    """
+    with tempfile.TemporaryDirectory() as tmpdir:
+        outfile = os.path.join(tmpdir, "sample.custom")
+        start = time.monotonic()
+        process = subprocess.run(
+            [*args, *get_dump_args(spec), f"-f{outfile}"],
+            env=env,
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.PIPE,
+        )
+        seconds = time.monotonic() - start
+        if process.returncode != 0:
+            logger.warning("Skipping %s: %s", spec, process.stderr.decode().strip())
+            return None
+        return BenchmarkResult(spec, seconds, os.path.getsize(outfile))
+
+
+def benchmark(args: List[str], env: dict, tables: List[str], candidates: List[str]) -> List[BenchmarkResult]:
+    """
+    Dump the sample tables with every candidate and the uncompressed baseline.
+
+    :param args: the pg_dump command, without compression and output arguments
+    """
+    for spec in candidates:
+        # validate before spending time on dumps
+        get_dump_args(spec)
+
+    args = [*args, *(f"-t{table}" for table in tables)]
+    results = []
+    for spec in [BASELINE, *(spec for spec in candidates if spec != BASELINE)]:
+        result = run_candidate(args, env, spec)
+        if result is not None:
+            logger.info("%s: %.2fs, %d bytes", spec, result.seconds, result.size)
+            results.append(result)
+    return results
+
+
+def recommend(results: List[BenchmarkResult], max_ratio: float) -> Optional[BenchmarkResult]:
+    """
+    Get the fastest result that compresses to at most ``max_ratio`` of the baseline.
+    """
+    baseline = next((result for result in results if result.spec == BASELINE), None)
+    if baseline is None:
+        raise CompressionError("The uncompressed baseline dump failed")
+
+    eligible = [result for result in results if result.size <= baseline.size * max_ratio]
+    if not eligible:
+        return None
+    return min(eligible, key=lambda result: result.seconds)
@@ -0,0 +1,68 @@
+"""
+Changed-file feeds for incremental file backups.
+
+A feed is a text file listing the paths that changed, one absolute path per
+line, produced by the application or by a filesystem watcher. Header lines
+describe which period the feed covers:
+
+.. code-block:: text
+
+    # since: 2018-06-27T02:00:00+00:00
+    /srv/media/uploads/report.pdf
+    /srv/media/uploads/customer-123
+
+A ``# gap`` line marks that events were lost (e.g. an inotify queue overflow),
+in which case the feed cannot be trusted and a full scan is done. A ``since``
+timestamp without timezone is in UTC.
+"""
+import logging
+import os
+from datetime import datetime, timezone
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class ChangeFeed:
+    __slots__ = ["since", "paths", "has_gaps"]
+
+    def __init__(self, since: Optional[datetime], paths: List[str], has_gaps: bool = False):
+        self.since = since
+        self.paths = paths
+        self.has_gaps = has_gaps
+
+    @classmethod
+    def from_file(cls, path: str):
+        since, has_gaps, paths = None, False, []
+        with open(path, "r") as feed:
+            for line in feed:
+                line = line.rstrip("\n")
+                if not line:
+                    continue
+                if line.startswith("#"):
+                    header = line.lstrip("#").strip()
+                    if header.startswith("since:"):
+                        since = datetime.fromisoformat(header[len("since:") :].strip())
+                        if since.tzinfo is None:
+                            since = since.replace(tzinfo=timezone.utc)
+                    elif header == "gap":
+                        has_gaps = True
+                    continue
+                paths.append(os.path.normpath(line))
+        return cls(since=since, paths=paths, has_gaps=has_gaps)
+
+    def covers(self, moment: datetime) -> bool:
+        """
+        Check if the feed contains all the changes made since ``moment``.
+        """
+        if self.has_gaps or self.since is None:
+            return False
+        return self.since <= moment
+
+    def get_changes(self, directory: str) -> List[str]:
+        """
+        Return the changed paths within ``directory``, relative to it.
+        """
+        directory = os.path.normpath(directory)
+        prefix = directory + os.sep
+        return sorted({os.path.relpath(path, directory) for path in self.paths if path.startswith(prefix)})
@@ -0,0 +1,96 @@
+"""
+Compression settings for database dumps.
+
+Per database alias, either pg_dump compresses the custom format archive
+itself, or the archive is dumped uncompressed and streamed through an external
+compression command:
+
+.. code-block:: yaml
+
+    database:
+      compression:
+        default: zstd:3  # gzip[:level], lz4[:level], zstd[:level] or none
+        secondary:
+          external: zstd -T0 -3 -c
+          decompress: zstd -d -c
+          extension: .zst
+"""
+import os
+import re
+import shlex
+from typing import List, Optional, Union
+
+METHODS = ("gzip", "lz4", "zstd")
+
+SPEC_PATTERN = re.compile(r"^(?P<method>[a-z0-9]+)(:(?P<level>[0-9]+))?$")
+
+
+class CompressionError(Exception):
+    pass
+
+
+def get_dump_args(spec: str) -> List[str]:
+    """
+    Translate a ``method[:level]`` spec to pg_dump arguments.
+
+    gzip is passed as plain level, which every pg_dump version understands;
+    lz4 and zstd require pg_dump 16 or newer.
+    """
+    match = SPEC_PATTERN.match(str(spec))
+    if match is None:
+        raise CompressionError(f"Invalid compression '{spec}', expected method[:level]")
+
+    method, level = match.group("method"), match.group("level")
+    if method == "none":
+        return ["-Z0"]
+    if method not in METHODS:
+        raise CompressionError(f"Unknown compression method '{method}', options are: none, {', '.join(METHODS)}")
+    if method == "gzip":
+        return [f"-Z{level}"] if level is not None else []
+    return [f"--compress={spec}"]
+
+
+class Compression:
+    __slots__ = ["dump_args", "external", "decompress", "extension"]
+
+    def __init__(
+        self,
+        dump_args: Optional[List[str]] = None,
+        external: Optional[List[str]] = None,
+        decompress: Optional[List[str]] = None,
+        extension: str = "",
+    ):
+        self.dump_args = dump_args or []
+        self.external = external
+        self.decompress = decompress
+        self.extension = extension
+
+    def __repr__(self):
+        return f"Compression(dump_args={self.dump_args!r}, external={self.external!r})"
+
+    @classmethod
+    def from_config(cls, config: Union[None, str, dict]):
+        """
+        Build the compression from the config of a single alias.
+        """
+        if config is None:
+            # pg_dump's default
+            return cls()
+
+        if isinstance(config, str):
+            return cls(dump_args=get_dump_args(config))
+
+        if "external" not in config:
+            raise CompressionError("External compression requires the 'external' command")
+        if "decompress" not in config:
+            raise CompressionError("External compression requires the 'decompress' command")
+
+        external = shlex.split(config["external"])
+        return cls(
+            # the archive itself is not compressed, the external command does that
+            dump_args=["-Z0"],
+            external=external,
+            decompress=shlex.split(config["decompress"]),
+            # restore recognizes externally compressed dumps by their extension
+            extension=config.get("extension") or f".{os.path.basename(external[0])}",
+        )
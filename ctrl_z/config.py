@@ -1,3 +1,4 @@
+import copy
 import logging
 import os
 
@@ -24,11 +25,56 @@ class Config:
         "pg_restore_binary",
         "dropdb_binary",
         "createdb_binary",
+        "pg_basebackup_binary",
+        "mysqldump_binary",
+        "mysql_binary",
+        "mydumper_binary",
+        "myloader_binary",
+        "wal",
+        "encryption",
+        "snapshot",
+        "serve",
+        "lock",
+        "tiers",
+        "retry",
+        "restore_profiles",
     ]
 
+    # options added after the initial config format, so that existing config
+    # files keep working
+    DEFAULTS = {
+        "pg_basebackup_binary": "pg_basebackup",
+        "mysqldump_binary": "mysqldump",
+        "mysql_binary": "mysql",
+        "mydumper_binary": "mydumper",
+        "myloader_binary": "myloader",
+        "wal": {"enabled": False, "archive_dir": "wal"},
+        "encryption": {"enabled": False, "key_file": None, "key_env": "CTRL_Z_ENCRYPTION_KEY"},
+        "snapshot": {"enabled": False, "command": None, "release": None, "workers": 4},
+        "serve": {
+            "socket": None,
+            "port": None,
+            "token_file": None,
+            "token_env": "CTRL_Z_SERVE_TOKEN",
+            "schedule": [],
+            "history": 20,
+        },
+        "lock": {"mode": "fail", "timeout": None, "heartbeat": 30, "stale_after": 300},
+        "tiers": [],
+        "retry": {},
+        "restore_profiles": {},
+    }
+
     def __init__(self, **kwargs):
         self.restore = kwargs.pop("restore", False)
 
+        for key, default in self.DEFAULTS.items():
+            if key not in kwargs:
+                kwargs[key] = copy.deepcopy(default)
+            elif isinstance(default, dict) and isinstance(kwargs[key] or {}, dict):
+                # fill in the options missing from a partial (or empty) section
+                kwargs[key] = {**copy.deepcopy(default), **(kwargs[key] or {})}
+
         for key, value in kwargs.items():
             setattr(self, key, value)
 
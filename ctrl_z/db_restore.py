@@ -1,4 +1,7 @@
+import json
 import logging
+import os
+from typing import Dict, List, Optional
 
 from django.db import connections
 from django.db.utils import OperationalError, ProgrammingError
@@ -30,3 +33,93 @@ def test_migrations_table(using: str = "default") -> bool:
         return False
 
     return count > 0
+
+
+# estimated row counts of all tables from the catalog, without reading the
+# tables: the planner statistics, or the live rows tracked by the statistics
+# collector for tables that were never analyzed
+ROW_COUNTS_SQL = """
+SELECT
+    n.nspname || '.' || c.relname,
+    CASE WHEN c.reltuples > 0 THEN c.reltuples::bigint ELSE COALESCE(s.n_live_tup, 0) END
+FROM pg_class c
+JOIN pg_namespace n ON n.oid = c.relnamespace
+LEFT JOIN pg_stat_user_tables s ON s.relid = c.oid
+WHERE c.relkind = 'r' AND n.nspname NOT IN ('pg_catalog', 'information_schema') AND n.nspname NOT LIKE 'pg_toast%'
+"""
+
+# rows a count may differ regardless of the tolerance, the statistics of small
+# tables are only refreshed after autovacuum_analyze_threshold (50) changes
+ROW_COUNT_SLACK = 50
+
+
+def get_row_counts(using: str = "default") -> Dict[str, int]:
+    """
+    Estimate the rows of every table in the database, with a single catalog
+    query.
+
+    :return: mapping of ``schema.table`` to row count
+    """
+    with connections[using].cursor() as cursor:
+        cursor.execute(ROW_COUNTS_SQL)
+        return dict(cursor.fetchall())
+
+
+def write_row_counts(path: str, counts: Dict[str, int]):
+    with open(path, "w") as outfile:
+        json.dump(counts, outfile, indent=2, sort_keys=True)
+
+
+def read_row_counts(path: str) -> Optional[Dict[str, int]]:
+    if not os.path.exists(path):
+        return None
+    with open(path, "r") as infile:
+        return json.load(infile)
+
+
+def compare_row_counts(
+    expected: Dict[str, int],
+    actual: Dict[str, int],
+    tolerance: float = 0.1,
+    slack: int = ROW_COUNT_SLACK,
+) -> List[str]:
+    """
+    Compare restored row counts to the counts recorded at backup time.
+
+    The counts are estimates, recorded next to the dump and not in the same
+    snapshot, so a relative ``tolerance`` and an absolute ``slack`` allow for
+    stale statistics and writes in between.
+
+    :return: descriptions of the differences
+    """
+    problems = []
+    for table, count in sorted(expected.items()):
+        if table not in actual:
+            problems.append(f"table {table} is missing")
+        elif abs(actual[table] - count) > count * tolerance + slack:
+            problems.append(f"table {table} has {actual[table]} rows, expected {count}")
+    return problems
+
+
+def check_row_counts(
+    using: str = "default",
+    row_counts: Optional[Dict[str, int]] = None,
+    tolerance: float = 0.1,
+    **context,
+) -> bool:
+    """
+    Verify a restore against the row counts recorded at backup time.
+
+    Enable ``database.row_counts`` to record them.
+    """
+    if row_counts is None:
+        logger.info("No row counts were recorded for %s, skipping the row count check", using)
+        return True
+
+    with connections[using].cursor() as cursor:
+        # a restore does not update the statistics the counts are estimated from
+        cursor.execute("ANALYZE")
+    problems = compare_row_counts(row_counts, get_row_counts(using), tolerance=tolerance)
+    for problem in problems:
+        logger.error("Row count check of %s: %s", using, problem)
+    return not problems
@@ -0,0 +1,294 @@
+"""
+Dump and restore strategies per database engine.
+
+The driver is picked from ``settings.DATABASES[alias]["ENGINE"]``:
+
+* PostgreSQL and PostGIS: ``pg_dump``/``pg_restore``, implemented by
+  :class:`ctrl_z.backup.Backup` itself (compression, WAL archiving, row counts);
+* MySQL and MariaDB: ``mysqldump --single-transaction`` streamed into the
+  backup, or ``mydumper``/``myloader`` dumping and loading tables with
+  parallel threads;
+* SQLite: the online backup API, copying a limited amount of pages per step
+  so writers are only blocked for the duration of a step.
+
+Streaming drivers write the dump to stdout, so the backup can compress and
+encrypt it on the way to disk. The others write a file or directory, which is
+encrypted afterwards.
+"""
+import logging
+import os
+import re
+import sqlite3
+from pathlib import Path
+from typing import List, Optional
+
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.module_loading import import_string
+
+from .config import Config
+from .streams import run_command
+
+logger = logging.getLogger(__name__)
+
+
+class DriverError(Exception):
+    pass
+
+
+class DatabaseDriver:
+    # short name of the engine, for the logs
+    name = ""
+    # whether the dump is written to stdout, and restored from stdin
+    streaming = False
+    # stderr lines of the dump command marking a table as done, and the remaining verbose chatter
+    dump_item_pattern = None
+    verbose_pattern = None
+
+    def __init__(self, config: Config):
+        self.config = config
+
+    def get_filename(self, db_config: dict, alias: str) -> str:
+        """
+        Get the file name of the dump of a database.
+
+        :param alias: the alias of the database in ``settings.DATABASES``
+        """
+        raise NotImplementedError
+
+    def get_env(self, db_config: dict) -> dict:
+        return os.environ.copy()
+
+    def prepare_restore(self, db_config: dict):
+        """
+        Prepare the target database for the restore, e.g. by recreating it.
+        """
+
+    # streaming drivers
+
+    def get_dump_args(self, db_config: dict) -> List[str]:
+        raise NotImplementedError
+
+    def get_restore_args(self, db_config: dict) -> List[str]:
+        raise NotImplementedError
+
+    def is_complete(self, tail: bytes) -> bool:
+        """
+        Check from the last bytes of a dump that it was written completely.
+        """
+        return True
+
+    # file drivers
+
+    def dump(self, db_config: dict, path: str):
+        raise NotImplementedError
+
+    def restore(self, db_config: dict, path: str):
+        raise NotImplementedError
+
+    def check(self, path: str) -> Optional[str]:
+        """
+        Check that a dump is usable.
+
+        :return: the error, if it is not
+        """
+        return None
+
+
+class PostgresDriver(DatabaseDriver):
+    name = "postgresql"
+
+    def get_filename(self, db_config: dict, alias: str) -> str:
+        host = db_config.get("HOST", "") or "localhost"
+        port = db_config.get("PORT", "") or 5432
+        return f"{host}.{port}.{db_config['NAME']}.custom"
+
+
+class MySQLDriver(DatabaseDriver):
+    name = "mysql"
+    dump_item_pattern = re.compile(rb"^-- Retrieving rows")
+    verbose_pattern = re.compile(rb"^-- ")
+
+    def __init__(self, config: Config):
+        super().__init__(config)
+        self.tool = config.database.get("mysql_tool", "mysqldump")
+        if self.tool not in ("mysqldump", "mydumper"):
+            raise DriverError(f"Unknown MySQL dump tool '{self.tool}', use mysqldump or mydumper")
+        self.streaming = self.tool == "mysqldump"
+        self.threads = config.database.get("mysql_threads", 4)
+
+    def _get_conn_args(self, db_config: dict) -> List[str]:
+        host = db_config.get("HOST", "") or "localhost"
+        port = db_config.get("PORT", "") or 3306
+        return [f"--host={host}", f"--port={port}", f"--user={db_config['USER']}"]
+
+    def get_filename(self, db_config: dict, alias: str) -> str:
+        host = db_config.get("HOST", "") or "localhost"
+        port = db_config.get("PORT", "") or 3306
+        extension = "sql" if self.streaming else "mydumper"
+        return f"{host}.{port}.{db_config['NAME']}.{extension}"
+
+    def get_env(self, db_config: dict) -> dict:
+        env = os.environ.copy()
+        # read by libmysqlclient, keeps the password off the command line
+        env["MYSQL_PWD"] = db_config.get("PASSWORD", "")
+        return env
+
+    def prepare_restore(self, db_config: dict):
+        name = db_config["NAME"].replace("`", "``")
+        logger.info("Recreating the target database")
+        args = [
+            self.config.mysql_binary,
+            *self._get_conn_args(db_config),
+            "-e",
+            f"DROP DATABASE IF EXISTS `{name}`; CREATE DATABASE `{name}`",
+        ]
+        (returncode, _stdout, stderr) = run_command(args, env=self.get_env(db_config))
+        if returncode != 0:
+            raise DriverError(stderr.decode() or f"{args[0]} exited with code {returncode}")
+
+    def get_dump_args(self, db_config: dict) -> List[str]:
+        return [
+            self.config.mysqldump_binary,
+            *self._get_conn_args(db_config),
+            # a consistent snapshot of InnoDB tables, without locking them
+            "--single-transaction",
+            # rows are streamed rather than buffered in memory
+            "--quick",
+            "--routines",
+            "--triggers",
+            "--verbose",
+            db_config["NAME"],
+        ]
+
+    def get_restore_args(self, db_config: dict) -> List[str]:
+        return [self.config.mysql_binary, *self._get_conn_args(db_config), db_config["NAME"]]
+
+    def is_complete(self, tail: bytes) -> bool:
+        # the last line mysqldump writes
+        return b"-- Dump completed" in tail
+
+    def dump(self, db_config: dict, path: str):
+        args = [
+            self.config.mydumper_binary,
+            *self._get_conn_args(db_config),
+            f"--database={db_config['NAME']}",
+            f"--outputdir={path}",
+            f"--threads={self.threads}",
+            "--trx-consistency-only",
+        ]
+        (returncode, _stdout, stderr) = run_command(args, env=self.get_env(db_config))
+        if returncode != 0:
+            raise DriverError(stderr.decode() or f"{args[0]} exited with code {returncode}")
+
+    def restore(self, db_config: dict, path: str):
+        args = [
+            self.config.myloader_binary,
+            *self._get_conn_args(db_config),
+            f"--database={db_config['NAME']}",
+            f"--directory={path}",
+            f"--threads={self.threads}",
+            "--overwrite-tables",
+        ]
+        (returncode, _stdout, stderr) = run_command(args, env=self.get_env(db_config))
+        if returncode != 0:
+            raise DriverError(stderr.decode() or f"{args[0]} exited with code {returncode}")
+
+    def check(self, path: str) -> Optional[str]:
+        # mydumper writes metadata.partial while dumping, and renames it when done
+        if not os.path.isfile(os.path.join(path, "metadata")):
+            return "the mydumper metadata file is missing, the dump did not finish"
+        return None
+
+
+class SQLiteDriver(DatabaseDriver):
+    name = "sqlite"
+
+    def get_filename(self, db_config: dict, alias: str) -> str:
+        # database files in different directories can have the same name
+        return f"{alias}.{os.path.basename(db_config['NAME'])}.backup"
+
+    def dump(self, db_config: dict, path: str):
+        pages = self.config.database.get("sqlite_pages", 1024)
+        sleep = self.config.database.get("sqlite_sleep", 0.01)
+        source = _connect_readonly(db_config["NAME"])
+        target = sqlite3.connect(path)
+        try:
+            # the source is only locked while a step copies its pages
+            source.backup(target, pages=pages, sleep=sleep)
+        finally:
+            target.close()
+            source.close()
+
+    def restore(self, db_config: dict, path: str):
+        source = _connect_readonly(path)
+        target = sqlite3.connect(db_config["NAME"])
+        try:
+            # replaces the whole content of the target in one transaction
+            source.backup(target)
+        finally:
+            target.close()
+            source.close()
+
+    def check(self, path: str) -> Optional[str]:
+        try:
+            connection = _connect_readonly(path)
+            try:
+                results = [row[0] for row in connection.execute("PRAGMA quick_check")]
+            finally:
+                connection.close()
+        except sqlite3.DatabaseError as exc:
+            return str(exc)
+        if results != ["ok"]:
+            return "; ".join(results)
+        return None
+
+
+def _connect_readonly(path: str) -> sqlite3.Connection:
+    return sqlite3.connect(f"{Path(path).resolve().as_uri()}?mode=ro", uri=True)
+
+
+# last component of the ENGINE setting to driver
+DRIVERS = {
+    "postgresql": PostgresDriver,
+    "postgresql_psycopg2": PostgresDriver,
+    "postgis": PostgresDriver,
+    "mysql": MySQLDriver,
+    "sqlite3": SQLiteDriver,
+    "spatialite": SQLiteDriver,
+}
+
+# vendor of the Django backend to driver, for custom backends
+VENDORS = {
+    "postgresql": PostgresDriver,
+    "mysql": MySQLDriver,
+    "sqlite": SQLiteDriver,
+}
+
+
+def _get_vendor(engine: str) -> Optional[str]:
+    try:
+        return import_string(f"{engine}.base.DatabaseWrapper").vendor
+    except (ImportError, ImproperlyConfigured, AttributeError):
+        return None
+
+
+def get_driver(db_config: dict, config: Config) -> DatabaseDriver:
+    """
+    Get the driver for a database, by its ``ENGINE``.
+
+    Custom backends (``django_tenants.postgresql_backend``...) get the driver
+    of their vendor. Configs without an engine, and backends whose vendor is
+    unknown, are PostgreSQL, the only engine supported before.
+    """
+    engine = db_config.get("ENGINE") or "django.db.backends.postgresql"
+    driver_class = DRIVERS.get(engine.rsplit(".", 1)[-1])
+    if driver_class is None:
+        vendor = _get_vendor(engine)
+        if vendor is not None:
+            driver_class = VENDORS.get(vendor)
+        elif not engine.startswith("django."):
+            logger.warning("Unknown database engine '%s', dumping it as PostgreSQL", engine)
+            driver_class = PostgresDriver
+    if driver_class is None:
+        raise DriverError(f"Database engine '{engine}' is not supported")
+    return driver_class(config)
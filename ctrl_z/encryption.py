@@ -0,0 +1,211 @@
+"""
+Streaming authenticated encryption of backup files.
+
+Data is encrypted in fixed-size chunks with AES-256-GCM, so arbitrarily large
+dumps and files are encrypted while they are written, without an extra copy
+and with constant memory use.
+
+The format is a header followed by the encrypted chunks::
+
+    magic (8 bytes) | version (1) | chunk size (4) | salt (32) | nonce prefix (7)
+    chunk ciphertext + tag (16) ...
+
+Every stream is encrypted with its own key, derived from the configured key
+and the random salt with HKDF-SHA256 (like Tink's streaming AEAD), so the
+nonces of millions of files encrypted with the same configured key never
+collide. The nonce of every chunk is the nonce prefix, the chunk counter and a
+flag marking the final chunk (the STREAM construction), which protects against
+reordering and truncation. The header is authenticated as associated data.
+
+Requires the ``cryptography`` package, install ``ctrl-z[encryption]``.
+"""
+import base64
+import os
+import shutil
+import struct
+import sys
+from typing import BinaryIO
+
+try:
+    from cryptography.exceptions import InvalidTag
+    from cryptography.hazmat.primitives import hashes
+    from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+    from cryptography.hazmat.primitives.kdf.hkdf import HKDF
+except ImportError:  # pragma: no cover
+    AESGCM = None
+    InvalidTag = None
+
+MAGIC = b"CTRLZENC"
+VERSION = 2
+# magic and version, followed by the rest of the header
+PREAMBLE = struct.Struct(">8sB")
+HEADER = struct.Struct(">8sBI32s7s")
+SALT_SIZE = 32
+TAG_SIZE = 16
+DEFAULT_CHUNK_SIZE = 1024 * 1024
+
+DEFAULT_KEY_ENV = "CTRL_Z_ENCRYPTION_KEY"
+
+
+class EncryptionError(Exception):
+    pass
+
+
+def _check_available():
+    if AESGCM is None:
+        raise EncryptionError("Encryption requires the 'cryptography' package, install ctrl-z[encryption]")
+
+
+def generate_key() -> str:
+    """
+    Generate a new base64 encoded 256-bit key.
+    """
+    return base64.b64encode(os.urandom(32)).decode("ascii")
+
+
+def load_key(config: dict) -> bytes:
+    """
+    Load the key from the file or environment variable set in the config.
+    """
+    key_file = config.get("key_file")
+    if key_file:
+        with open(key_file, "rb") as infile:
+            encoded = infile.read().strip()
+    else:
+        key_env = config.get("key_env") or DEFAULT_KEY_ENV
+        encoded = os.environ.get(key_env, "").encode("ascii")
+        if not encoded:
+            raise EncryptionError(f"Encryption is enabled, but no key file is configured and ${key_env} is empty")
+
+    try:
+        key = base64.b64decode(encoded, validate=True)
+    except ValueError:
+        raise EncryptionError("The encryption key must be base64 encoded")
+    if len(key) != 32:
+        raise EncryptionError("The encryption key must be 256 bits")
+    return key
+
+
+def _derive_key(key: bytes, salt: bytes) -> bytes:
+    """
+    Derive the key of a single stream.
+    """
+    hkdf = HKDF(algorithm=hashes.SHA256(), length=32, salt=salt, info=MAGIC + bytes([VERSION]))
+    return hkdf.derive(key)
+
+
+def _nonce(prefix: bytes, counter: int, final: bool) -> bytes:
+    return prefix + struct.pack(">I?", counter, final)
+
+
+class EncryptingWriter:
+    """
+    File-like object encrypting everything written to it into ``outfile``.
+
+    The final chunk is written on :meth:`close`.
+    """
+
+    def __init__(self, outfile: BinaryIO, key: bytes, chunk_size: int = DEFAULT_CHUNK_SIZE):
+        _check_available()
+        self.outfile = outfile
+        salt = os.urandom(SALT_SIZE)
+        self.aead = AESGCM(_derive_key(key, salt))
+        self.chunk_size = chunk_size
+        self.prefix = os.urandom(7)
+        self.header = HEADER.pack(MAGIC, VERSION, chunk_size, salt, self.prefix)
+        self.buffer = bytearray()
+        self.counter = 0
+        self.closed = False
+        outfile.write(self.header)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, *args):
+        if exc_type is None:
+            self.close()
+
+    def _write_chunk(self, chunk: bytes, final: bool):
+        nonce = _nonce(self.prefix, self.counter, final)
+        self.outfile.write(self.aead.encrypt(nonce, chunk, self.header))
+        self.counter += 1
+
+    def write(self, data: bytes) -> int:
+        self.buffer += data
+        while len(self.buffer) > self.chunk_size:
+            self._write_chunk(bytes(self.buffer[: self.chunk_size]), final=False)
+            del self.buffer[: self.chunk_size]
+        return len(data)
+
+    def close(self):
+        if self.closed:
+            return
+        # always end with a final chunk, possibly empty, to detect truncation
+        self._write_chunk(bytes(self.buffer), final=True)
+        self.buffer.clear()
+        self.closed = True
+
+
+def decrypt_chunks(infile: BinaryIO, key: bytes):
+    """
+    Yield the decrypted chunks of an encrypted stream.
+    """
+    _check_available()
+    preamble = infile.read(PREAMBLE.size)
+    if len(preamble) != PREAMBLE.size:
+        raise EncryptionError("Not an encrypted CTRL-Z file: header is truncated")
+    magic, version = PREAMBLE.unpack(preamble)
+    if magic != MAGIC or version != VERSION:
+        raise EncryptionError("Not an encrypted CTRL-Z file, or an unsupported version")
+    header = preamble + infile.read(HEADER.size - PREAMBLE.size)
+    if len(header) != HEADER.size:
+        raise EncryptionError("Not an encrypted CTRL-Z file: header is truncated")
+
+    _magic, _version, chunk_size, salt, prefix = HEADER.unpack(header)
+    aead = AESGCM(_derive_key(key, salt))
+    counter = 0
+    chunk = infile.read(chunk_size + TAG_SIZE)
+    while True:
+        # read ahead to know if this is the final chunk
+        next_chunk = infile.read(chunk_size + TAG_SIZE)
+        final = not next_chunk
+        try:
+            yield aead.decrypt(_nonce(prefix, counter, final), chunk, header)
+        except InvalidTag:
+            raise EncryptionError("Decryption failed: wrong key, or the file is corrupt or truncated")
+        if final:
+            return
+        chunk = next_chunk
+        counter += 1
+
+
+def encrypt_stream(infile: BinaryIO, outfile: BinaryIO, key: bytes, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    with EncryptingWriter(outfile, key, chunk_size=chunk_size) as writer:
+        shutil.copyfileobj(infile, writer, chunk_size)
+
+
+def decrypt_stream(infile: BinaryIO, outfile: BinaryIO, key: bytes):
+    for chunk in decrypt_chunks(infile, key):
+        outfile.write(chunk)
+
+
+def encrypt_file(src: str, dst: str, key: bytes, chunk_size: int = DEFAULT_CHUNK_SIZE):
+    """
+    Encrypt ``src`` into ``dst``, usable as ``copy_function`` (with the key bound).
+    """
+    with open(src, "rb") as infile, open(dst, "wb") as outfile:
+        encrypt_stream(infile, outfile, key, chunk_size=chunk_size)
+    shutil.copystat(src, dst)
+    return dst
+
+
+def decrypt_file(src: str, dst: str, key: bytes):
+    with open(src, "rb") as infile, open(dst, "wb") as outfile:
+        decrypt_stream(infile, outfile, key)
+    shutil.copystat(src, dst)
+    return dst
+
+
+if __name__ == "__main__":  # pragma: no cover
+    # python -m ctrl_z.encryption prints a new key
+    sys.stdout.write(f"{generate_key()}\n")
@@ -0,0 +1,137 @@
+"""
+Copy files with the cheapest mechanism the filesystem supports.
+
+In order of preference:
+
+1. a reflink (``FICLONE``), sharing all blocks on copy-on-write filesystems
+   such as btrfs and XFS - a metadata-only operation, whatever the size;
+2. ``copy_file_range`` over the data segments only, which keeps holes in
+   sparse files and lets the kernel (or the NFS server) copy without passing
+   the data through user space;
+3. a plain read/write of the data segments.
+
+:func:`fast_copy` is a drop-in replacement for :func:`shutil.copy2`, usable as
+``copy_function`` for :func:`shutil.copytree`.
+"""
+import errno
+import logging
+import os
+import shutil
+
+try:
+    import fcntl
+except ImportError:  # pragma: no cover
+    fcntl = None
+
+logger = logging.getLogger(__name__)
+
+# _IOW(0x94, 9, int) from linux/fs.h
+FICLONE = 0x40049409
+
+# bytes per copy_file_range call, copied by the kernel
+CHUNK_SIZE = 64 * 1024 * 1024
+# bytes per read of the read/write fallback, held in memory, e.g. across mounts
+READ_SIZE = 1024 * 1024
+
+# errors meaning "not supported here", rather than a failing copy
+UNSUPPORTED = {errno.EOPNOTSUPP, errno.ENOTTY, errno.EXDEV, errno.EINVAL, errno.ENOSYS, errno.EBADF, errno.EPERM}
+
+
+def _clone(src_fd: int, dst_fd: int) -> bool:
+    if fcntl is None:
+        return False
+    try:
+        fcntl.ioctl(dst_fd, FICLONE, src_fd)
+    except OSError as exc:
+        if exc.errno in UNSUPPORTED:
+            return False
+        raise
+    return True
+
+
+def _data_segments(fd: int, size: int):
+    """
+    Yield the ``(start, end)`` ranges of a file that contain data, skipping holes.
+    """
+    offset = 0
+    while offset < size:
+        try:
+            start = os.lseek(fd, offset, os.SEEK_DATA)
+        except OSError as exc:
+            if exc.errno == errno.ENXIO:
+                # only a hole remains
+                return
+            if exc.errno in UNSUPPORTED:
+                yield offset, size
+                return
+            raise
+        end = os.lseek(fd, start, os.SEEK_HOLE)
+        yield start, end
+        offset = end
+
+
+def _copy_range(src_fd: int, dst_fd: int, start: int, end: int, use_copy_file_range: bool) -> bool:
+    """
+    Copy a byte range, at the same offset.
+
+    :return: whether ``copy_file_range`` can still be used
+    """
+    offset = start
+    while offset < end:
+        if use_copy_file_range:
+            try:
+                copied = os.copy_file_range(src_fd, dst_fd, min(CHUNK_SIZE, end - offset), offset, offset)
+            except OSError as exc:
+                if exc.errno not in UNSUPPORTED:
+                    raise
+                use_copy_file_range = False
+                continue
+        else:
+            data = os.pread(src_fd, min(READ_SIZE, end - offset), offset)
+            copied = os.pwrite(dst_fd, data, offset) if data else 0
+        if copied == 0:
+            # the source shrunk while copying
+            break
+        offset += copied
+    return use_copy_file_range
+
+
+def copy_file(src: str, dst: str):
+    """
+    Copy the content of ``src`` to ``dst``, reflinked or keeping holes if possible.
+    """
+    with open(src, "rb") as infile, open(dst, "wb") as outfile:
+        src_fd, dst_fd = infile.fileno(), outfile.fileno()
+        if _clone(src_fd, dst_fd):
+            return
+
+        size = os.fstat(src_fd).st_size
+        use_copy_file_range = hasattr(os, "copy_file_range")
+        for start, end in _data_segments(src_fd, size):
+            use_copy_file_range = _copy_range(src_fd, dst_fd, start, end, use_copy_file_range)
+        # a trailing hole is not written, but must be part of the size
+        os.ftruncate(dst_fd, size)
+
+
+def fast_copy(src: str, dst: str, *, follow_symlinks: bool = True) -> str:
+    """
+    Copy a file and its metadata, like :func:`shutil.copy2`.
+    """
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    if not follow_symlinks and os.path.islink(src):
+        return shutil.copy2(src, dst, follow_symlinks=False)
+
+    copy_file(src, dst)
+    shutil.copystat(src, dst)
+    return dst
+
+
+def link_or_copy(src: str, dst: str):
+    """
+    Hard-link a file, or copy it if that is not possible (e.g. across filesystems).
+    """
+    try:
+        os.link(src, dst)
+    except OSError:
+        fast_copy(src, dst)
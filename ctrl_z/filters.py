@@ -0,0 +1,126 @@
+"""
+Include/exclude filters for the backed up file directories.
+"""
+import fnmatch
+import os
+import re
+from typing import Iterable, List, Optional
+
+GLOB_CHARACTERS = re.compile(r"[*?[]")
+
+
+def expand_patterns(patterns: Iterable[str]) -> List[str]:
+    """
+    Normalize path patterns, a pattern without wildcards naming a directory
+    also matches everything below it.
+    """
+    expanded = []
+    for pattern in patterns:
+        pattern = pattern.replace(os.sep, "/").strip("/")
+        expanded.append(pattern)
+        if not GLOB_CHARACTERS.search(pattern):
+            expanded.append(f"{pattern}/*")
+    return expanded
+
+
+def get_base_dirs(patterns: Iterable[str]) -> List[str]:
+    """
+    Get the directories holding every match of the patterns, so only those
+    subtrees need to be walked.
+
+    :return: relative paths, without nesting - ``""`` for the root of the tree
+    """
+    bases = set()
+    for pattern in patterns:
+        match = GLOB_CHARACTERS.search(pattern)
+        if match is None:
+            # a directory, or a single file
+            bases.add(pattern)
+            continue
+        literal = pattern[: match.start()]
+        bases.add(literal.rsplit("/", 1)[0] if "/" in literal else "")
+    # a base inside another base is walked already
+    return sorted(
+        base
+        for base in bases
+        if not any(other != base and (other == "" or base.startswith(f"{other}/")) for other in bases)
+    )
+
+
+def _compile(patterns: Optional[Iterable[str]]):
+    if not patterns:
+        return None
+    return re.compile("|".join(f"(?:{fnmatch.translate(pattern)})" for pattern in patterns))
+
+
+class PathFilter:
+    """
+    Decide which entries of a directory tree are included.
+
+    Patterns are shell-style globs matched against the path relative to the
+    root of the tree, using ``/`` as separator. Note that ``*`` also matches
+    ``/``. All patterns are combined in a single regular expression, so the
+    cost per entry does not grow with the amount of patterns.
+
+    :param include: if given, only files matching one of these are included.
+      Directories are always traversed unless excluded.
+    :param exclude: files and directories matching one of these are excluded.
+      Excluded directories are not traversed.
+    :param max_file_size: files larger than this amount of bytes are excluded.
+    """
+
+    __slots__ = ["include", "exclude", "max_file_size"]
+
+    def __init__(
+        self,
+        include: Optional[Iterable[str]] = None,
+        exclude: Optional[Iterable[str]] = None,
+        max_file_size: Optional[int] = None,
+    ):
+        self.include = _compile(include)
+        self.exclude = _compile(exclude)
+        self.max_file_size = max_file_size
+
+    def __bool__(self):
+        return bool(self.include or self.exclude or self.max_file_size is not None)
+
+    @classmethod
+    def from_config(cls, config: Optional[dict]):
+        return cls(**(config or {}))
+
+    def is_excluded(self, relpath: str, is_dir: bool = False, size: Optional[int] = None) -> bool:
+        if os.sep != "/":
+            relpath = relpath.replace(os.sep, "/")
+
+        if self.exclude is not None and self.exclude.match(relpath):
+            return True
+
+        if is_dir:
+            return False
+
+        if self.include is not None and not self.include.match(relpath):
+            return True
+
+        if self.max_file_size is not None and size is not None and size > self.max_file_size:
+            return True
+
+        return False
+
+    def get_ignore(self, root: str):
+        """
+        Build an ``ignore`` callable for :func:`shutil.copytree` of ``root``.
+        """
+
+        def ignore(directory: str, names: list) -> set:
+            reldir = os.path.relpath(directory, root)
+            ignored = set()
+            for name in names:
+                path = os.path.join(directory, name)
+                relpath = name if reldir == os.curdir else os.path.join(reldir, name)
+                is_dir = os.path.isdir(path)
+                size = os.path.getsize(path) if not is_dir and self.max_file_size is not None else None
+                if self.is_excluded(relpath, is_dir=is_dir, size=size):
+                    ignored.add(name)
+            return ignored
+
+        return ignore
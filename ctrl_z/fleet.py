@@ -0,0 +1,222 @@
+"""
+Run the backups of multiple sites concurrently from a single process.
+
+Every site keeps its own CLI script and config file - Django settings are
+process global, so each backup runs in its own child process. The runner
+limits how many of those run at the same time and produces one combined
+report.
+
+Usage::
+
+    python -m ctrl_z.fleet /etc/ctrl-z/fleet.yml
+
+with a fleet file like:
+
+.. code-block:: yaml
+
+    max_parallel: 4
+    niceness: 10
+    ionice: idle
+    jobs:
+      - name: site-a
+        cli: /srv/site-a/backup/cli.py
+        config_file: /srv/site-a/backup/config.yml
+        python: /srv/site-a/env/bin/python
+        settings: site_a.conf.production
+        args: [--skip-db, secondary]
+"""
+import argparse
+import logging
+import os
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import List, Optional
+
+import yaml
+
+from .report import tail_file
+
+logger = logging.getLogger(__name__)
+
+IONICE_CLASSES = {"realtime": "1", "best-effort": "2", "idle": "3"}
+
+
+class Job:
+    __slots__ = ["name", "cli", "config_file", "python", "settings", "args", "env"]
+
+    def __init__(
+        self,
+        cli: str,
+        config_file: str,
+        name: Optional[str] = None,
+        python: Optional[str] = None,
+        settings: Optional[str] = None,
+        args: Optional[List[str]] = None,
+        env: Optional[dict] = None,
+    ):
+        self.cli = cli
+        self.config_file = config_file
+        self.name = name or config_file
+        self.python = python or sys.executable
+        self.settings = settings
+        self.args = args or []
+        self.env = env or {}
+
+    def __repr__(self):
+        return f"Job(name={self.name!r})"
+
+    def get_command(self, subcommand: str = "backup") -> List[str]:
+        return [self.python, self.cli, "--config-file", self.config_file, subcommand, *self.args]
+
+    def get_env(self) -> dict:
+        env = os.environ.copy()
+        if self.settings:
+            env["DJANGO_SETTINGS_MODULE"] = self.settings
+        env.update({key: str(value) for key, value in self.env.items()})
+        return env
+
+
+class JobResult:
+    __slots__ = ["job", "returncode", "duration", "output"]
+
+    def __init__(self, job: Job, returncode: int, duration: float, output: str):
+        self.job = job
+        self.returncode = returncode
+        self.duration = duration
+        self.output = output
+
+    @property
+    def succeeded(self) -> bool:
+        return self.returncode == 0
+
+
+class FleetRunner:
+    """
+    Run the backup of every job, at most ``max_parallel`` at the same time.
+
+    :param jobs: the sites to back up
+    :param max_parallel: maximum amount of concurrently running backups, which
+      bounds the amount of parallel dumps and copies
+    :param niceness: CPU niceness increment for the child processes
+    :param ionice: IO scheduling class for the child processes (Linux only),
+      one of ``realtime``, ``best-effort`` or ``idle``
+    :param tail_lines: amount of output lines of failed jobs to include in the
+      report
+    """
+
+    def __init__(
+        self,
+        jobs: List[Job],
+        max_parallel: int = 4,
+        niceness: int = 0,
+        ionice: Optional[str] = None,
+        tail_lines: int = 20,
+    ):
+        if ionice is not None and ionice not in IONICE_CLASSES:
+            raise ValueError(f"Unknown ionice class '{ionice}', options are: {', '.join(IONICE_CLASSES)}")
+        self.jobs = jobs
+        self.max_parallel = max_parallel
+        self.niceness = niceness
+        self.ionice = ionice
+        self.tail_lines = tail_lines
+
+    @classmethod
+    def from_file(cls, fleet_file: str, **overrides):
+        with open(fleet_file, "r") as _fleet:
+            config = yaml.safe_load(_fleet)
+        config.update(overrides)
+        jobs = [Job(**job) for job in config.pop("jobs", [])]
+        return cls(jobs=jobs, **config)
+
+    def _get_command(self, job: Job, subcommand: str) -> List[str]:
+        command = job.get_command(subcommand)
+        if self.ionice and shutil.which("ionice"):
+            command = ["ionice", "-c", IONICE_CLASSES[self.ionice], *command]
+        # not with preexec_fn, which is not safe with the worker threads
+        if self.niceness and shutil.which("nice"):
+            command = ["nice", "-n", str(self.niceness), *command]
+        return command
+
+    def run_job(self, job: Job, subcommand: str = "backup") -> JobResult:
+        command = self._get_command(job, subcommand)
+        logger.info("Starting %s of %s", subcommand, job.name)
+        start = time.monotonic()
+
+        # child output goes to disk, so memory use doesn't grow with it
+        with tempfile.NamedTemporaryFile(mode="w+", prefix="ctrl-z-fleet-", suffix=".log") as output:
+            try:
+                process = subprocess.run(
+                    command,
+                    env=job.get_env(),
+                    stdin=subprocess.DEVNULL,
+                    stdout=output,
+                    stderr=subprocess.STDOUT,
+                )
+            except OSError as exc:
+                logger.error("Could not start %s of %s: %s", subcommand, job.name, exc)
+                returncode, tail = 127, str(exc)
+            else:
+                returncode = process.returncode
+                output.flush()
+                tail = tail_file(output.name, self.tail_lines)
+
+        duration = time.monotonic() - start
+        log = logger.info if returncode == 0 else logger.error
+        log("Finished %s of %s with exit code %d in %.1fs", subcommand, job.name, returncode, duration)
+        return JobResult(job, returncode, duration, tail)
+
+    def run(self, subcommand: str = "backup") -> List[JobResult]:
+        logger.info("Running %s for %d sites, %d at a time", subcommand, len(self.jobs), self.max_parallel)
+        with ThreadPoolExecutor(max_workers=self.max_parallel) as executor:
+            return list(executor.map(lambda job: self.run_job(job, subcommand), self.jobs))
+
+    def report(self, results: List[JobResult]) -> str:
+        """
+        Render the combined report of a fleet run.
+        """
+        failed = [result for result in results if not result.succeeded]
+        lines = [
+            f"{len(results) - len(failed)}/{len(results)} backups succeeded",
+            "",
+        ]
+        for result in results:
+            status = "OK" if result.succeeded else f"FAILED ({result.returncode})"
+            lines.append(f"{result.job.name}: {status} in {result.duration:.1f}s")
+
+        for result in failed:
+            lines += ["", f"Output of {result.job.name}", "-" * (10 + len(result.job.name)), result.output.rstrip()]
+
+        return "\n".join(lines) + "\n"
+
+
+def main(args=None) -> int:
+    parser = argparse.ArgumentParser(description="CTRL-Z fleet runner")
+    parser.add_argument("fleet_file", help="YAML file describing the sites to back up")
+    parser.add_argument("--max-parallel", type=int, help="Maximum amount of concurrent backups")
+    parser.add_argument("--report-file", help="Write the combined report to this file instead of stdout")
+    options = parser.parse_args(args)
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+
+    overrides = {}
+    if options.max_parallel:
+        overrides["max_parallel"] = options.max_parallel
+    runner = FleetRunner.from_file(options.fleet_file, **overrides)
+
+    results = runner.run()
+    report = runner.report(results)
+    if options.report_file:
+        with open(options.report_file, "w") as outfile:
+            outfile.write(report)
+    else:
+        sys.stdout.write(report)
+
+    return 0 if all(result.succeeded for result in results) else 1
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,257 @@
+"""
+Hashing of file trees, backed by a persistent cache.
+
+Digests are cached in an SQLite database keyed on ``(device, inode, size,
+mtime_ns)``, so only files whose stat result changed since the last run are
+read again. Files that do need hashing are read with large buffers in a thread
+pool - hashlib releases the GIL while digesting.
+"""
+import hashlib
+import logging
+import os
+import sqlite3
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, Iterator, Optional, Tuple
+
+from .filters import PathFilter
+from .walk import WalkEntry, walk_tree
+
+logger = logging.getLogger(__name__)
+
+ALGORITHM = "sha256"
+
+BUFFER_SIZE = 1024 * 1024
+
+CACHE_FILENAME = ".ctrl-z-hashes.sqlite3"
+
+# digests written per transaction, other runs sharing the cache wait for it
+BATCH_SIZE = 1000
+
+# seconds the cache waits for a transaction of another run
+TIMEOUT = 60
+
+# digests of files not seen for this many seconds are removed
+PRUNE_AFTER = 30 * 24 * 60 * 60
+
+
+class HashCache:
+    """
+    Persistent mapping of file stat results to digests.
+
+    Only use a cache instance from the thread that created it. Several
+    instances (of concurrent directory copies or runs) can share the cache
+    file: digests are written in short transactions of ``batch_size``. Digests
+    of files that were not seen for ``prune_after`` seconds are removed when
+    the cache is closed.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        algorithm: str = ALGORITHM,
+        batch_size: int = BATCH_SIZE,
+        prune_after: int = PRUNE_AFTER,
+    ):
+        self.path = path
+        self.algorithm = algorithm
+        self.batch_size = batch_size
+        self.prune_after = prune_after
+        self.now = int(time.time())
+        self.pending = 0
+        # keys of the digests read from the cache, marked as seen in batches
+        self.seen = []
+        self.connection = sqlite3.connect(path, timeout=TIMEOUT)
+        # readers don't block the writer
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute(
+            f"""
+            CREATE TABLE IF NOT EXISTS digests (
+                device INTEGER NOT NULL,
+                inode INTEGER NOT NULL,
+                algorithm TEXT NOT NULL,
+                size INTEGER NOT NULL,
+                mtime_ns INTEGER NOT NULL,
+                digest TEXT NOT NULL,
+                seen INTEGER NOT NULL DEFAULT {self.now},
+                PRIMARY KEY (device, inode, algorithm)
+            )
+            """
+        )
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(digests)")]
+        if "seen" not in columns:
+            # a cache of an earlier version
+            self.connection.execute(f"ALTER TABLE digests ADD COLUMN seen INTEGER NOT NULL DEFAULT {self.now}")
+        self.connection.commit()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def close(self):
+        try:
+            self.commit()
+            self.connection.execute("DELETE FROM digests WHERE seen < ?", (self.now - self.prune_after,))
+            self.connection.commit()
+        finally:
+            self.connection.close()
+
+    def commit(self):
+        if self.seen:
+            self.connection.executemany(
+                "UPDATE digests SET seen = ? WHERE device = ? AND inode = ? AND algorithm = ?",
+                [(self.now, device, inode, self.algorithm) for device, inode in self.seen],
+            )
+            self.seen = []
+        self.connection.commit()
+        self.pending = 0
+
+    def _written(self):
+        self.pending += 1
+        if self.pending >= self.batch_size:
+            self.commit()
+
+    def get(self, stat: os.stat_result) -> Optional[str]:
+        row = self.connection.execute(
+            "SELECT size, mtime_ns, digest FROM digests WHERE device = ? AND inode = ? AND algorithm = ?",
+            (stat.st_dev, stat.st_ino, self.algorithm),
+        ).fetchone()
+        if row is None:
+            return None
+        size, mtime_ns, digest = row
+        if size != stat.st_size or mtime_ns != stat.st_mtime_ns:
+            return None
+        self.seen.append((stat.st_dev, stat.st_ino))
+        self._written()
+        return digest
+
+    def set(self, stat: os.stat_result, digest: str):
+        self.connection.execute(
+            "INSERT OR REPLACE INTO digests VALUES (?, ?, ?, ?, ?, ?, ?)",
+            (stat.st_dev, stat.st_ino, self.algorithm, stat.st_size, stat.st_mtime_ns, digest, self.now),
+        )
+        self._written()
+
+
+def hash_file(path: str, algorithm: str = ALGORITHM) -> str:
+    digest = hashlib.new(algorithm)
+    buffer = bytearray(BUFFER_SIZE)
+    view = memoryview(buffer)
+    with open(path, "rb", buffering=0) as infile:
+        while True:
+            read = infile.readinto(buffer)
+            if not read:
+                break
+            digest.update(view[:read])
+    return digest.hexdigest()
+
+
+def iter_digests(
+    paths: Iterable[str],
+    cache: Optional[HashCache] = None,
+    workers: int = 4,
+    algorithm: str = ALGORITHM,
+) -> Iterator[Tuple[str, str]]:
+    """
+    Hash the given files, only reading those not (validly) in the cache.
+
+    Paths are consumed lazily and only a few files are hashed at the same
+    time, so memory use does not grow with the amount of files.
+
+    :return: iterator of ``(path, hex digest)``
+    """
+    stats = ((path, os.stat(path)) for path in paths)
+    yield from _iter_digests(stats, cache=cache, workers=workers, algorithm=algorithm)
+
+
+def _iter_digests(
+    stats: Iterable[Tuple[str, os.stat_result]],
+    cache: Optional[HashCache],
+    workers: int,
+    algorithm: str,
+) -> Iterator[Tuple[str, str]]:
+    from_cache = hashed = 0
+    pending = deque()
+
+    def finish():
+        path, stat, future = pending.popleft()
+        digest = future.result()
+        if cache is not None:
+            cache.set(stat, digest)
+        return path, digest
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for path, stat in stats:
+            digest = cache.get(stat) if cache is not None else None
+            if digest is not None:
+                from_cache += 1
+                yield path, digest
+                continue
+
+            hashed += 1
+            pending.append((path, stat, executor.submit(hash_file, path, algorithm)))
+            if len(pending) >= workers * 2:
+                yield finish()
+
+        while pending:
+            yield finish()
+
+    logger.debug("%d digests from cache, hashed %d files", from_cache, hashed)
+
+
+def hash_files(
+    paths: Iterable[str],
+    cache: Optional[HashCache] = None,
+    workers: int = 4,
+    algorithm: str = ALGORITHM,
+) -> Dict[str, str]:
+    """
+    Hash the given files, only reading those not (validly) in the cache.
+
+    :return: mapping of path to hex digest
+    """
+    return dict(iter_digests(paths, cache=cache, workers=workers, algorithm=algorithm))
+
+
+def hash_tree(
+    root: str,
+    cache: Optional[HashCache] = None,
+    workers: int = 4,
+    algorithm: str = ALGORITHM,
+    path_filter: Optional[PathFilter] = None,
+    entries: Optional[Iterable[WalkEntry]] = None,
+) -> Dict[str, str]:
+    """
+    Hash all the files in a directory tree.
+
+    :param path_filter: only hash the files included by this filter
+    :param entries: the entries of a walk of the tree already going on, such
+      as a :func:`~ctrl_z.walk.iter_copy_tree`, instead of walking it again
+    :return: mapping of path relative to ``root`` to hex digest
+    """
+    if entries is None:
+        entries = walk_tree(root, path_filter=path_filter, workers=workers)
+    stats = ((entry.path, entry.stat) for entry in entries if not entry.is_dir)
+    digests = _iter_digests(stats, cache=cache, workers=workers, algorithm=algorithm)
+    return {os.path.relpath(path, root): digest for path, digest in digests}
+
+
+def write_manifest(path: str, digests: Dict[str, str]):
+    """
+    Write the digests in ``sha256sum`` compatible format.
+    """
+    with open(path, "w") as manifest:
+        for relpath in sorted(digests):
+            manifest.write(f"{digests[relpath]}  {relpath}\n")
+
+
+def read_manifest(path: str) -> Dict[str, str]:
+    digests = {}
+    with open(path, "r") as manifest:
+        for line in manifest:
+            digest, relpath = line.rstrip("\n").split("  ", 1)
+            digests[relpath] = digest
+    return digests
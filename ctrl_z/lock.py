@@ -0,0 +1,258 @@
+"""
+Advisory lock on the backup root, so runs never overlap.
+
+Two runs writing into the same dated directory (a slow backup overlapping the
+next cron tick, or a scheduled run of ``ctrl-z serve``) corrupt each other's
+copies. Backups, restores and rotations hold an exclusive ``flock`` on a lock
+file in the backup root for their whole duration.
+
+The lock file holds the PID, host and start time of the holder, and a
+heartbeat refreshed while it runs. The kernel releases the lock of a process
+that dies, its metadata is cleaned up by the next run. A lock can still be
+held by a dead run when it was taken over NFS by a host that crashed, or was
+inherited by an orphaned child process: the lock is then stale, and broken by
+replacing the lock file, when
+
+* the holder ran on this host and its PID no longer exists, or
+* the holder ran on another host and its heartbeat stopped for longer than
+  ``stale_after`` seconds.
+
+A lock without (readable) metadata is never stale, its holder may not have
+written it yet. A run that finds its lock broken aborts, since another run
+may be writing into the backup root by now.
+"""
+import fcntl
+import json
+import logging
+import os
+import socket
+import sys
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+LOCK_FILENAME = ".ctrl-z.lock"
+
+# what to do if another run holds the lock
+MODES = ("wait", "skip", "fail")
+
+DEFAULT_HEARTBEAT = 30
+DEFAULT_STALE_AFTER = 300
+
+# seconds between attempts while waiting
+POLL_INTERVAL = 1
+
+
+class LockError(Exception):
+    pass
+
+
+class LockBrokenError(LockError):
+    """
+    The lock of the run was broken by another run, which considered it dead.
+    """
+
+
+def get_lock_path(base_dir: str) -> str:
+    """
+    Get the lock file of the backup root holding the dated ``base_dir``.
+    """
+    return os.path.join(os.path.dirname(os.path.normpath(base_dir)), LOCK_FILENAME)
+
+
+def read_holder(path: str) -> Optional[dict]:
+    """
+    Read the metadata of the run holding (or last holding) the lock.
+    """
+    try:
+        with open(path, "r") as infile:
+            holder = json.loads(infile.read() or "null")
+    except (OSError, ValueError):
+        # missing, or being rewritten
+        return None
+    return holder if isinstance(holder, dict) else None
+
+
+def describe_holder(holder: Optional[dict]) -> str:
+    if not holder:
+        return "an unknown run"
+    return "PID {pid} on {host}, started {started}, last heartbeat {heartbeat}".format(**holder)
+
+
+def is_stale(holder: Optional[dict], stale_after: float) -> bool:
+    if not holder:
+        # not written yet, or being rewritten
+        return False
+    if holder.get("host") == socket.gethostname():
+        pid = holder.get("pid")
+        return isinstance(pid, int) and not _pid_exists(pid)
+    try:
+        heartbeat = datetime.fromisoformat(holder["heartbeat"])
+    except (KeyError, TypeError, ValueError):
+        return False
+    if heartbeat.tzinfo is None:
+        return False
+    return (datetime.now(timezone.utc) - heartbeat).total_seconds() > stale_after
+
+
+def _pid_exists(pid: int) -> bool:
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # exists, but is owned by another user
+        return True
+    return True
+
+
+def _write(fd: int, metadata: dict):
+    content = json.dumps(metadata).encode()
+    os.ftruncate(fd, 0)
+    os.pwrite(fd, content, 0)
+
+
+def _now() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+def _break(path: str, holder: Optional[dict]):
+    logger.warning("Breaking the stale lock %s of %s", path, describe_holder(holder))
+    # new runs open the replacement, the dead holder keeps its lock on the old file
+    replacement = f"{path}.{os.getpid()}"
+    open(replacement, "w").close()
+    os.replace(replacement, path)
+
+
+class Heartbeat(threading.Thread):
+    """
+    Refresh the heartbeat in the lock file, and notice if the lock was broken.
+    """
+
+    def __init__(self, fd: int, path: str, metadata: dict, interval: float, broken: threading.Event):
+        super().__init__(daemon=True)
+        self.fd = fd
+        self.path = path
+        self.metadata = metadata
+        self.interval = interval
+        self.broken = broken
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                broken = os.stat(self.path).st_ino != os.fstat(self.fd).st_ino
+            except FileNotFoundError:
+                broken = True
+            if broken:
+                logger.error("The lock %s was broken by another run, which considered this run dead", self.path)
+                self.broken.set()
+                return
+            self.metadata["heartbeat"] = _now()
+            _write(self.fd, self.metadata)
+
+    def stop(self):
+        self.stopped.set()
+        self.join()
+
+
+def _acquire(path: str, mode: str, timeout: Optional[float], stale_after: float) -> Optional[int]:
+    """
+    :return: the file descriptor holding the lock, or None to skip the run
+    """
+    deadline = time.monotonic() + timeout if timeout else None
+    waiting = False
+    while True:
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            os.close(fd)
+        else:
+            try:
+                # the file may have been replaced by a run breaking a stale lock in between
+                if os.stat(path).st_ino == os.fstat(fd).st_ino:
+                    return fd
+            except FileNotFoundError:
+                pass
+            os.close(fd)
+            continue
+
+        holder = read_holder(path)
+        if is_stale(holder, stale_after):
+            _break(path, holder)
+            continue
+        if mode == "skip":
+            logger.warning("Skipping, the lock %s is held by %s", path, describe_holder(holder))
+            return None
+        if mode == "fail" or (deadline is not None and time.monotonic() >= deadline):
+            raise LockError(f"The lock {path} is held by {describe_holder(holder)}")
+        if not waiting:
+            logger.info("Waiting for the lock %s, held by %s", path, describe_holder(holder))
+            waiting = True
+        time.sleep(POLL_INTERVAL)
+
+
+@contextmanager
+def backup_lock(
+    base_dir: str,
+    mode: str = "fail",
+    timeout: Optional[float] = None,
+    heartbeat: float = DEFAULT_HEARTBEAT,
+    stale_after: float = DEFAULT_STALE_AFTER,
+    broken: Optional[threading.Event] = None,
+):
+    """
+    Hold the lock on the backup root of ``base_dir``.
+
+    :param mode: if another run holds the lock, ``wait`` for it (at most
+      ``timeout`` seconds), ``skip`` this run or ``fail``
+    :param broken: set as soon as the lock is found broken, for the run to
+      abort early
+    :return: the path of the lock file, or None if the run is to be skipped
+    :raises LockError: if another run holds the lock
+    :raises LockBrokenError: if the lock was broken while held
+    """
+    if mode not in MODES:
+        raise LockError(f"Unknown lock mode '{mode}', use one of {', '.join(MODES)}")
+    path = get_lock_path(base_dir)
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+
+    fd = _acquire(path, mode, timeout, stale_after)
+    if fd is None:
+        yield None
+        return
+
+    if broken is None:
+        broken = threading.Event()
+    try:
+        previous = read_holder(path)
+        if previous:
+            # released locks are emptied
+            logger.warning("Cleaning up the lock of a run that did not finish: %s", describe_holder(previous))
+        started = _now()
+        metadata = {
+            "pid": os.getpid(),
+            "host": socket.gethostname(),
+            "started": started,
+            "heartbeat": started,
+            "command": " ".join(sys.argv),
+        }
+        _write(fd, metadata)
+        beat = Heartbeat(fd, path, metadata, heartbeat, broken)
+        beat.start()
+        logger.debug("Acquired the lock %s", path)
+        try:
+            yield path
+        finally:
+            beat.stop()
+            os.ftruncate(fd, 0)
+            fcntl.flock(fd, fcntl.LOCK_UN)
+    finally:
+        os.close(fd)
+    if broken.is_set():
+        raise LockBrokenError(f"The lock {path} was broken by another run, the result can not be trusted")
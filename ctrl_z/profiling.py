@@ -0,0 +1,143 @@
+"""
+Profiling of backup and restore runs.
+
+With ``--profile``, every phase of the run (rotation, database dumps, file
+copies...) runs under cProfile, and the resource usage of every subprocess
+(pg_dump, pg_restore...) is collected with ``wait4``. The results are written
+as a bundle for offline analysis::
+
+    profile/
+        summary.json        phase durations and subprocess resource usage
+        summary.txt         the same, plus the top functions of every phase
+        01-databases.prof   cProfile stats, for pstats or snakeviz
+
+Python time shows up in the cProfile stats, time waiting for subprocesses as
+``wait4``/``read`` calls there and as CPU time and block I/O of the processes.
+"""
+import cProfile
+import io
+import json
+import logging
+import os
+import pstats
+import subprocess
+import time
+from contextlib import contextmanager
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+PROFILE_DIR = "profile"
+
+TOP_FUNCTIONS = 25
+
+# the profiler of the current run, if profiling
+_active = None
+
+
+class Profiler:
+    def __init__(self):
+        self.phases = []
+        self.processes = []
+        self.current_phase = None
+
+    def __enter__(self):
+        global _active
+        _active = self
+        return self
+
+    def __exit__(self, *exc_info):
+        global _active
+        _active = None
+
+    @contextmanager
+    def phase(self, name: str):
+        """
+        Profile a phase of the run with cProfile.
+        """
+        profile = cProfile.Profile()
+        previous, self.current_phase = self.current_phase, name
+        start = time.monotonic()
+        profile.enable()
+        try:
+            yield
+        finally:
+            profile.disable()
+            self.phases.append({"name": name, "seconds": round(time.monotonic() - start, 3), "profile": profile})
+            self.current_phase = previous
+
+    def record_process(self, args: List[str], rusage, returncode: int):
+        self.processes.append(
+            {
+                "command": os.path.basename(str(args[0])),
+                "args": [str(arg) for arg in args[1:]],
+                "phase": self.current_phase,
+                "returncode": returncode,
+                "user_seconds": round(rusage.ru_utime, 3),
+                "system_seconds": round(rusage.ru_stime, 3),
+                # kilobytes on Linux
+                "max_rss": rusage.ru_maxrss,
+                "blocks_in": rusage.ru_inblock,
+                "blocks_out": rusage.ru_oublock,
+            }
+        )
+
+    def get_summary(self) -> dict:
+        return {
+            "phases": [{"name": phase["name"], "seconds": phase["seconds"]} for phase in self.phases],
+            "processes": self.processes,
+        }
+
+    def write(self, directory: str) -> str:
+        """
+        Write the profile bundle into ``directory``.
+
+        :return: the path of the bundle
+        """
+        path = os.path.join(directory, PROFILE_DIR)
+        os.makedirs(path, exist_ok=True)
+
+        report = io.StringIO()
+        for index, phase in enumerate(self.phases, 1):
+            phase["profile"].dump_stats(os.path.join(path, f"{index:02d}-{phase['name']}.prof"))
+            report.write(f"== {phase['name']}: {phase['seconds']}s ==\n")
+            stats = pstats.Stats(phase["profile"], stream=report)
+            stats.sort_stats("cumulative").print_stats(TOP_FUNCTIONS)
+
+        report.write("== subprocesses ==\n")
+        for process in self.processes:
+            report.write(
+                "{command} ({phase}): {user_seconds}s user, {system_seconds}s system, max RSS {max_rss} kB, "
+                "{blocks_in} blocks in, {blocks_out} blocks out, exit code {returncode}\n".format(**process)
+            )
+
+        with open(os.path.join(path, "summary.json"), "w") as outfile:
+            json.dump(self.get_summary(), outfile, indent=2)
+        with open(os.path.join(path, "summary.txt"), "w") as outfile:
+            outfile.write(report.getvalue())
+
+        logger.info("Profile written to %s", path)
+        return path
+
+
+def get_profiler() -> Optional[Profiler]:
+    return _active
+
+
+def wait(process: subprocess.Popen) -> int:
+    """
+    Wait for a process, like :meth:`subprocess.Popen.wait`, recording its
+    resource usage when profiling.
+    """
+    profiler = _active
+    if profiler is None or process.returncode is not None:
+        return process.wait()
+
+    try:
+        _pid, status, rusage = os.wait4(process.pid, 0)
+    except ChildProcessError:
+        # already reaped elsewhere
+        return process.wait()
+    process.returncode = os.waitstatus_to_exitcode(status)
+    profiler.record_process(process.args, rusage, process.returncode)
+    return process.returncode
@@ -0,0 +1,209 @@
+"""
+Progress reporting for long-running dumps, restores and copies.
+
+Progress is drawn on a single console line when stderr is a TTY, and logged
+as a periodic line otherwise (cron, systemd), so a slow run can be told apart
+from a hung one.
+"""
+import logging
+import os
+import re
+import sys
+import threading
+import time
+import weakref
+from datetime import timedelta
+from typing import Callable, Iterable, Iterator, List, Optional
+
+from .streams import BoundedBuffer
+from .walk import WalkEntry
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_INTERVAL = 30
+
+# minimum time between redraws of the console line
+TTY_INTERVAL = 0.5
+
+# pg_dump/pg_restore --verbose chatter, as opposed to errors, warnings and their context
+VERBOSE_PATTERN = re.compile(rb"^(pg_dump|pg_restore): (?!error|warning|detail|hint|while |from TOC entry|\[)")
+
+# the verbose lines marking the start of a TOC entry
+RESTORE_ITEM_PATTERN = re.compile(rb"^pg_restore: (creating|processing data for|executing) ")
+DUMP_ITEM_PATTERN = re.compile(rb"^pg_dump: dumping contents of table ")
+
+# the unfinished progress of the running operations, for the status of ``ctrl-z serve``
+_active = weakref.WeakSet()
+_active_lock = threading.Lock()
+
+
+def format_bytes(size: float) -> str:
+    for unit in ("B", "KiB", "MiB", "GiB", "TiB"):
+        if abs(size) < 1024 or unit == "TiB":
+            break
+        size /= 1024
+    return f"{size:.1f} {unit}" if unit != "B" else f"{int(size)} B"
+
+
+class Progress:
+    """
+    Track the items and bytes done of a unit of work.
+
+    :param label: what is being done, e.g. ``Restoring mydb``
+    :param unit: name of the items, e.g. ``files`` or ``TOC entries``
+    :param interval: seconds between log lines when not on a TTY, 0 to only
+      log when done
+    """
+
+    def __init__(
+        self,
+        label: str,
+        unit: str = "files",
+        total_items: Optional[int] = None,
+        total_bytes: Optional[int] = None,
+        interval: float = DEFAULT_INTERVAL,
+        stream=None,
+    ):
+        self.label = label
+        self.unit = unit
+        self.total_items = total_items
+        self.total_bytes = total_bytes
+        self.interval = interval
+        self.stream = stream or sys.stderr
+        self.tty = hasattr(self.stream, "isatty") and self.stream.isatty()
+
+        self.items = 0
+        self.bytes = 0
+        self.started = time.monotonic()
+        self.last_output = self.started
+        with _active_lock:
+            _active.add(self)
+
+    def update(self, items: int = 1, nbytes: int = 0):
+        self.items += items
+        self.bytes += nbytes
+
+        if not self.tty and not self.interval:
+            return
+        now = time.monotonic()
+        if now - self.last_output >= (TTY_INTERVAL if self.tty else self.interval):
+            self.last_output = now
+            self._output()
+
+    def finish(self):
+        with _active_lock:
+            _active.discard(self)
+        if self.tty:
+            self.stream.write(f"\r{self.render()}\n")
+            self.stream.flush()
+        logger.info("%s: done, %s", self.label, self.render(final=True))
+
+    def _output(self):
+        if self.tty:
+            # pad to overwrite a previous, longer line
+            self.stream.write(f"\r{self.render():<79}")
+            self.stream.flush()
+        else:
+            logger.info("%s", self.render())
+
+    def eta(self) -> Optional[timedelta]:
+        """
+        Estimate the remaining time from the throughput so far, by bytes if
+        the total is known, otherwise by items.
+        """
+        elapsed = time.monotonic() - self.started
+        if self.total_bytes and self.bytes:
+            fraction = self.bytes / self.total_bytes
+        elif self.total_items and self.items:
+            fraction = self.items / self.total_items
+        else:
+            return None
+        fraction = min(fraction, 1)
+        return timedelta(seconds=round(elapsed / fraction - elapsed))
+
+    def render(self, final: bool = False) -> str:
+        elapsed = max(time.monotonic() - self.started, 1e-6)
+        items = f"{self.items}/{self.total_items}" if self.total_items is not None else str(self.items)
+        parts = [f"{items} {self.unit}"]
+        if self.bytes or self.total_bytes:
+            total = f"/{format_bytes(self.total_bytes)}" if self.total_bytes is not None else ""
+            parts.append(f"{format_bytes(self.bytes)}{total}")
+            parts.append(f"{format_bytes(self.bytes / elapsed)}/s")
+        else:
+            parts.append(f"{self.items / elapsed:.1f} {self.unit}/s")
+
+        if final:
+            parts.append(f"in {timedelta(seconds=round(elapsed))}")
+        else:
+            eta = self.eta()
+            if eta is not None:
+                parts.append(f"ETA {eta}")
+        prefix = "" if final else f"{self.label}: "
+        return prefix + ", ".join(parts)
+
+    def wrap_copy(self, copy_function: Callable) -> Callable:
+        """
+        Wrap a ``copy_function`` to count the copied files and bytes.
+        """
+
+        def copy(src, dst, *args, **kwargs):
+            result = copy_function(src, dst, *args, **kwargs)
+            self.update(1, os.path.getsize(src))
+            return result
+
+        return copy
+
+    def track(self, entries: Iterable[WalkEntry]) -> Iterator[WalkEntry]:
+        """
+        Count copied walk entries, by the sizes the walk already stat'ed.
+        """
+        for entry in entries:
+            if not entry.is_dir:
+                self.update(1, entry.stat.st_size)
+            yield entry
+
+
+def get_active() -> List[str]:
+    """
+    Render the progress of the operations that are running.
+    """
+    with _active_lock:
+        active = sorted(_active, key=lambda progress: progress.started)
+    return [progress.render() for progress in active]
+
+
+class OutputFollower(threading.Thread):
+    """
+    Read the ``--verbose`` stderr of pg_dump/pg_restore in the background.
+
+    Lines matching ``item_pattern`` update the progress, the remaining verbose
+    chatter (matching ``verbose_pattern``) is dropped and everything else
+    (errors, warnings) is kept in :attr:`output`.
+    """
+
+    def __init__(self, stream, progress: Progress, item_pattern=RESTORE_ITEM_PATTERN, verbose_pattern=VERBOSE_PATTERN):
+        super().__init__(daemon=True)
+        self.stream = stream
+        self.progress = progress
+        self.item_pattern = item_pattern
+        self.verbose_pattern = verbose_pattern
+        self.buffer = BoundedBuffer()
+
+    def run(self):
+        for line in self.stream:
+            if self.item_pattern is not None and self.item_pattern.match(line):
+                self.progress.update()
+            elif self.verbose_pattern is None or not self.verbose_pattern.match(line):
+                self.buffer.write(line)
+        self.stream.close()
+
+    @property
+    def output(self) -> bytes:
+        return self.buffer.getvalue()
+
+
+def count_toc_entries(lines: Iterable[bytes]) -> int:
+    """
+    Count the entries in ``pg_restore --list`` output, skipping the comments.
+    """
+    return sum(1 for line in lines if line.strip() and not line.startswith(b";"))
@@ -0,0 +1,127 @@
+"""
+Compact reporting on a backup/restore run.
+
+The log file in a backup directory is appended to by every run writing into
+that directory, and can grow large with verbose subprocess output. Instead of
+mailing the whole file, a :class:`ReportHandler` keeps a bounded view of the
+current run which is rendered into the report body. The full log output of
+the run is attached gzip-compressed.
+"""
+import gzip
+import io
+import logging
+import os
+import shutil
+from collections import Counter, deque
+from datetime import datetime, timezone
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+CHUNK_SIZE = 64 * 1024
+
+
+class ReportHandler(logging.Handler):
+    """
+    Logging handler keeping a bounded summary of the current run in memory.
+
+    :param tail_lines: amount of most recent log lines to keep
+    :param max_errors: amount of error records to keep
+    :param logfile: path to the log file of the run, used to determine which
+      part of the file belongs to the current run
+    """
+
+    def __init__(
+        self,
+        tail_lines: int = 100,
+        max_errors: int = 50,
+        logfile: Optional[str] = None,
+        level=logging.NOTSET,
+    ):
+        super().__init__(level=level)
+        self.tail = deque(maxlen=tail_lines)
+        self.errors = deque(maxlen=max_errors)
+        self.counts = Counter()
+        self.started = datetime.now(timezone.utc)
+        self.logfile = logfile
+        self.log_offset = os.path.getsize(logfile) if logfile and os.path.exists(logfile) else 0
+
+    def emit(self, record: logging.LogRecord):
+        try:
+            line = self.format(record)
+        except Exception:  # pragma: no cover - same as logging.StreamHandler
+            self.handleError(record)
+            return
+
+        self.counts[record.levelname] += 1
+        self.tail.append(line)
+        if record.levelno >= logging.ERROR:
+            self.errors.append(line)
+
+    def render(self, has_errors: bool) -> str:
+        """
+        Render the report body: a summary, the errors and the log tail.
+        """
+        status = "FAILED" if has_errors else "SUCCEEDED"
+        duration = datetime.now(timezone.utc) - self.started
+        counts = ", ".join(f"{level}: {count}" for level, count in sorted(self.counts.items())) or "none"
+
+        sections = [
+            "Summary",
+            "=======",
+            f"Status: {status}",
+            f"Started: {self.started:%Y-%m-%d %H:%M:%S %Z}",
+            f"Duration: {duration}",
+            f"Log records: {counts}",
+            "",
+        ]
+
+        if self.errors:
+            sections += ["Errors", "======", *self.errors, ""]
+
+        sections += [
+            f"Last {len(self.tail)} log lines",
+            "=================",
+            *self.tail,
+            "",
+        ]
+        return "\n".join(sections)
+
+    def compressed_log(self) -> Optional[bytes]:
+        """
+        Return the log output of the current run, gzip-compressed.
+        """
+        if not self.logfile or not os.path.exists(self.logfile):
+            return None
+
+        self.flush()
+        return compress_file(self.logfile, offset=self.log_offset)
+
+
+def get_report_handler(logger_name: str = "ctrl_z") -> Optional[ReportHandler]:
+    """
+    Find the report handler installed by :func:`ctrl_z.backup.configure_logging`.
+    """
+    for handler in logging.getLogger(logger_name).handlers:
+        if isinstance(handler, ReportHandler):
+            return handler
+    return None
+
+
+def compress_file(path: str, offset: int = 0) -> bytes:
+    """
+    Gzip the content of ``path`` from ``offset`` onwards, streaming in chunks.
+    """
+    buffer = io.BytesIO()
+    with open(path, "rb") as infile, gzip.GzipFile(fileobj=buffer, mode="wb") as outfile:
+        infile.seek(offset)
+        shutil.copyfileobj(infile, outfile, CHUNK_SIZE)
+    return buffer.getvalue()
+
+
+def tail_file(path: str, lines: int) -> str:
+    """
+    Return the last ``lines`` lines of a text file without reading it into memory.
+    """
+    with open(path, "r") as infile:
+        return "".join(deque(infile, maxlen=lines))
@@ -2,27 +2,48 @@ import logging
 import os
 import re
 import shutil
-from datetime import date, datetime, timezone
+from datetime import date, datetime, timedelta, timezone
 from itertools import chain
 from typing import Union
 
 from dateutil.relativedelta import relativedelta
-from dateutil.rrule import DAILY, WEEKLY, rrule
+from dateutil.rrule import DAILY, MONTHLY, WEEKLY, rrule
 
 logger = logging.getLogger(__name__)
 
+# the suffix of a backup being moved into a storage tier, see ctrl_z.tiers
+PARTIAL_SUFFIX = ".partial"
+
 
 class RetentionPolicy:
-    __slots__ = ["day_of_week", "days_to_keep", "weeks_to_keep"]
+    __slots__ = [
+        "day_of_week",
+        "days_to_keep",
+        "weeks_to_keep",
+        "day_of_month",
+        "months_to_keep",
+        "hours_to_keep",
+    ]
 
     DATE_FORMAT = "%Y-%m-%d"
+    HOUR_FORMAT = "%Y-%m-%d-%H%M"
 
-    BACKUP_DIR_PATTERN = re.compile(r"^2[0-9]{3}-[0-1][0-9]-[0-3][0-9]-(daily|weekly)")
+    BACKUP_DIR_PATTERN = re.compile(
+        r"^2[0-9]{3}-[0-1][0-9]-[0-3][0-9]-(daily|weekly|monthly|[0-2][0-9][0-5][0-9]-hourly)"
+    )
 
     def __init__(self, **config):
+        # tiers added later default to disabled, for existing config files
+        self.day_of_month = 1
+        self.months_to_keep = 0
+        self.hours_to_keep = 0
+
         for key, value in config.items():
             setattr(self, key, value)
 
+        if not 1 <= self.day_of_month <= 28:
+            raise ValueError("day_of_month must be between 1 and 28, so that every month has one")
+
     def serialize(self):
         return {key: getattr(self, key) for key in self.__slots__}
 
@@ -30,26 +51,48 @@ class RetentionPolicy:
         """
         Test if a directory name fits the pattern of backup folder names.
 
-        The pattern is YYYY-MM-DD-suffix, where suffix is either 'daily' or 'weekly'.
+        The pattern is YYYY-MM-DD-suffix, where suffix is either 'daily',
+        'weekly' or 'monthly', or YYYY-MM-DD-HHMM-hourly.
         """
         if self.BACKUP_DIR_PATTERN.match(dir_name):
             return True
         return False
 
     def get_suffix(self, dt: Union[date, datetime]) -> str:
+        if self.months_to_keep and dt.day == self.day_of_month:
+            return "monthly"
         return "weekly" if dt.weekday() == self.day_of_week else "daily"
 
+    def get_timestamp(self, dir_name: str) -> datetime:
+        """
+        Get the moment a backup directory refers to, for ordering purposes.
+
+        Daily, weekly and monthly backups refer to the start of their day.
+        """
+        if dir_name.endswith("-hourly"):
+            moment = datetime.strptime(dir_name[:15], self.HOUR_FORMAT)
+        else:
+            moment = datetime.strptime(dir_name[:10], self.DATE_FORMAT)
+        return moment.replace(tzinfo=timezone.utc)
+
     def get_base_dir(self, base: str) -> str:
         """
         Figure out the folder name for the current backup.
 
+        The first backup of a day is the daily (or weekly/monthly) backup. If
+        hourly backups are enabled, later backups on the same day get their
+        own, timestamped directory instead of replacing the daily one.
+
         :param str base: the base directory where all the date-stamped backups
             are kept.
         """
         now = datetime.now(timezone.utc)
         datestamp = now.strftime(self.DATE_FORMAT)
         suffix = self.get_suffix(now)
-        return os.path.join(base, f"{datestamp}-{suffix}")
+        base_dir = os.path.join(base, f"{datestamp}-{suffix}")
+        if self.hours_to_keep and os.path.exists(base_dir):
+            return os.path.join(base, f"{now.strftime(self.HOUR_FORMAT)}-hourly")
+        return base_dir
 
     def rotate(self, base: str):
         """
@@ -69,8 +112,19 @@ class RetentionPolicy:
         weekly_start = now - relativedelta(weeks=self.weeks_to_keep - 1, days=days_since_day_of_week)
         weeklies = rrule(WEEKLY, dtstart=weekly_start, count=self.weeks_to_keep)
 
-        to_keep = sorted({f"{dt.strftime(self.DATE_FORMAT)}-{self.get_suffix(dt)}" for dt in chain(dailies, weeklies)})
-        logger.debug("Keeping backups from: %r", to_keep)
+        # if this month's backup day is still to come, start counting from last month
+        months_back = self.months_to_keep - (1 if now.day >= self.day_of_month else 0)
+        monthly_start = now - relativedelta(months=months_back, day=1)
+        monthlies = rrule(MONTHLY, dtstart=monthly_start, count=self.months_to_keep, bymonthday=self.day_of_month)
+
+        # one less hour, since we're (possibly) generating 'now'
+        hourly_start = now.replace(minute=0, second=0, microsecond=0) - timedelta(hours=self.hours_to_keep - 1)
+
+        # a set, so that a single pass over the directories decides what to keep
+        to_keep = {
+            f"{dt.strftime(self.DATE_FORMAT)}-{self.get_suffix(dt)}" for dt in chain(dailies, weeklies, monthlies)
+        }
+        logger.debug("Keeping backups from: %r", sorted(to_keep))
 
         to_delete = []
         for dir_name in os.listdir(base):
@@ -78,10 +132,19 @@ class RetentionPolicy:
                 logger.debug("%s doesn't look like a backup directory, keeping it.", dir_name)
                 continue
 
+            if dir_name.endswith(PARTIAL_SUFFIX):
+                # a move into this tier, which removes it itself if it fails
+                logger.debug("%s is being moved into a storage tier, keeping it", dir_name)
+                continue
+
             if dir_name in to_keep:
                 logger.debug("%s falls within the retention policy, keeping it", dir_name)
                 continue
 
+            if self.hours_to_keep and dir_name.endswith("-hourly") and self.get_timestamp(dir_name) >= hourly_start:
+                logger.debug("%s falls within the hourly retention policy, keeping it", dir_name)
+                continue
+
             to_delete.append(os.path.join(base, dir_name))
 
         for path in to_delete:
@@ -0,0 +1,148 @@
+"""
+Retries of transient failures.
+
+A network blip during a dump or a stale NFS handle during a copy should not
+fail the whole backup. Every database dump or restore and every directory copy
+is a unit of work, retried on its own according to the retry policy of its
+kind (``retry.database``, ``retry.files``):
+
+.. code-block:: yaml
+
+    retry:
+      files:
+        attempts: 3
+        backoff: 10
+        errors: [EIO, ESTALE]
+
+An error is retryable if it is (or was caused by) an :class:`OSError` with one
+of the configured ``errors`` as errno, or if its message contains such an
+``[Errno N]`` or one of the configured ``messages`` - errors of ``pg_dump``
+and other subprocesses only reach ctrl-z as their output.
+
+Nothing is retried unless ``attempts`` is configured.
+"""
+import errno
+import logging
+import re
+import time
+from typing import Callable, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+ERRNO_PATTERN = re.compile(r"\[Errno (\d+)\]")
+
+# retries are opt-in, a retried dump or copy can take long and mask real
+# problems; the errors and messages apply once ``attempts`` is raised
+DEFAULT_POLICIES = {
+    "database": {
+        "attempts": 1,
+        "backoff": 10,
+        "errors": ["ECONNREFUSED", "ECONNRESET", "ETIMEDOUT", "EHOSTUNREACH", "ENETUNREACH"],
+        "messages": [
+            "could not connect to server",
+            "connection refused",
+            "connection timed out",
+            "server closed the connection unexpectedly",
+            "timeout expired",
+            "Lost connection to MySQL server",
+            "Can't connect to MySQL server",
+        ],
+    },
+    "files": {
+        "attempts": 1,
+        "backoff": 10,
+        "errors": ["EIO", "ESTALE", "ETIMEDOUT"],
+        "messages": [],
+    },
+}
+
+
+class RetryPolicy:
+    """
+    :param attempts: how often to try at most, 1 to never retry
+    :param backoff: seconds to wait before the first retry, doubled for every
+      next retry up to ``max_backoff``
+    :param errors: names of the retryable errnos, such as ``ESTALE``
+    :param messages: retryable errors contain one of these, case-insensitive
+    """
+
+    __slots__ = ["attempts", "backoff", "max_backoff", "errnos", "messages"]
+
+    def __init__(
+        self,
+        attempts: int = 1,
+        backoff: float = 10,
+        max_backoff: float = 300,
+        errors: Iterable[str] = (),
+        messages: Iterable[str] = (),
+    ):
+        self.attempts = max(attempts, 1)
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.errnos = {self._get_errno(name) for name in errors}
+        self.messages = [message.lower() for message in messages]
+
+    def __repr__(self):
+        return f"RetryPolicy(attempts={self.attempts}, backoff={self.backoff})"
+
+    @classmethod
+    def from_config(cls, kind: str, config: Optional[dict]) -> "RetryPolicy":
+        """
+        Build the policy of a kind of work, from its config and the defaults.
+        """
+        return cls(**{**DEFAULT_POLICIES[kind], **(config or {})})
+
+    @staticmethod
+    def _get_errno(name: str) -> int:
+        try:
+            return getattr(errno, name)
+        except AttributeError:
+            raise ValueError(f"Unknown error '{name}', use errno names such as ESTALE")
+
+    def get_delay(self, retry: int) -> float:
+        """
+        Get the seconds to wait before the ``retry``-th retry, starting at 1.
+        """
+        return min(self.backoff * 2 ** (retry - 1), self.max_backoff)
+
+    def is_retryable(self, exc: BaseException) -> bool:
+        seen: List[BaseException] = []
+        while exc is not None and exc not in seen:
+            seen.append(exc)
+            if isinstance(exc, OSError) and exc.errno in self.errnos:
+                return True
+            message = str(exc)
+            if any(int(number) in self.errnos for number in ERRNO_PATTERN.findall(message)):
+                return True
+            lowered = message.lower()
+            if any(pattern in lowered for pattern in self.messages):
+                return True
+            exc = exc.__cause__ or exc.__context__
+        return False
+
+    def call(self, function: Callable, *args, description: str = "", cleanup: Optional[Callable] = None, **kwargs):
+        """
+        Call ``function``, retrying it on retryable errors.
+
+        :param description: what is being done, for the log
+        :param cleanup: called before every retry, to remove partial output
+        """
+        description = description or getattr(function, "__name__", repr(function))
+        for attempt in range(1, self.attempts + 1):
+            try:
+                return function(*args, **kwargs)
+            except Exception as exc:
+                if attempt == self.attempts or not self.is_retryable(exc):
+                    raise
+                delay = self.get_delay(attempt)
+                logger.warning(
+                    "Attempt %d of %d to %s failed: %s - retrying in %ss",
+                    attempt,
+                    self.attempts,
+                    description,
+                    exc,
+                    delay,
+                )
+                time.sleep(delay)
+                if cleanup is not None:
+                    cleanup()
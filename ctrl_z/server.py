@@ -0,0 +1,366 @@
+"""
+Long-running ``ctrl-z serve`` mode.
+
+Instead of a fresh process per cron tick, a single process sets up Django once
+and runs the backups itself:
+
+* a scheduler queues backups at the configured moments (``serve.schedule``);
+* a queue takes ad-hoc backup and restore requests, which run one at a time
+  (and under the lock on the backup root, see :mod:`ctrl_z.lock`);
+* a small HTTP endpoint, on a Unix socket or a local port, shows the running
+  job with its progress, the queue and the history of recent runs::
+
+    curl --unix-socket /var/backups/ctrl-z.sock http://localhost/status
+    curl --unix-socket /var/backups/ctrl-z.sock -H "Authorization: Bearer $CTRL_Z_SERVE_TOKEN" \
+        -H "Content-Type: application/json" -d '{"files": false}' http://localhost/backup
+
+Queueing jobs requires the token set in the ``serve`` config (``token_file``
+or ``token_env``), the socket is only accessible by its owner.
+"""
+import hmac
+import http.server
+import itertools
+import json
+import logging
+import os
+import queue
+import socketserver
+import threading
+from collections import deque
+from datetime import datetime, timedelta
+from typing import List, Optional
+
+from .backup import Backup, configure_logging
+from .config import Config
+from .progress import get_active
+
+logger = logging.getLogger(__name__)
+
+SOCKET_FILENAME = "ctrl-z.sock"
+DEFAULT_TOKEN_ENV = "CTRL_Z_SERVE_TOKEN"
+
+# keyword arguments accepted per kind of job
+JOB_OPTIONS = {
+    "backup": {"db", "skip_db", "files", "version", "changed_files"},
+    "restore": {"backup_dir", "db", "skip_db", "files", "db_names", "db_hosts", "db_ports", "paths", "profile"},
+}
+
+
+class Job:
+    """
+    A backup or restore, queued or run by the server.
+    """
+
+    __slots__ = ["id", "kind", "options", "scheduled", "status", "queued", "started", "finished", "error", "summary"]
+
+    _ids = itertools.count(1)
+
+    def __init__(self, kind: str, options: dict, scheduled: bool = False):
+        if not isinstance(options, dict):
+            raise ValueError("The options must be a mapping")
+        unknown = set(options) - JOB_OPTIONS[kind]
+        if unknown:
+            raise ValueError(f"Unknown {kind} options: {', '.join(sorted(unknown))}")
+        if kind == "restore" and "backup_dir" not in options:
+            raise ValueError("A restore requires the backup_dir")
+
+        self.id = next(self._ids)
+        self.kind = kind
+        self.options = options
+        self.scheduled = scheduled
+        self.status = "queued"
+        self.queued = datetime.now()
+        self.started = None
+        self.finished = None
+        self.error = None
+        self.summary = None
+
+    def __repr__(self):
+        return f"Job(id={self.id}, kind={self.kind!r}, status={self.status!r})"
+
+    def as_dict(self) -> dict:
+        return {
+            "id": self.id,
+            "kind": self.kind,
+            "options": self.options,
+            "scheduled": self.scheduled,
+            "status": self.status,
+            "queued": self.queued.isoformat(),
+            "started": self.started.isoformat() if self.started else None,
+            "finished": self.finished.isoformat() if self.finished else None,
+            "error": self.error,
+            "summary": self.summary,
+        }
+
+
+class ScheduleEntry:
+    """
+    A backup run daily ``at`` a time (``HH:MM``, local time) or ``every`` so
+    many minutes.
+    """
+
+    __slots__ = ["at", "every", "options"]
+
+    def __init__(self, at: Optional[str] = None, every: Optional[int] = None, **options):
+        if (at is None) == (every is None):
+            raise ValueError("A schedule entry requires either 'at' or 'every'")
+        unknown = set(options) - JOB_OPTIONS["backup"]
+        if unknown:
+            raise ValueError(f"Unknown backup options: {', '.join(sorted(unknown))}")
+        self.at = datetime.strptime(at, "%H:%M").time() if at is not None else None
+        self.every = timedelta(minutes=every) if every is not None else None
+        self.options = options
+
+    def next_run(self, after: datetime) -> datetime:
+        if self.every is not None:
+            return after + self.every
+        moment = datetime.combine(after.date(), self.at)
+        if moment <= after:
+            moment += timedelta(days=1)
+        return moment
+
+
+def _get_schedule_entry(entry: dict) -> ScheduleEntry:
+    if not isinstance(entry, dict):
+        raise ValueError(f"Invalid schedule entry {entry!r}, expected a mapping")
+    try:
+        return ScheduleEntry(**entry)
+    except (TypeError, ValueError) as exc:
+        raise ValueError(f"Invalid schedule entry {entry!r}: {exc}")
+
+
+def load_token(config: dict) -> Optional[str]:
+    """
+    Load the token from the file or environment variable set in the config.
+    """
+    token_file = config.get("token_file")
+    if token_file:
+        with open(token_file) as infile:
+            return infile.read().strip() or None
+    token_env = config.get("token_env") or DEFAULT_TOKEN_ENV
+    return os.environ.get(token_env, "").strip() or None
+
+
+class Server:
+    def __init__(self, config_file: str, config: Config):
+        self.config_file = config_file
+        options = config.serve
+        self.schedule = [_get_schedule_entry(entry) for entry in options.get("schedule") or []]
+        self.token = load_token(options)
+        self.socket = options.get("socket") or os.path.join(os.path.dirname(config.base_dir), SOCKET_FILENAME)
+        self.port = options.get("port")
+
+        self.queue = queue.Queue()
+        self.queued: List[Job] = []
+        self.current: Optional[Job] = None
+        self.history = deque(maxlen=options.get("history", 20))
+        self.next_runs: List[datetime] = []
+
+        self._lock = threading.Lock()
+        self._stopping = threading.Event()
+        self._httpd = None
+
+    def submit(self, kind: str, options: dict, scheduled: bool = False) -> Job:
+        job = Job(kind, options, scheduled=scheduled)
+        with self._lock:
+            self.queued.append(job)
+        self.queue.put(job)
+        logger.info("Queued %s job %d", kind, job.id)
+        return job
+
+    def get_status(self) -> dict:
+        with self._lock:
+            current = self.current.as_dict() if self.current else None
+            status = {
+                "current": current,
+                "progress": get_active() if current else [],
+                "queued": [job.as_dict() for job in self.queued],
+                "history": [job.as_dict() for job in reversed(self.history)],
+                "next_run": min(self.next_runs).isoformat() if self.next_runs else None,
+            }
+        return status
+
+    def serve_forever(self):
+        logger.info("Serving on %s", self.port and f"127.0.0.1:{self.port}" or self.socket)
+        self.start()
+        try:
+            while not self._stopping.is_set():
+                self.process_next(timeout=1)
+        finally:
+            self.shutdown()
+
+    def start(self):
+        if self.port:
+            self._httpd = LocalHTTPServer(("127.0.0.1", self.port), StatusHandler)
+        else:
+            if os.path.exists(self.socket):
+                os.remove(self.socket)
+            self._httpd = UnixHTTPServer(self.socket, StatusHandler)
+        if not self.token:
+            logger.warning("No serve token is configured, backups and restores can not be requested")
+        self._httpd.backup_server = self
+        threading.Thread(target=self._httpd.serve_forever, daemon=True).start()
+        threading.Thread(target=self._run_scheduler, daemon=True).start()
+
+    def stop(self):
+        """
+        Stop after the running job.
+        """
+        self._stopping.set()
+
+    def shutdown(self):
+        if self._httpd is not None:
+            self._httpd.shutdown()
+            self._httpd.server_close()
+            if not self.port and os.path.exists(self.socket):
+                os.remove(self.socket)
+
+    def process_next(self, timeout: Optional[float] = None) -> Optional[Job]:
+        """
+        Run the next queued job, waiting at most ``timeout`` seconds for one.
+        """
+        try:
+            job = self.queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+        with self._lock:
+            self.queued.remove(job)
+            self.current = job
+            job.status = "running"
+            job.started = datetime.now()
+        try:
+            self._run(job)
+            job.status = "succeeded"
+        except Exception as exc:
+            job.status = "failed"
+            job.error = str(exc)
+        finally:
+            with self._lock:
+                job.finished = datetime.now()
+                self.current = None
+                self.history.append(job)
+        return job
+
+    def _run(self, job: Job):
+        options = dict(job.options)
+        if job.kind == "restore":
+            backup_dir = options.pop("backup_dir")
+            if not os.path.isdir(backup_dir):
+                # the name of a backup in any storage tier
+                backup_dir = Backup.from_config(self.config_file).find_backup(backup_dir) or backup_dir
+            backup = Backup.prepare_restore(self.config_file, backup_dir)
+        else:
+            # a fresh instance per run, the base directory depends on the moment
+            backup = Backup.from_config(self.config_file)
+        configure_logging(backup.config)
+        backup.summary.kind = job.kind
+
+        error = None
+        try:
+            if job.kind == "restore":
+                backup.restore(**options)
+            else:
+                backup.full(**options)
+        except Exception as exc:
+            error = exc
+            logger.exception("%s job %d failed", job.kind.capitalize(), job.id)
+            raise
+        finally:
+            job.summary = backup.finish_summary(error).as_dict()
+            backup.report(error is not None)
+
+    def _run_scheduler(self):
+        now = datetime.now()
+        runs = [entry.next_run(now) for entry in self.schedule]
+        while not self._stopping.is_set():
+            with self._lock:
+                self.next_runs = list(runs)
+            if not runs:
+                return
+            index = min(range(len(runs)), key=runs.__getitem__)
+            delay = (runs[index] - datetime.now()).total_seconds()
+            if delay > 0:
+                self._stopping.wait(min(delay, 60))
+                continue
+
+            entry = self.schedule[index]
+            with self._lock:
+                pending = any(job.scheduled for job in self.queued)
+            if pending:
+                # the previous scheduled run did not even start yet
+                logger.warning("Skipping the scheduled backup, the previous one is still queued")
+            else:
+                try:
+                    self.submit("backup", dict(entry.options), scheduled=True)
+                except ValueError:
+                    logger.exception("Could not queue the scheduled backup")
+            runs[index] = entry.next_run(max(runs[index], datetime.now()))
+
+
+class StatusHandler(http.server.BaseHTTPRequestHandler):
+    """
+    ``GET /status``, ``POST /backup`` and ``POST /restore`` with the options
+    as JSON body.
+    """
+
+    def do_GET(self):
+        if self.path != "/status":
+            self._respond(404, {"error": "Not found"})
+            return
+        self._respond(200, self.server.backup_server.get_status())
+
+    def do_POST(self):
+        kind = self.path.strip("/")
+        if kind not in JOB_OPTIONS:
+            self._respond(404, {"error": "Not found"})
+            return
+        token = self.server.backup_server.token
+        if not token:
+            self._respond(403, {"error": "No serve token is configured"})
+            return
+        scheme, _, given = (self.headers.get("Authorization") or "").partition(" ")
+        if scheme.lower() != "bearer" or not hmac.compare_digest(given.strip().encode(), token.encode()):
+            self._respond(401, {"error": "Invalid or missing token"})
+            return
+        # a form can not be posted cross-origin with a JSON content type
+        if self.headers.get_content_type() != "application/json":
+            self._respond(415, {"error": "The body must be application/json"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length") or 0)
+            options = json.loads(self.rfile.read(length) or b"{}")
+            job = self.server.backup_server.submit(kind, options)
+        except (ValueError, TypeError) as exc:
+            self._respond(400, {"error": str(exc)})
+            return
+        self._respond(202, job.as_dict())
+
+    def _respond(self, status: int, body: dict):
+        content = json.dumps(body, indent=2).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(content)))
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        logger.debug("%s - %s", self.address_string(), format % args)
+
+
+class LocalHTTPServer(socketserver.ThreadingMixIn, http.server.HTTPServer):
+    daemon_threads = True
+
+
+class UnixHTTPServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def server_bind(self):
+        super().server_bind()
+        # only the owner may connect, before the socket starts listening
+        os.chmod(self.server_address, 0o600)
+
+    def get_request(self):
+        request, _address = super().get_request()
+        # BaseHTTPRequestHandler expects a (host, port) address
+        return request, ("local", 0)
@@ -0,0 +1,105 @@
+"""
+Database and file snapshots taken at the same moment.
+
+A full backup normally dumps the databases first and copies the files
+afterwards, so on a busy site the restored rows and files can be an hour
+apart. In consistent mode, all snapshots are taken up front:
+
+* every PostgreSQL database exports a snapshot (``pg_export_snapshot``) from a
+  transaction held open for the whole backup, and ``pg_dump --snapshot`` dumps
+  exactly that state;
+* every file directory is frozen, either as a tree of hard links or with a
+  filesystem snapshot command (LVM, btrfs, ZFS...).
+
+The dumps and copies then run in parallel from the snapshots.
+
+A hard-link freeze is quick and needs no special filesystem, but it only
+protects against files being added, deleted or replaced (the way Django's
+storages write them). A file modified in place is modified in the freeze too.
+"""
+import logging
+import os
+import shlex
+import shutil
+from contextlib import contextmanager
+from typing import Optional
+
+from django.db import connections, transaction
+
+from .fastcopy import link_or_copy
+from .streams import run_command
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_SUFFIX = ".ctrl-z-snapshot"
+
+
+class SnapshotError(Exception):
+    pass
+
+
+@contextmanager
+def export_snapshot(alias: str):
+    """
+    Export a snapshot of a PostgreSQL database, and hold it.
+
+    The snapshot can be imported by other sessions, e.g. ``pg_dump
+    --snapshot``, until the context exits. Queries on the connection of
+    ``alias`` in the same thread also see the snapshot.
+
+    :return: the snapshot id
+    """
+    with transaction.atomic(using=alias):
+        with connections[alias].cursor() as cursor:
+            cursor.execute("SET TRANSACTION ISOLATION LEVEL REPEATABLE READ, READ ONLY")
+            cursor.execute("SELECT pg_export_snapshot()")
+            (snapshot,) = cursor.fetchone()
+        logger.info("Exported snapshot %s of %s", snapshot, alias)
+        yield snapshot
+
+
+def get_snapshot_path(directory: str) -> str:
+    # next to the directory, so hard links stay on the same filesystem
+    return os.path.normpath(directory) + SNAPSHOT_SUFFIX
+
+
+@contextmanager
+def freeze_directory(directory: str, command: Optional[str] = None, release: Optional[str] = None):
+    """
+    Freeze the content of ``directory``.
+
+    Without a ``command``, the tree is hard-linked next to the directory. A
+    ``command`` (and ``release`` command) can take a filesystem snapshot
+    instead, with ``{source}`` and ``{snapshot}`` replaced by the paths.
+
+    :return: the path of the frozen copy
+    """
+    path = get_snapshot_path(directory)
+    if os.path.lexists(path):
+        logger.info("Removing stale snapshot %s", path)
+        _release(directory, path, release)
+
+    if command:
+        _run(command, directory, path)
+    else:
+        shutil.copytree(directory, path, symlinks=True, copy_function=link_or_copy)
+    logger.info("Froze %s at %s", directory, path)
+
+    try:
+        yield path
+    finally:
+        _release(directory, path, release)
+
+
+def _release(directory: str, path: str, release: Optional[str]):
+    if release:
+        _run(release, directory, path)
+    else:
+        shutil.rmtree(path)
+
+
+def _run(template: str, directory: str, path: str):
+    args = [arg.format(source=directory, snapshot=path) for arg in shlex.split(template)]
+    (returncode, _stdout, stderr) = run_command(args)
+    if returncode != 0:
+        raise SnapshotError(stderr.decode().strip() or f"{args[0]} exited with code {returncode}")
@@ -0,0 +1,91 @@
+"""
+Bounded handling of subprocess output.
+
+Outputs of pg_dump, pg_restore and friends can be arbitrarily large (think
+thousands of identical errors). They are read in fixed-size chunks, and only
+the head and the tail are kept - the parts that explain what went wrong.
+"""
+import subprocess
+import threading
+from typing import BinaryIO, List, Optional, Tuple
+
+from .profiling import wait
+
+CHUNK_SIZE = 64 * 1024
+
+# bytes kept of an output, half from the start and half from the end
+DEFAULT_LIMIT = 64 * 1024
+
+
+class BoundedBuffer:
+    """
+    Write-only buffer keeping the head and tail of everything written to it.
+    """
+
+    def __init__(self, limit: int = DEFAULT_LIMIT):
+        self.half = limit // 2
+        self.head = bytearray()
+        self.tail = bytearray()
+        self.dropped = 0
+
+    def write(self, data: bytes) -> int:
+        written = len(data)
+        room = self.half - len(self.head)
+        if room > 0:
+            self.head += data[:room]
+            data = data[room:]
+        if data:
+            self.tail += data
+            excess = len(self.tail) - self.half
+            if excess > 0:
+                del self.tail[:excess]
+                self.dropped += excess
+        return written
+
+    def getvalue(self) -> bytes:
+        if not self.dropped:
+            return bytes(self.head + self.tail)
+        return bytes(self.head) + f"\n[... {self.dropped} bytes omitted ...]\n".encode() + bytes(self.tail)
+
+
+def drain(stream: BinaryIO, buffer: BoundedBuffer, chunk_size: int = CHUNK_SIZE) -> BoundedBuffer:
+    """
+    Read a stream to its end into the buffer, in chunks.
+    """
+    while True:
+        chunk = stream.read(chunk_size)
+        if not chunk:
+            return buffer
+        buffer.write(chunk)
+
+
+def read_bounded(fileobj: BinaryIO, limit: int = DEFAULT_LIMIT) -> bytes:
+    """
+    Read the head and tail of a (temporary) file holding command output.
+    """
+    fileobj.seek(0)
+    return drain(fileobj, BoundedBuffer(limit)).getvalue()
+
+
+def run_command(
+    args: List[str],
+    env: Optional[dict] = None,
+    limit: int = DEFAULT_LIMIT,
+) -> Tuple[int, bytes, bytes]:
+    """
+    Run a command, like :meth:`subprocess.Popen.communicate` but with bounded
+    memory use.
+
+    :return: the exit code, and the (bounded) stdout and stderr output
+    """
+    process = subprocess.Popen(args, env=env, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+    stdout, stderr = BoundedBuffer(limit), BoundedBuffer(limit)
+    # both pipes are read at the same time, so a full pipe never blocks the command
+    reader = threading.Thread(target=drain, args=(process.stderr, stderr), daemon=True)
+    reader.start()
+    drain(process.stdout, stdout)
+    reader.join()
+    process.stdout.close()
+    process.stderr.close()
+    wait(process)
+    return process.returncode, stdout.getvalue(), stderr.getvalue()
@@ -0,0 +1,140 @@
+"""
+Machine-readable summary and exit codes of backup and restore runs.
+
+With ``--summary``, the CLI writes a JSON summary of the run to a file, or to
+stdout with ``--summary -``::
+
+    {
+      "kind": "backup",
+      "status": "partial",
+      "base_dir": "/var/backups/2026-10-19-daily",
+      "started": "2026-10-19T02:30:00+00:00",
+      "finished": "2026-10-19T02:41:12+00:00",
+      "seconds": 672.4,
+      "error": "Failed to back up: database 'reports'",
+      "phases": [{"name": "databases", "status": "succeeded", "seconds": 410.2, "error": null}, ...],
+      "units": [{"kind": "database", "name": "reports", "phase": "databases", "status": "failed",
+                 "seconds": 3.1, "bytes": null, "error": "pg_dump exited with code 1"}, ...]
+    }
+
+Units are the databases and directories of the run. A failing unit does not
+stop the others, so an orchestrator can retry only the failed ones
+(``--skip-db``, ``--no-files``...). The exit code of the CLI tells the outcome
+apart without parsing the summary, see the ``EXIT_*`` constants.
+"""
+import json
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from typing import List, Optional
+
+logger = logging.getLogger(__name__)
+
+EXIT_SUCCESS = 0
+# the run failed as a whole
+EXIT_FAILURE = 1
+# some databases or directories failed, the others succeeded
+EXIT_PARTIAL_FAILURE = 2
+# another run holds the lock on the backup root
+EXIT_LOCKED = 3
+
+EXIT_CODES = {
+    "succeeded": EXIT_SUCCESS,
+    "skipped": EXIT_SUCCESS,
+    "failed": EXIT_FAILURE,
+    "partial": EXIT_PARTIAL_FAILURE,
+    "locked": EXIT_LOCKED,
+}
+
+
+def _now() -> datetime:
+    return datetime.now(timezone.utc)
+
+
+class RunSummary:
+    """
+    The phases and units (databases, directories) of a run and their outcome.
+    """
+
+    def __init__(self, kind: Optional[str] = None, base_dir: Optional[str] = None):
+        self.kind = kind
+        self.base_dir = base_dir
+        self.status: Optional[str] = None
+        self.error: Optional[str] = None
+        self.started = _now()
+        self.finished: Optional[datetime] = None
+        self.phases: List[dict] = []
+        self.units: List[dict] = []
+        self.current_phase: Optional[str] = None
+        # units are recorded by worker threads too
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def phase(self, name: str):
+        record = {"name": name, "status": "running", "seconds": None, "error": None}
+        with self._lock:
+            self.phases.append(record)
+        previous, self.current_phase = self.current_phase, name
+        start = time.monotonic()
+        try:
+            yield record
+        except BaseException as exc:
+            record["status"] = "failed"
+            record["error"] = str(exc)
+            raise
+        else:
+            failed = any(unit["status"] == "failed" and unit["phase"] == name for unit in self.units)
+            record["status"] = "partial" if failed else "succeeded"
+        finally:
+            record["seconds"] = round(time.monotonic() - start, 3)
+            self.current_phase = previous
+
+    def add_unit(self, kind: str, name: str) -> dict:
+        record = {
+            "kind": kind,
+            "name": name,
+            "phase": self.current_phase,
+            "status": "running",
+            "seconds": None,
+            "bytes": None,
+            "error": None,
+        }
+        with self._lock:
+            self.units.append(record)
+        return record
+
+    @property
+    def failed_units(self) -> List[dict]:
+        return [unit for unit in self.units if unit["status"] == "failed"]
+
+    def finish(self, status: str, error: Optional[str] = None):
+        self.status = status
+        self.error = error
+        self.finished = _now()
+
+    @property
+    def exit_code(self) -> int:
+        return EXIT_CODES.get(self.status, EXIT_FAILURE)
+
+    def as_dict(self) -> dict:
+        return {
+            "kind": self.kind,
+            "status": self.status,
+            "base_dir": self.base_dir,
+            "started": self.started.isoformat(),
+            "finished": self.finished.isoformat() if self.finished else None,
+            "seconds": round((self.finished - self.started).total_seconds(), 3) if self.finished else None,
+            "error": self.error,
+            "phases": self.phases,
+            "units": self.units,
+        }
+
+    def to_json(self) -> str:
+        return json.dumps(self.as_dict(), indent=2) + "\n"
+
+    def write(self, path: str):
+        with open(path, "w") as outfile:
+            outfile.write(self.to_json())
+        logger.info("Wrote the summary of the run to %s", path)
@@ -0,0 +1,138 @@
+"""
+Tiered storage of backups.
+
+Recent backups stay in the ``base_dir`` (fast local storage). Older weekly
+and monthly backups move to slower, larger storage tiers - any mounted path,
+including object stores mounted with s3fs, rclone or similar:
+
+.. code-block:: yaml
+
+    tiers:
+      - path: /mnt/archive
+        suffixes: [weekly, monthly]
+        after_days: 1
+
+Tiers are listed from fast to slow, and a backup moves to the slowest tier
+accepting it. A move is a streaming copy to ``<name>.partial`` in the tier, a
+checksum comparison of both copies, a rename and only then the removal of the
+original, so an interrupted move never loses a backup. The retention policy
+applies to the tiers as well, and restores find a backup by name in any tier.
+"""
+import logging
+import os
+import shutil
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Tuple
+
+from .fastcopy import fast_copy
+from .hashing import hash_tree
+from .retention import PARTIAL_SUFFIX, RetentionPolicy
+from .walk import iter_copy_tree, walk_tree
+
+logger = logging.getLogger(__name__)
+
+
+class TierError(Exception):
+    pass
+
+
+class Tier:
+    __slots__ = ["path", "suffixes", "after_days"]
+
+    def __init__(self, path: str, suffixes: Optional[List[str]] = None, after_days: int = 1):
+        self.path = path
+        self.suffixes = suffixes or ["weekly", "monthly"]
+        self.after_days = after_days
+
+    def __repr__(self):
+        return f"Tier(path={self.path!r}, suffixes={self.suffixes!r})"
+
+    @classmethod
+    def from_config(cls, config: List[dict]) -> List["Tier"]:
+        return [cls(**tier) for tier in config or []]
+
+    def accepts(self, dir_name: str, policy: RetentionPolicy, now: datetime) -> bool:
+        suffix = "hourly" if dir_name.endswith("-hourly") else dir_name.rsplit("-", 1)[-1]
+        if suffix not in self.suffixes:
+            return False
+        return policy.get_timestamp(dir_name) <= now - timedelta(days=self.after_days)
+
+
+def list_backups(base: str, tiers: List[Tier], policy: RetentionPolicy) -> List[Tuple[str, str]]:
+    """
+    List the backups in the base directory and all tiers, oldest first.
+
+    :return: ``(name, path)`` pairs
+    """
+    backups = []
+    for location in [base, *(tier.path for tier in tiers)]:
+        if not os.path.isdir(location):
+            continue
+        with os.scandir(location) as entries:
+            for entry in entries:
+                if entry.is_dir() and policy.is_backup_dir(entry.name) and not entry.name.endswith(PARTIAL_SUFFIX):
+                    backups.append((entry.name, entry.path))
+    return sorted(backups, key=lambda backup: (policy.get_timestamp(backup[0]), backup[0]))
+
+
+def find_backup(name: str, base: str, tiers: List[Tier], policy: RetentionPolicy) -> Optional[str]:
+    """
+    Find the directory of a backup by its name, in whichever tier holds it.
+    """
+    for backup_name, path in list_backups(base, tiers, policy):
+        if backup_name == name:
+            return path
+    return None
+
+
+def move_backup(src: str, tier: Tier, workers: int = 4) -> str:
+    """
+    Move a backup into a tier: copy, verify, and only then remove the original.
+
+    :return: the new path of the backup
+    """
+    name = os.path.basename(src)
+    dest = os.path.join(tier.path, name)
+    partial = dest + PARTIAL_SUFFIX
+    os.makedirs(tier.path, exist_ok=True)
+    if os.path.exists(partial):
+        logger.info("Removing the interrupted move %s", partial)
+        shutil.rmtree(partial)
+    if os.path.exists(dest):
+        raise TierError(f"{dest} already exists")
+
+    logger.info("Moving backup %s to %s", src, tier.path)
+    # the original is hashed while it is copied
+    copied = iter_copy_tree(walk_tree(src, workers=workers), partial, copy_function=fast_copy)
+    if hash_tree(src, workers=workers, entries=copied) != hash_tree(partial, workers=workers):
+        shutil.rmtree(partial)
+        raise TierError(f"The copy of {src} in {tier.path} differs from the original")
+
+    os.rename(partial, dest)
+    shutil.rmtree(src)
+    logger.info("Moved backup %s to %s", name, dest)
+    return dest
+
+
+def migrate(base: str, tiers: List[Tier], policy: RetentionPolicy, exclude: Optional[str] = None) -> List[str]:
+    """
+    Move the backups that are due to the slowest tier accepting them.
+
+    The tiers are ordered from fast to slow, backups only move down.
+
+    :param exclude: the backup being written, never moved
+    :return: the new paths of the moved backups
+    """
+    now = datetime.now(timezone.utc)
+    locations = [os.path.normpath(location) for location in [base, *(tier.path for tier in tiers)]]
+    moved = []
+    for name, path in list_backups(base, tiers, policy):
+        if exclude and os.path.normpath(path) == os.path.normpath(exclude):
+            continue
+        target = None
+        for index, tier in enumerate(tiers, 1):
+            if tier.accepts(name, policy, now):
+                target = index
+        if target is not None and locations.index(os.path.dirname(os.path.normpath(path))) < target:
+            moved.append(move_backup(path, tiers[target - 1]))
+    return moved
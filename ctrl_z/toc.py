@@ -0,0 +1,239 @@
+"""
+Selective restores of PostgreSQL dumps, with restore profiles.
+
+A staging environment often needs the full schema, but the data of only some
+(reference) tables. A restore profile tells per database alias which tables
+to restore with their data (``full``), which without (``schema_only``) and
+which to leave out completely (``skip``):
+
+.. code-block:: yaml
+
+    restore_profiles:
+      staging:
+        default:
+          full: ["django_*", "auth_*", "reference.*"]
+          schema_only: ["audit_log"]
+          skip: ["django_session"]
+
+Patterns are globs, matched against ``schema.table`` if they contain a dot and
+against the table name otherwise. ``skip`` wins over ``schema_only``, which
+wins over ``full``. Tables not matching any pattern are restored in full, or
+schema only if the profile lists ``full`` tables.
+
+The profile is applied to the ``pg_restore --list`` output of the dump, and the
+selected entries are restored with ``pg_restore --use-list``. Everything that
+depends on a skipped table (indexes, constraints, views...) is left out as
+well, and so are the foreign keys from restored data to tables restored
+without data, since their data would violate them.
+"""
+import logging
+import re
+from fnmatch import fnmatchcase
+from typing import IO, Dict, Iterable, List, Optional
+
+logger = logging.getLogger(__name__)
+
+FULL = "full"
+SCHEMA_ONLY = "schema_only"
+SKIP = "skip"
+
+# 215; 1259 16386 TABLE public foo owner
+ENTRY_PATTERN = re.compile(r"^(\d+); \d+ \d+ (.*)$")
+# ;	depends on: 214 3350, in the --verbose listing
+DEPENDS_PATTERN = re.compile(r"^;\s*depends on:([\d ]*)$")
+TABLE_PATTERN = re.compile(r"^(TABLE(?! ATTACH )(?: DATA)?) (\S+) (.+) (\S*)$")
+# FK CONSTRAINT public foo foo_bar_fk owner, on the table the foreign key is defined on
+FK_PATTERN = re.compile(r"^FK CONSTRAINT (\S+) (.+) (\S+) (\S*)$")
+
+
+class RestoreProfile:
+    """
+    The tables of a database to restore with and without their data.
+
+    :param full: patterns of the tables to restore with their data
+    :param schema_only: patterns of the tables to restore without their data
+    :param skip: patterns of the tables not to restore at all
+    """
+
+    __slots__ = ["full", "schema_only", "skip"]
+
+    def __init__(
+        self,
+        full: Optional[Iterable[str]] = None,
+        schema_only: Iterable[str] = (),
+        skip: Iterable[str] = (),
+    ):
+        self.full = list(full) if full is not None else None
+        self.schema_only = list(schema_only)
+        self.skip = list(skip)
+
+    def __repr__(self):
+        return f"RestoreProfile(full={self.full!r}, schema_only={self.schema_only!r}, skip={self.skip!r})"
+
+    @classmethod
+    def from_config(cls, config: Optional[dict]) -> "RestoreProfile":
+        config = config or {}
+        if "sample" in config:
+            raise ValueError(
+                "Sampling tables is not supported, pg_restore restores all rows of a table or none. "
+                "Restore them as schema_only or skip them."
+            )
+        unknown = set(config) - {FULL, SCHEMA_ONLY, SKIP}
+        if unknown:
+            raise ValueError(f"Unknown restore profile options: {', '.join(sorted(unknown))}")
+        return cls(full=config.get(FULL), schema_only=config.get(SCHEMA_ONLY) or (), skip=config.get(SKIP) or ())
+
+    @staticmethod
+    def _matches(patterns: List[str], schema: str, table: str) -> bool:
+        return any(fnmatchcase(f"{schema}.{table}" if "." in pattern else table, pattern) for pattern in patterns)
+
+    def get_mode(self, schema: str, table: str) -> str:
+        """
+        Get how to restore a table: ``full``, ``schema_only`` or ``skip``.
+        """
+        if self._matches(self.skip, schema, table):
+            return SKIP
+        if self._matches(self.schema_only, schema, table):
+            return SCHEMA_ONLY
+        if self.full is None or self._matches(self.full, schema, table):
+            return FULL
+        return SCHEMA_ONLY
+
+    def get_expected_row_counts(self, row_counts: Dict[str, int]) -> Dict[str, int]:
+        """
+        Adjust the row counts recorded at backup time to what the profile
+        restores: tables without data are expected to be empty, skipped tables
+        to be missing.
+        """
+        expected = {}
+        for name, count in row_counts.items():
+            schema, _, table = name.partition(".")
+            mode = self.get_mode(schema, table)
+            if mode != SKIP:
+                expected[name] = count if mode == FULL else 0
+        return expected
+
+
+class TocEntry:
+    __slots__ = ["dump_id", "description", "dependencies", "table", "mode"]
+
+    def __init__(self, dump_id: int, description: str):
+        self.dump_id = dump_id
+        self.description = description
+        self.dependencies: List[int] = []
+        # the schema and name of TABLE and TABLE DATA entries
+        self.table: Optional[str] = None
+        self.mode: Optional[str] = None
+
+
+class TocSelection:
+    """
+    The lines of a ``pg_restore --list`` listing, with the entries that are
+    not restored commented out.
+    """
+
+    def __init__(self, lines: List[str], entries: int, dropped: int, tables: Dict[str, str]):
+        self.lines = lines
+        # the amount of entries that are restored, and left out
+        self.entries = entries
+        self.dropped = dropped
+        # how each table is restored
+        self.tables = tables
+
+    def write(self, outfile: IO[bytes]):
+        for line in self.lines:
+            outfile.write(line.encode("utf-8", "surrogateescape"))
+
+
+def select_entries(lines: Iterable[bytes], profile: RestoreProfile) -> TocSelection:
+    """
+    Apply a restore profile to the ``pg_restore --list --verbose`` output of a
+    dump.
+    """
+    listing: List[str] = []
+    entries: Dict[int, TocEntry] = {}
+    positions: Dict[int, int] = {}
+    entry = None
+    for raw in lines:
+        line = raw.decode("utf-8", "surrogateescape")
+        listing.append(line)
+        text = line.rstrip("\r\n")
+        match = ENTRY_PATTERN.match(text)
+        if match:
+            entry = TocEntry(int(match.group(1)), match.group(2))
+            entries[entry.dump_id] = entry
+            positions[entry.dump_id] = len(listing) - 1
+            table = TABLE_PATTERN.match(entry.description)
+            if table:
+                entry.table = f"{table.group(2)}.{table.group(3)}"
+                entry.mode = profile.get_mode(table.group(2), table.group(3))
+            continue
+        match = DEPENDS_PATTERN.match(text)
+        if match and entry is not None:
+            entry.dependencies.extend(int(dump_id) for dump_id in match.group(1).split())
+
+    tables = {
+        entry.table: entry
+        for entry in entries.values()
+        if entry.table is not None and not entry.description.startswith("TABLE DATA ")
+    }
+    dropped = set()
+    # the entries whose dependents are left out as well
+    removed = [entry.dump_id for entry in entries.values() if entry.mode == SKIP]
+    for entry in entries.values():
+        if entry.description.startswith("TABLE DATA ") and entry.mode != FULL:
+            dropped.add(entry.dump_id)
+        elif entry.description.startswith("FK CONSTRAINT ") and _violates(entry, entries, tables):
+            logger.warning("Leaving out %s, it refers to a table restored without data", entry.description)
+            removed.append(entry.dump_id)
+
+    dependents: Dict[int, List[int]] = {}
+    for entry in entries.values():
+        for dependency in entry.dependencies:
+            dependents.setdefault(dependency, []).append(entry.dump_id)
+    while removed:
+        dump_id = removed.pop()
+        if dump_id in dropped:
+            continue
+        dropped.add(dump_id)
+        removed.extend(dependents.get(dump_id, []))
+
+    for dump_id in dropped:
+        position = positions[dump_id]
+        listing[position] = ";" + listing[position]
+
+    modes = {name: table.mode for name, table in tables.items()}
+    return TocSelection(listing, entries=len(entries) - len(dropped), dropped=len(dropped), tables=modes)
+
+
+def _get_table(dump_id: int, entries: Dict[int, TocEntry]) -> Optional[TocEntry]:
+    """
+    Find the table an entry is (or belongs to), following one dependency.
+    """
+    entry = entries.get(dump_id)
+    if entry is None or entry.table is not None:
+        return entry
+    for dependency in entry.dependencies:
+        table = entries.get(dependency)
+        if table is not None and table.table is not None:
+            return table
+    return None
+
+
+def _violates(constraint: TocEntry, entries: Dict[int, TocEntry], tables: Dict[str, TocEntry]) -> bool:
+    """
+    Check if a foreign key refers from a table restored with data to a table
+    restored without.
+
+    The table of the foreign key itself is named in its description, the
+    order of the dependencies says nothing.
+    """
+    match = FK_PATTERN.match(constraint.description)
+    if match is None:
+        return False
+    name = f"{match.group(1)}.{match.group(2)}"
+    own = tables.get(name)
+    if own is None or own.mode != FULL:
+        return False
+    referenced = [_get_table(dump_id, entries) for dump_id in constraint.dependencies]
+    return any(table is not None and table.table != name and table.mode == SCHEMA_ONLY for table in referenced)
@@ -0,0 +1,205 @@
+"""
+Continuous WAL archiving and point-in-time recovery.
+
+Next to the logical dumps, CTRL-Z can take physical base backups with
+``pg_basebackup``. Together with the WAL segments archived by PostgreSQL,
+these allow restoring a cluster to any moment after the base backup.
+
+Archiving is done by PostgreSQL itself, for every completed WAL segment. This
+module doubles as a light-weight command (no Django setup required) to use as
+``archive_command`` and ``restore_command``::
+
+    archive_command = 'python -m ctrl_z.wal archive %p /var/backups/wal/localhost.5432'
+    restore_command = 'python -m ctrl_z.wal fetch %f %p /var/backups/wal/localhost.5432'
+"""
+import argparse
+import filecmp
+import json
+import logging
+import os
+import re
+import shutil
+import sys
+import tarfile
+from datetime import datetime
+from typing import Optional
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_SEGMENT_SIZE = 16 * 1024 * 1024
+
+INFO_FILENAME = "ctrl-z.json"
+
+# WAL segments, and the .backup/.partial files named after them
+SEGMENT_PATTERN = re.compile(r"^[0-9A-F]{24}(\.partial|\.[0-9A-F]{8}\.backup)?$")
+
+START_POINT_PATTERN = re.compile(r"write-ahead log start point: ([0-9A-F]+/[0-9A-F]+) on timeline ([0-9]+)")
+
+
+def lsn_to_segment(lsn: str, timeline: int, segment_size: int = DEFAULT_SEGMENT_SIZE) -> str:
+    """
+    Get the name of the WAL segment containing the log sequence number.
+    """
+    high, low = lsn.split("/")
+    position = (int(high, 16) << 32) | int(low, 16)
+    segment_number = position // segment_size
+    segments_per_id = 0x100000000 // segment_size
+    return f"{timeline:08X}{segment_number // segments_per_id:08X}{segment_number % segments_per_id:08X}"
+
+
+def parse_start_point(output: str) -> tuple:
+    """
+    Get the start LSN and timeline from ``pg_basebackup --verbose`` output.
+    """
+    match = START_POINT_PATTERN.search(output)
+    if match is None:
+        raise ValueError("Could not find the write-ahead log start point in the pg_basebackup output")
+    return match.group(1), int(match.group(2))
+
+
+def _fsync_dir(path: str):
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def archive_segment(path: str, archive_dir: str):
+    """
+    Copy a WAL segment into the archive, durably and atomically.
+
+    Archiving a segment that is already archived with the same content
+    succeeds, as PostgreSQL may retry after a crash.
+    """
+    os.makedirs(archive_dir, exist_ok=True)
+    name = os.path.basename(path)
+    target = os.path.join(archive_dir, name)
+
+    if os.path.exists(target):
+        if filecmp.cmp(path, target, shallow=False):
+            logger.info("%s is already archived", name)
+            return
+        raise FileExistsError(f"{target} already exists with different content")
+
+    tmp_target = f"{target}.tmp"
+    with open(path, "rb") as infile, open(tmp_target, "wb") as outfile:
+        shutil.copyfileobj(infile, outfile, 1024 * 1024)
+        outfile.flush()
+        os.fsync(outfile.fileno())
+    os.rename(tmp_target, target)
+    _fsync_dir(archive_dir)
+
+
+def fetch_segment(name: str, destination: str, archive_dir: str):
+    """
+    Copy an archived file to where PostgreSQL asks for it during recovery.
+    """
+    shutil.copyfile(os.path.join(archive_dir, name), destination)
+
+
+def prune_archive(archive_dir: str, oldest_segment: str) -> int:
+    """
+    Remove the archived segments older than ``oldest_segment``.
+
+    Timeline history files are always kept.
+
+    :return: the amount of removed files
+    """
+    removed = 0
+    for entry in os.scandir(archive_dir):
+        if not SEGMENT_PATTERN.match(entry.name):
+            continue
+        if entry.name[:24] < oldest_segment:
+            os.remove(entry.path)
+            removed += 1
+    logger.info("Pruned %d archived WAL files older than %s from %s", removed, oldest_segment, archive_dir)
+    return removed
+
+
+def write_info(path: str, **info):
+    with open(os.path.join(path, INFO_FILENAME), "w") as outfile:
+        json.dump(info, outfile, indent=2)
+
+
+def read_info(path: str) -> Optional[dict]:
+    info_file = os.path.join(path, INFO_FILENAME)
+    if not os.path.exists(info_file):
+        return None
+    with open(info_file, "r") as infile:
+        return json.load(infile)
+
+
+def _extract(archive: str, destination: str):
+    # keep permissions and ownership as they are in the data directory
+    kwargs = {"filter": "tar"} if hasattr(tarfile, "tar_filter") else {}
+    with tarfile.open(archive) as tar:
+        tar.extractall(destination, **kwargs)
+
+
+def extract_base_backup(backup_path: str, pgdata: str):
+    """
+    Unpack a tar-format base backup into an empty data directory.
+    """
+    if os.path.exists(pgdata) and os.listdir(pgdata):
+        raise FileExistsError(f"The data directory {pgdata} is not empty")
+    os.makedirs(pgdata, mode=0o700, exist_ok=True)
+
+    for name in sorted(os.listdir(backup_path)):
+        if name.startswith("base.tar"):
+            _extract(os.path.join(backup_path, name), pgdata)
+        elif name.startswith("pg_wal.tar"):
+            _extract(os.path.join(backup_path, name), os.path.join(pgdata, "pg_wal"))
+
+
+def write_recovery_config(pgdata: str, archive_dir: str, target_time: Optional[datetime] = None):
+    """
+    Configure the data directory for archive recovery, up to ``target_time``.
+    """
+    restore_command = f"{sys.executable} -m ctrl_z.wal fetch %f %p {archive_dir}"
+    settings = {"restore_command": restore_command}
+    if target_time is not None:
+        settings.update(
+            {
+                "recovery_target_time": target_time.isoformat(sep=" "),
+                "recovery_target_action": "promote",
+            }
+        )
+
+    with open(os.path.join(pgdata, "postgresql.auto.conf"), "a") as conf:
+        conf.write("\n# added by CTRL-Z for point-in-time recovery\n")
+        for key, value in settings.items():
+            escaped = value.replace("'", "''")
+            conf.write(f"{key} = '{escaped}'\n")
+
+    open(os.path.join(pgdata, "recovery.signal"), "w").close()
+
+
+def main(args=None) -> int:
+    parser = argparse.ArgumentParser(description="CTRL-Z WAL archive commands")
+    subparsers = parser.add_subparsers(dest="subcommand", required=True)
+
+    parser_archive = subparsers.add_parser("archive", help="Archive a WAL segment (archive_command)")
+    parser_archive.add_argument("path", help="Path of the segment to archive, %%p")
+    parser_archive.add_argument("archive_dir", help="The WAL archive directory")
+
+    parser_fetch = subparsers.add_parser("fetch", help="Fetch an archived WAL file (restore_command)")
+    parser_fetch.add_argument("name", help="Name of the file to fetch, %%f")
+    parser_fetch.add_argument("destination", help="Where to copy the file to, %%p")
+    parser_fetch.add_argument("archive_dir", help="The WAL archive directory")
+
+    options = parser.parse_args(args)
+    try:
+        if options.subcommand == "archive":
+            archive_segment(options.path, options.archive_dir)
+        else:
+            fetch_segment(options.name, options.destination, options.archive_dir)
+    except OSError as exc:
+        # a non-zero exit code makes PostgreSQL retry or end recovery
+        sys.stderr.write(f"{exc}\n")
+        return 1
+    return 0
+
+
+if __name__ == "__main__":  # pragma: no cover
+    sys.exit(main())
@@ -0,0 +1,139 @@
+"""
+Single-pass walking of file trees.
+
+:func:`shutil.copytree`, :func:`os.walk` and ``os.path`` checks each stat the
+same entries again, which dominates the runtime on network filesystems. A tree
+is walked with :func:`os.scandir`, keeping the stat result of every file, and
+a single walk feeds the copy and the hashing of the tree.
+
+Directories are listed ``workers`` at a time, so the latency of listing many
+small directories over NFS overlaps. Pending directories are taken from a
+stack rather than a queue, so memory use grows with the depth of the tree and
+not with its width.
+"""
+import logging
+import os
+import stat
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Iterable, Iterator, List, Optional, Tuple
+
+from .fastcopy import fast_copy
+from .filters import PathFilter
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_WORKERS = 4
+
+
+class WalkEntry:
+    """
+    A file or directory in a walked tree, with the stat result of files.
+    """
+
+    __slots__ = ["path", "relpath", "is_dir", "stat"]
+
+    def __init__(self, path: str, relpath: str, is_dir: bool, stat: Optional[os.stat_result] = None):
+        self.path = path
+        self.relpath = relpath
+        self.is_dir = is_dir
+        self.stat = stat
+
+    def __repr__(self):
+        return f"WalkEntry(relpath={self.relpath!r}, is_dir={self.is_dir})"
+
+
+def _list_directory(dirpath: str, reldir: str, path_filter: PathFilter, follow_symlinks: bool) -> List[WalkEntry]:
+    entries = []
+    with os.scandir(dirpath) as iterator:
+        for entry in iterator:
+            relpath = os.path.join(reldir, entry.name) if reldir else entry.name
+            try:
+                is_dir = entry.is_dir(follow_symlinks=follow_symlinks)
+                entry_stat = None if is_dir else entry.stat(follow_symlinks=follow_symlinks)
+            except OSError as exc:
+                logger.warning("Skipping %s: %s", entry.path, exc)
+                continue
+            if entry_stat is not None and not stat.S_ISREG(entry_stat.st_mode):
+                logger.debug("Skipping %s, not a regular file", entry.path)
+                continue
+            if path_filter.is_excluded(relpath, is_dir=is_dir, size=entry_stat.st_size if entry_stat else None):
+                continue
+            entries.append(WalkEntry(entry.path, relpath, is_dir, entry_stat))
+    return entries
+
+
+def walk_tree(
+    root: str,
+    path_filter: Optional[PathFilter] = None,
+    workers: int = DEFAULT_WORKERS,
+    prefix: str = "",
+    follow_symlinks: bool = True,
+) -> Iterator[WalkEntry]:
+    """
+    Walk a tree, listing ``workers`` directories at a time.
+
+    Directories are yielded before their contents. Excluded directories are
+    not traversed.
+
+    :param path_filter: only yield the entries included by this filter
+    :param prefix: the path of ``root`` relative to the tree the filter and
+      the relative paths of the entries refer to
+    :param follow_symlinks: follow symlinks like copytree does, otherwise
+      symlinks are skipped
+    """
+    path_filter = path_filter or PathFilter()
+    pending = [(prefix, root)]
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        while pending:
+            batch = [pending.pop() for _ in range(min(workers, len(pending)))]
+            for entries in executor.map(
+                lambda item: _list_directory(item[1], item[0], path_filter, follow_symlinks), batch
+            ):
+                for entry in entries:
+                    yield entry
+                    if entry.is_dir:
+                        pending.append((entry.relpath, entry.path))
+
+
+def measure(entries: Iterable[WalkEntry]) -> Tuple[int, int]:
+    """
+    Count the files and bytes of walked entries.
+    """
+    files = size = 0
+    for entry in entries:
+        if not entry.is_dir:
+            files += 1
+            size += entry.stat.st_size
+    return files, size
+
+
+def iter_copy_tree(
+    entries: Iterable[WalkEntry],
+    dest: str,
+    copy_function: Callable = fast_copy,
+) -> Iterator[WalkEntry]:
+    """
+    Copy walked entries into ``dest``, which may exist, yielding the copied
+    files as they are copied so they can be hashed in the same pass.
+
+    Directories get the permissions of the originals, read-only ones once the
+    walk is done so they can still be filled. Their modification times are
+    not kept.
+    """
+    os.makedirs(dest, exist_ok=True)
+    read_only = []
+    for entry in entries:
+        target = os.path.join(dest, entry.relpath)
+        if entry.is_dir:
+            os.makedirs(target, exist_ok=True)
+            mode = stat.S_IMODE(os.stat(entry.path).st_mode)
+            if mode & stat.S_IWUSR and mode & stat.S_IXUSR:
+                os.chmod(target, mode)
+            else:
+                read_only.append((target, mode))
+        else:
+            copy_function(entry.path, target)
+            yield entry
+    # subdirectories are walked after their parents, set their modes first
+    for target, mode in reversed(read_only):
+        os.chmod(target, mode)
@@ -14,7 +14,7 @@ def test_backup_no_db(tmpdir, settings, config_writer):
 
     backup.full(db=False, files=True)
 
-    backup_dir = tmpdir.join("backups").listdir()[0]
+    backup_dir = tmpdir.join("backups").listdir(lambda path: path.isdir())[0]
     media_file = backup_dir.join("files", "media", "some_file.txt")
     assert media_file.read() == "to check"
 
@@ -59,7 +59,7 @@ def test_backup_files_overwrite_target(tmpdir, settings, config_writer):
 
     backup.full(db=False, files=True)
 
-    backup_dir = tmpdir.join("backups").listdir()[0]
+    backup_dir = tmpdir.join("backups").listdir(lambda path: path.isdir())[0]
     assert len(backup_dir.join("files", "media").listdir()) == 1
 
 
@@ -69,7 +69,7 @@ def test_backup_skip_db(tmpdir, settings, config_writer):
 
     backup.full(db=True, skip_db=["default"], files=False)
 
-    backup_dir = tmpdir.join("backups").listdir()[0]
+    backup_dir = tmpdir.join("backups").listdir(lambda path: path.isdir())[0]
     filenames = [item.basename for item in backup_dir.join("db").listdir()]
 
     port = settings.DATABASES["secondary"]["PORT"]
@@ -82,7 +82,7 @@ def test_backup_all_db(tmpdir, settings, config_writer):
 
     backup.full(db=True, files=False)
 
-    backup_dir = tmpdir.join("backups").listdir()[0]
+    backup_dir = tmpdir.join("backups").listdir(lambda path: path.isdir())[0]
     filenames = [item.basename for item in backup_dir.join("db").listdir()]
 
     port1 = settings.DATABASES["default"]["PORT"]
@@ -96,7 +96,7 @@ def test_backup_db_version_file(tmpdir, settings, config_writer):
 
     backup.full(db=True, files=False, version="TEST")
 
-    backup_dir = tmpdir.join("backups").listdir()[0]
+    backup_dir = tmpdir.join("backups").listdir(lambda path: path.isdir())[0]
     version_dir = backup_dir.listdir()[0]
     assert version_dir.basename == "version"
     version_file = version_dir.listdir()[0]
@@ -0,0 +1,104 @@
+import os
+from datetime import datetime, timezone
+
+from freezegun import freeze_time
+
+from ctrl_z import Backup
+from ctrl_z.changes import ChangeFeed
+
+
+def _write_feed(path, since, *paths, gap=False):
+    lines = [f"# since: {since}"] if since else []
+    if gap:
+        lines.append("# gap")
+    lines += paths
+    path.write("\n".join(lines) + "\n")
+    return str(path)
+
+
+def test_parse_feed(tmpdir):
+    feed_file = _write_feed(tmpdir.join("feed"), "2018-06-27T02:00:00+00:00", "/srv/media/a", "/srv/other/b")
+
+    feed = ChangeFeed.from_file(feed_file)
+
+    assert feed.since == datetime(2018, 6, 27, 2, tzinfo=timezone.utc)
+    assert feed.get_changes("/srv/media") == ["a"]
+    assert feed.covers(datetime(2018, 6, 27, 3, tzinfo=timezone.utc))
+    assert not feed.covers(datetime(2018, 6, 27, 1, tzinfo=timezone.utc))
+
+
+def test_feed_without_timezone(tmpdir):
+    feed = ChangeFeed.from_file(_write_feed(tmpdir.join("feed"), "2018-06-27T02:00:00", "/srv/media/a"))
+
+    assert feed.since == datetime(2018, 6, 27, 2, tzinfo=timezone.utc)
+    assert feed.covers(datetime(2018, 6, 27, 3, tzinfo=timezone.utc))
+
+
+def test_feed_with_gaps(tmpdir):
+    feed_file = _write_feed(tmpdir.join("feed"), "2018-06-27T02:00:00+00:00", "/srv/media/a", gap=True)
+
+    feed = ChangeFeed.from_file(feed_file)
+
+    assert not feed.covers(datetime(2018, 6, 28, tzinfo=timezone.utc))
+
+
+def _backup(config_path, **kwargs):
+    backup = Backup.from_config(config_path)
+    backup.full(db=False, **kwargs)
+    return backup
+
+
+def test_incremental_backup(tmpdir, settings, config_writer):
+    media = tmpdir.mkdir("media")
+    settings.MEDIA_ROOT = str(media)
+    media.join("unchanged.txt").write("same")
+    media.join("modified.txt").write("original")
+    media.join("deleted.txt").write("gone soon")
+    config_writer()
+    config_path = str(tmpdir.join("config.yml"))
+
+    with freeze_time("2018-06-26 02:00:00"):
+        previous = _backup(config_path)
+
+    media.join("modified.txt").write("modified")
+    media.join("deleted.txt").remove()
+    media.join("added.txt").write("added")
+    feed = _write_feed(
+        tmpdir.join("feed"),
+        "2018-06-26T01:00:00+00:00",
+        *(str(media.join(name)) for name in ("modified.txt", "deleted.txt", "added.txt")),
+    )
+
+    with freeze_time("2018-06-27 02:00:00"):
+        current = _backup(config_path, changed_files=feed)
+
+    copy = os.path.join(current.files_dir, "media")
+    assert sorted(os.listdir(copy)) == ["added.txt", "modified.txt", "unchanged.txt"]
+    with open(os.path.join(copy, "modified.txt")) as modified:
+        assert modified.read() == "modified"
+    # the previous backup is left alone
+    with open(os.path.join(previous.files_dir, "media", "modified.txt")) as modified:
+        assert modified.read() == "original"
+    # unchanged files are shared with the previous backup
+    assert os.path.samefile(
+        os.path.join(copy, "unchanged.txt"), os.path.join(previous.files_dir, "media", "unchanged.txt")
+    )
+
+
+def test_incremental_backup_feed_too_recent(tmpdir, settings, config_writer):
+    media = tmpdir.mkdir("media")
+    settings.MEDIA_ROOT = str(media)
+    media.join("a.txt").write("a")
+    config_writer()
+    config_path = str(tmpdir.join("config.yml"))
+
+    with freeze_time("2018-06-26 02:00:00"):
+        _backup(config_path)
+
+    media.join("b.txt").write("not in the feed")
+    feed = _write_feed(tmpdir.join("feed"), "2018-06-26T12:00:00+00:00", str(media.join("a.txt")))
+
+    with freeze_time("2018-06-27 02:00:00"):
+        current = _backup(config_path, changed_files=feed)
+
+    assert sorted(os.listdir(os.path.join(current.files_dir, "media"))) == ["a.txt", "b.txt"]
@@ -2,6 +2,7 @@
 Integration tests for the command line interface implementation.
 """
 import argparse
+import json
 import os
 import warnings
 from datetime import datetime, timezone
@@ -12,6 +13,7 @@ from freezegun import freeze_time
 
 from ctrl_z import cli
 from ctrl_z.config import DEFAULT_CONFIG_FILE
+from ctrl_z.lock import LOCK_FILENAME
 
 
 def test_config_generation(config_path):
@@ -52,7 +54,7 @@ def test_full_backup(tmpdir, settings, config_writer):
     expected_date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
 
     # assert that the backup directory was created
-    children = os.listdir(str(backups_base))
+    children = [name for name in os.listdir(str(backups_base)) if name != LOCK_FILENAME]
     assert len(children) == 1
     backup_dir = children[0]
     assert backup_dir.startswith(expected_date)
@@ -79,7 +81,7 @@ def test_version_full_backup(tmpdir, settings, config_writer):
     expected_date = datetime.now(timezone.utc).strftime("%Y-%m-%d")
 
     # assert that the backup directory was created
-    children = os.listdir(str(backups_base))
+    children = [name for name in os.listdir(str(backups_base)) if name != LOCK_FILENAME]
     assert len(children) == 1
     backup_dir = children[0]
     assert backup_dir.startswith(expected_date)
@@ -91,6 +93,27 @@ def test_version_full_backup(tmpdir, settings, config_writer):
         assert version_file.readlines() == ["test"]
 
 
+def test_profiled_backup(tmpdir, settings, config_writer):
+    config_path = str(tmpdir.join("config.yml"))
+    backups_base = tmpdir.join("backups")
+
+    config_writer(config_path, base_dir=str(backups_base))
+
+    # prevent actual db access
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", category=UserWarning)
+        settings.DATABASES = {}
+    settings.MEDIA_ROOT = str(tmpdir.mkdir("media"))
+
+    cli(args=["--profile", "backup"], config_file=config_path, stdout=StringIO())
+
+    (backup_dir,) = backups_base.listdir(lambda path: path.basename != LOCK_FILENAME)
+    with open(str(backup_dir.join("profile", "summary.json")), "r") as summary:
+        phases = [phase["name"] for phase in json.load(summary)["phases"]]
+    assert phases == ["rotate", "databases", "files"]
+    assert backup_dir.join("profile", "02-databases.prof").exists()
+
+
 def test_full_restore(tmpdir, settings, config_writer):
     config_path = str(tmpdir.join("config.yml"))
     backups_base = tmpdir.mkdir("backups")
@@ -204,9 +227,28 @@ def test_db_restore_aliases(tmpdir, config_writer, mocker):
         db_ports={"default": "5432"},
         files=True,
         skip_db=None,
+        paths=None,
+        profile=None,
     )
 
 
+def test_restore_paths(tmpdir, config_writer, mocker):
+    config_path = str(tmpdir.join("config.yml"))
+    backups_base = tmpdir.mkdir("backups")
+    backup_dir = backups_base.mkdir("2018-05-29-daily")
+    config_writer(config_path, base_dir=str(backups_base))
+    mock_restore = mocker.patch("ctrl_z._cli.Backup.restore")
+
+    cli(
+        args=["restore", str(backup_dir), "--files-only", "--path", "uploads/a/**", "--path", "docs"],
+        config_file=config_path,
+        stdout=StringIO(),
+    )
+
+    assert mock_restore.call_args.kwargs["db"] is False
+    assert mock_restore.call_args.kwargs["paths"] == ["uploads/a/**", "docs"]
+
+
 @freeze_time("2018-05-29")
 def test_show_backup_dir(tmpdir, config_writer):
     config_path = str(tmpdir.join("config.yml"))
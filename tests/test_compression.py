@@ -0,0 +1,128 @@
+import gzip
+import os
+
+import pytest
+
+from ctrl_z import Backup
+from ctrl_z.benchmark import (
+    BenchmarkResult, benchmark, recommend, select_sample
+)
+from ctrl_z.compression import Compression, CompressionError, get_dump_args
+
+from .test_encryption import KEY, _fake_binary
+
+
+@pytest.mark.parametrize(
+    "spec,args",
+    [
+        ("none", ["-Z0"]),
+        ("gzip", []),
+        ("gzip:1", ["-Z1"]),
+        ("lz4", ["--compress=lz4"]),
+        ("zstd:3", ["--compress=zstd:3"]),
+    ],
+)
+def test_get_dump_args(spec, args):
+    assert get_dump_args(spec) == args
+
+
+@pytest.mark.parametrize("spec", ["bzip2", "zstd:fast", ""])
+def test_get_dump_args_invalid(spec):
+    with pytest.raises(CompressionError):
+        get_dump_args(spec)
+
+
+def test_external_compression_config():
+    compression = Compression.from_config({"external": "zstd -T0 -c", "decompress": "zstd -d -c"})
+
+    assert compression.dump_args == ["-Z0"]
+    assert compression.external == ["zstd", "-T0", "-c"]
+    assert compression.extension == ".zstd"
+
+    with pytest.raises(CompressionError):
+        Compression.from_config({"external": "zstd -c"})
+
+
+@pytest.mark.parametrize("encrypted", [False, True])
+def test_external_compression_roundtrip(tmpdir, settings, config_writer, monkeypatch, encrypted):
+    monkeypatch.setenv("CTRL_Z_ENCRYPTION_KEY", KEY)
+    settings.MEDIA_ROOT = str(tmpdir.mkdir("media"))
+    restored_dump = tmpdir.join("restored.dump")
+    config_writer(
+        encryption={"enabled": encrypted},
+        pg_dump_binary=_fake_binary(tmpdir, "pg_dump", 'echo "dump of $PGDATABASE $*"'),
+        pg_restore_binary=_fake_binary(tmpdir, "pg_restore", f"cat > {restored_dump}"),
+        dropdb_binary=_fake_binary(tmpdir, "dropdb", "true"),
+        createdb_binary=_fake_binary(tmpdir, "createdb", "true"),
+        database={
+            "test_function": "tests.test_encryption.always_ok",
+            "compression": {"default": {"external": "gzip -c", "decompress": "gzip -d -c", "extension": ".gz"}},
+        },
+    )
+    config_path = str(tmpdir.join("config.yml"))
+
+    backup = Backup.from_config(config_path)
+    backup.full(skip_db=["secondary"], files=False)
+
+    (dump,) = os.listdir(backup.db_dir)
+    expected = f"dump of {settings.DATABASES['default']['NAME']} -Fc -Z0 --verbose\n"
+    if encrypted:
+        assert dump.endswith(".custom.gz.enc")
+    else:
+        assert dump.endswith(".custom.gz")
+        with gzip.open(os.path.join(backup.db_dir, dump), "rt") as infile:
+            assert infile.read() == expected
+
+    restore = Backup.prepare_restore(config_path, backup.base_dir)
+    restore.restore(skip_db=["secondary"], files=False)
+
+    assert restored_dump.read() == expected
+
+
+def test_pg_dump_compression_args(tmpdir, settings, config_writer):
+    args_file = tmpdir.join("args")
+    config_writer(
+        pg_dump_binary=_fake_binary(tmpdir, "pg_dump", f'echo "$*" > {args_file}'),
+        database={"compression": {"default": "zstd:3"}},
+    )
+
+    backup = Backup.from_config(str(tmpdir.join("config.yml")))
+    backup.create_directories()
+    backup.databases(skip_db=["secondary"])
+
+    assert args_file.read().startswith("-Fc --compress=zstd:3 -f")
+
+
+def test_select_sample():
+    table_sizes = [("public", "big", 1000), ("public", "medium", 400), ("public", "small", 100)]
+
+    assert select_sample(table_sizes, 600) == ['"public"."medium"', '"public"."small"']
+    assert select_sample(table_sizes, 50) == ['"public"."small"']
+
+
+def test_benchmark_and_recommend(tmpdir):
+    # size of the output depends on the compression argument
+    pg_dump = _fake_binary(
+        tmpdir,
+        "pg_dump",
+        'for arg; do case "$arg" in -f*) out="${arg#-f}";; -Z0) size=1000;; --compress=zstd:1) size=300;; '
+        "--compress=lz4) exit 1;; esac; done\n"
+        'head -c "${size:-400}" /dev/zero > "$out"',
+    )
+
+    results = benchmark([pg_dump, "-Fc"], os.environ.copy(), ['"public"."big"'], ["gzip:6", "lz4", "zstd:1"])
+
+    assert [(result.spec, result.size) for result in results] == [("none", 1000), ("gzip:6", 400), ("zstd:1", 300)]
+    assert recommend(results, max_ratio=0.5).spec in ("gzip:6", "zstd:1")
+    assert recommend(results, max_ratio=0.1) is None
+
+
+def test_recommend_fastest():
+    results = [
+        BenchmarkResult("none", 1.0, 1000),
+        BenchmarkResult("gzip:9", 5.0, 200),
+        BenchmarkResult("zstd:1", 1.5, 300),
+    ]
+
+    assert recommend(results, max_ratio=0.4).spec == "zstd:1"
+    assert recommend(results, max_ratio=0.25).spec == "gzip:9"
@@ -0,0 +1,178 @@
+import gzip
+import os
+import sqlite3
+
+import pytest
+
+from ctrl_z import Backup
+from ctrl_z.backup import BackupError
+from ctrl_z.config import DEFAULT_CONFIG_FILE, Config
+from ctrl_z.drivers import (
+    DriverError, MySQLDriver, PostgresDriver, SQLiteDriver, get_driver
+)
+
+from .test_encryption import KEY, _fake_binary
+
+# the engines are switched per test
+pytestmark = pytest.mark.filterwarnings("ignore:Overriding setting DATABASES")
+
+
+def _sqlite_db(path, rows):
+    connection = sqlite3.connect(str(path))
+    with connection:
+        connection.execute("CREATE TABLE IF NOT EXISTS item (name TEXT)")
+        connection.execute("DELETE FROM item")
+        connection.executemany("INSERT INTO item VALUES (?)", [(row,) for row in rows])
+    connection.close()
+
+
+def _sqlite_rows(path):
+    connection = sqlite3.connect(str(path))
+    try:
+        return [row[0] for row in connection.execute("SELECT name FROM item ORDER BY name")]
+    finally:
+        connection.close()
+
+
+def test_get_driver():
+    config = Config.from_file(DEFAULT_CONFIG_FILE)
+
+    assert isinstance(get_driver({"ENGINE": "django.contrib.gis.db.backends.postgis"}, config), PostgresDriver)
+    assert isinstance(get_driver({"ENGINE": "django.db.backends.mysql"}, config), MySQLDriver)
+    assert isinstance(get_driver({"ENGINE": "django.db.backends.sqlite3"}, config), SQLiteDriver)
+    # hand written configs without an engine
+    assert isinstance(get_driver({}, config), PostgresDriver)
+    with pytest.raises(DriverError):
+        get_driver({"ENGINE": "django.db.backends.oracle"}, config)
+
+
+def test_get_driver_custom_backend(mocker):
+    config = Config.from_file(DEFAULT_CONFIG_FILE)
+
+    assert isinstance(get_driver({"ENGINE": "myproject.db.backends.postgresql"}, config), PostgresDriver)
+    # not importable here, so the vendor is unknown
+    assert isinstance(get_driver({"ENGINE": "django_tenants.postgresql_backend"}, config), PostgresDriver)
+
+    mocker.patch("ctrl_z.drivers._get_vendor", return_value="mysql")
+    assert isinstance(get_driver({"ENGINE": "myproject.db.mysql_backend"}, config), MySQLDriver)
+
+
+@pytest.mark.parametrize("encrypted", [False, True])
+def test_sqlite_backup_and_restore(tmpdir, settings, config_writer, monkeypatch, encrypted):
+    monkeypatch.setenv("CTRL_Z_ENCRYPTION_KEY", KEY)
+    database = tmpdir.join("db.sqlite3")
+    _sqlite_db(database, ["a", "b"])
+    settings.DATABASES = {"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": str(database)}}
+    config_writer(
+        encryption={"enabled": encrypted},
+        database={"test_function": "tests.test_encryption.always_ok"},
+    )
+    config_path = str(tmpdir.join("config.yml"))
+
+    backup = Backup.from_config(config_path)
+    backup.full(files=False)
+    assert os.listdir(backup.db_dir) == ["default.db.sqlite3.backup" + (".enc" if encrypted else "")]
+
+    _sqlite_db(database, ["c"])
+    restore = Backup.prepare_restore(config_path, backup.base_dir)
+    restore.restore(files=False)
+
+    assert _sqlite_rows(database) == ["a", "b"]
+
+
+def test_sqlite_corrupt_dump_fails_preflight(tmpdir, settings, config_writer):
+    database = tmpdir.join("db.sqlite3")
+    _sqlite_db(database, ["a"])
+    settings.DATABASES = {"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": str(database)}}
+    config_writer(database={"test_function": "tests.test_encryption.always_ok"})
+    config_path = str(tmpdir.join("config.yml"))
+    backup = Backup.from_config(config_path)
+    backup.full(files=False)
+    with open(os.path.join(backup.db_dir, "default.db.sqlite3.backup"), "r+b") as dump:
+        dump.write(b"garbage" * 20)
+
+    restore = Backup.prepare_restore(config_path, backup.base_dir)
+    with pytest.raises(BackupError, match="pre-restore check"):
+        restore.restore(files=False)
+
+    assert _sqlite_rows(database) == ["a"]
+
+
+def test_benchmark_compression_not_postgres(tmpdir, settings, config_writer):
+    settings.DATABASES = {"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": str(tmpdir.join("db.sqlite3"))}}
+    config_writer()
+    backup = Backup.from_config(str(tmpdir.join("config.yml")))
+
+    with pytest.raises(BackupError, match="is not PostgreSQL"):
+        backup.benchmark_compression()
+
+
+def test_sqlite_file_names():
+    driver = SQLiteDriver(Config.from_file(DEFAULT_CONFIG_FILE))
+
+    # database files in different directories with the same name
+    assert driver.get_filename({"NAME": "/srv/a/db.sqlite3"}, "default") == "default.db.sqlite3.backup"
+    assert driver.get_filename({"NAME": "/srv/b/db.sqlite3"}, "secondary") == "secondary.db.sqlite3.backup"
+
+
+def test_mysqldump_compressed(tmpdir, settings, config_writer):
+    restored = tmpdir.join("restored.sql")
+    settings.DATABASES = {
+        "default": {"ENGINE": "django.db.backends.mysql", "NAME": "shop", "USER": "shop", "PASSWORD": "secret"}
+    }
+    config_writer(
+        mysqldump_binary=_fake_binary(
+            tmpdir,
+            "mysqldump",
+            'echo "-- Retrieving rows..." >&2; echo "INSERT $MYSQL_PWD;"; echo "-- Dump completed on 2026-10-19"',
+        ),
+        mysql_binary=_fake_binary(
+            tmpdir,
+            "mysql",
+            f'case "$*" in *" -e "*) touch {tmpdir.join("recreated")};; *) cat > {restored};; esac',
+        ),
+        database={
+            "test_function": "tests.test_encryption.always_ok",
+            "compression": {"default": {"external": "gzip -c", "decompress": "gzip -d -c"}},
+        },
+    )
+    config_path = str(tmpdir.join("config.yml"))
+    backup = Backup.from_config(config_path)
+    backup.full(files=False)
+
+    dump = os.path.join(backup.db_dir, "localhost.3306.shop.sql.gzip")
+    with gzip.open(dump) as infile:
+        assert infile.read().startswith(b"INSERT secret;")
+
+    restore = Backup.prepare_restore(config_path, backup.base_dir)
+    restore.restore(files=False)
+
+    assert tmpdir.join("recreated").exists()
+    assert restored.read().endswith("-- Dump completed on 2026-10-19\n")
+
+    # a dump without the closing line was cut off
+    with gzip.open(dump, "wb") as outfile:
+        outfile.write(b"INSERT secret;\n")
+    restored.remove()
+    with pytest.raises(BackupError, match="incomplete"):
+        restore.restore(files=False)
+    assert not restored.exists()
+
+
+def test_mysql_restore_failure(tmpdir, settings, config_writer, caplog):
+    settings.DATABASES = {"default": {"ENGINE": "django.db.backends.mysql", "NAME": "shop", "USER": "shop"}}
+    config_writer(
+        mysqldump_binary=_fake_binary(tmpdir, "mysqldump", 'echo "INSERT 1;"; echo "-- Dump completed on 2026-10-19"'),
+        mysql_binary=_fake_binary(
+            tmpdir, "mysql", 'case "$*" in *" -e "*) ;; *) cat > /dev/null; echo "ERROR 1062" >&2; exit 1;; esac'
+        ),
+        database={"test_function": "tests.test_encryption.always_ok"},
+    )
+    config_path = str(tmpdir.join("config.yml"))
+    backup = Backup.from_config(config_path)
+    backup.full(files=False)
+
+    restore = Backup.prepare_restore(config_path, backup.base_dir)
+    with pytest.raises(BackupError, match="Failed to restore"):
+        restore.restore(files=False)
+    assert "Restoring shop failed: ERROR 1062" in caplog.text
@@ -0,0 +1,121 @@
+import io
+import os
+import stat
+import struct
+
+import pytest
+from cryptography.exceptions import InvalidTag
+from cryptography.hazmat.primitives.ciphers.aead import AESGCM
+
+from ctrl_z import Backup
+from ctrl_z.encryption import (
+    HEADER, EncryptionError, decrypt_stream, encrypt_stream, generate_key,
+    load_key
+)
+
+KEY = generate_key()
+
+
+def always_ok(using):
+    return True
+
+
+def _roundtrip(data, key, chunk_size):
+    encrypted = io.BytesIO()
+    encrypt_stream(io.BytesIO(data), encrypted, key, chunk_size=chunk_size)
+    decrypted = io.BytesIO()
+    decrypt_stream(io.BytesIO(encrypted.getvalue()), decrypted, key)
+    return encrypted.getvalue(), decrypted.getvalue()
+
+
+@pytest.mark.parametrize("size", [0, 1, 16, 64, 100])
+def test_roundtrip(size):
+    key = os.urandom(32)
+    data = os.urandom(size)
+
+    encrypted, decrypted = _roundtrip(data, key, chunk_size=16)
+
+    assert decrypted == data
+    # short plaintexts may occur in the ciphertext by chance
+    assert size < 16 or data not in encrypted
+
+
+def test_truncation_detected():
+    key = os.urandom(32)
+    encrypted, _ = _roundtrip(os.urandom(64), key, chunk_size=16)
+
+    # drop the final chunk
+    with pytest.raises(EncryptionError):
+        decrypt_stream(io.BytesIO(encrypted[: -(16 + 16)]), io.BytesIO(), key)
+
+
+def test_wrong_key():
+    encrypted, _ = _roundtrip(b"secret", os.urandom(32), chunk_size=16)
+
+    with pytest.raises(EncryptionError):
+        decrypt_stream(io.BytesIO(encrypted), io.BytesIO(), os.urandom(32))
+
+
+def test_stream_keys_are_derived():
+    key = os.urandom(32)
+    first, _ = _roundtrip(b"same data", key, chunk_size=16)
+    second, _ = _roundtrip(b"same data", key, chunk_size=16)
+
+    _magic, _version, _chunk_size, salt, prefix = HEADER.unpack(first[: HEADER.size])
+    assert salt != HEADER.unpack(second[: HEADER.size])[3]
+    # the chunks are not encrypted with the configured key itself
+    nonce = prefix + struct.pack(">I?", 0, True)
+    with pytest.raises(InvalidTag):
+        AESGCM(key).decrypt(nonce, first[HEADER.size :], first[: HEADER.size])
+
+
+def test_load_key(tmpdir, monkeypatch):
+    monkeypatch.setenv("CTRL_Z_ENCRYPTION_KEY", KEY)
+    key_file = tmpdir.join("key")
+    key_file.write(generate_key() + "\n")
+
+    assert len(load_key({"key_env": "CTRL_Z_ENCRYPTION_KEY"})) == 32
+    assert load_key({"key_file": str(key_file)}) != load_key({})
+
+    monkeypatch.delenv("CTRL_Z_ENCRYPTION_KEY")
+    with pytest.raises(EncryptionError):
+        load_key({})
+
+
+def _fake_binary(tmpdir, name, script):
+    path = tmpdir.join(name)
+    path.write(f"#!/bin/sh\n{script}\n")
+    os.chmod(str(path), os.stat(str(path)).st_mode | stat.S_IEXEC)
+    return str(path)
+
+
+def test_encrypted_files_and_dump(tmpdir, settings, config_writer, monkeypatch):
+    monkeypatch.setenv("CTRL_Z_ENCRYPTION_KEY", KEY)
+    media = tmpdir.mkdir("media")
+    settings.MEDIA_ROOT = str(media)
+    media.mkdir("sub").join("file.txt").write("top secret")
+    restored_dump = tmpdir.join("restored.dump")
+    config_writer(
+        encryption={"enabled": True, "key_env": "CTRL_Z_ENCRYPTION_KEY"},
+        pg_dump_binary=_fake_binary(tmpdir, "pg_dump", 'echo "dump of $PGDATABASE"'),
+        pg_restore_binary=_fake_binary(tmpdir, "pg_restore", f"cat > {restored_dump}"),
+        dropdb_binary=_fake_binary(tmpdir, "dropdb", "true"),
+        createdb_binary=_fake_binary(tmpdir, "createdb", "true"),
+        database={"test_function": "tests.test_encryption.always_ok"},
+    )
+    config_path = str(tmpdir.join("config.yml"))
+
+    backup = Backup.from_config(config_path)
+    backup.full(skip_db=["secondary"])
+
+    with open(os.path.join(backup.files_dir, "media", "sub", "file.txt"), "rb") as backed_up:
+        assert b"top secret" not in backed_up.read()
+    (dump,) = os.listdir(backup.db_dir)
+    assert dump.endswith(".custom.enc")
+
+    media.join("sub", "file.txt").write("overwritten")
+    restore = Backup.prepare_restore(config_path, backup.base_dir)
+    restore.restore(skip_db=["secondary"])
+
+    assert media.join("sub", "file.txt").read() == "top secret"
+    assert restored_dump.read() == f"dump of {settings.DATABASES['default']['NAME']}\n"
@@ -0,0 +1,83 @@
+import errno
+import os
+
+import pytest
+
+from ctrl_z import fastcopy
+from ctrl_z.fastcopy import fast_copy
+
+
+@pytest.fixture
+def sparse_file(tmpdir):
+    path = str(tmpdir.join("disk.img"))
+    with open(path, "wb") as outfile:
+        outfile.write(b"header")
+        outfile.seek(8 * 1024 * 1024)
+        outfile.write(b"middle")
+        # trailing hole
+        outfile.truncate(16 * 1024 * 1024)
+    os.utime(path, (1_000_000_000, 1_000_000_000))
+    return path
+
+
+def _read(path):
+    with open(path, "rb") as infile:
+        return infile.read()
+
+
+def test_copy_keeps_content_and_metadata(tmpdir, sparse_file):
+    dst = fast_copy(sparse_file, str(tmpdir.join("copy.img")))
+
+    assert _read(dst) == _read(sparse_file)
+    assert os.stat(dst).st_mtime == 1_000_000_000
+
+
+def test_copy_keeps_holes(tmpdir, sparse_file, mocker):
+    # force the copy_file_range path, even on filesystems supporting reflinks
+    mocker.patch("ctrl_z.fastcopy._clone", return_value=False)
+    dst = fast_copy(sparse_file, str(tmpdir.join("copy.img")))
+
+    assert _read(dst) == _read(sparse_file)
+    assert os.stat(dst).st_blocks <= os.stat(sparse_file).st_blocks
+
+
+def test_fallback_to_read_write(tmpdir, sparse_file, mocker):
+    mocker.patch("ctrl_z.fastcopy._clone", return_value=False)
+    mocker.patch("os.copy_file_range", side_effect=OSError(errno.EXDEV, "cross-device"))
+    dst = fast_copy(sparse_file, str(tmpdir.join("copy.img")))
+
+    assert _read(dst) == _read(sparse_file)
+    assert os.stat(dst).st_blocks <= os.stat(sparse_file).st_blocks
+
+
+def test_cross_device_copy_reads_in_small_chunks(tmpdir, mocker):
+    src = tmpdir.join("media.bin")
+    src.write_binary(os.urandom(3 * fastcopy.READ_SIZE + 10))
+    mocker.patch("ctrl_z.fastcopy._clone", return_value=False)
+    mocker.patch("os.copy_file_range", side_effect=OSError(errno.EXDEV, "cross-device"))
+    pread = mocker.spy(os, "pread")
+
+    dst = fast_copy(str(src), str(tmpdir.join("copy.bin")))
+
+    assert _read(dst) == _read(str(src))
+    # MEDIA_ROOT on another mount than the backups must not buffer whole chunks
+    assert pread.call_count == 4
+    assert max(call.args[1] for call in pread.call_args_list) == fastcopy.READ_SIZE
+
+
+def test_copy_into_directory(tmpdir):
+    src = tmpdir.join("file.txt")
+    src.write("")
+    target = tmpdir.mkdir("target")
+
+    assert fast_copy(str(src), str(target)) == str(target.join("file.txt"))
+    assert target.join("file.txt").read() == ""
+
+
+def test_clone_unsupported(tmpdir, mocker):
+    mocker.patch("fcntl.ioctl", side_effect=OSError(errno.EOPNOTSUPP, "not supported"))
+    src = tmpdir.join("file.txt")
+    src.write("content")
+
+    with open(str(src), "rb") as infile, open(str(tmpdir.join("copy.txt")), "wb") as outfile:
+        assert fastcopy._clone(infile.fileno(), outfile.fileno()) is False
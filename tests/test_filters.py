@@ -0,0 +1,120 @@
+import os
+
+import ctrl_z.backup as backup_module
+from ctrl_z import Backup
+from ctrl_z.filters import PathFilter, expand_patterns, get_base_dirs
+
+
+def test_no_filters():
+    path_filter = PathFilter()
+
+    assert not path_filter
+    assert not path_filter.is_excluded("some/file.txt", size=10**12)
+
+
+def test_exclude_patterns():
+    path_filter = PathFilter(exclude=["thumbnails", "tmp/*", "*.part"])
+
+    assert path_filter.is_excluded("thumbnails", is_dir=True)
+    assert path_filter.is_excluded("tmp/upload.bin")
+    assert path_filter.is_excluded("uploads/big.iso.part")
+    assert not path_filter.is_excluded("uploads/thumbnails.txt")
+    assert not path_filter.is_excluded("uploads", is_dir=True)
+
+
+def test_include_patterns_and_size():
+    path_filter = PathFilter(include=["*.pdf"], max_file_size=100)
+
+    assert not path_filter.is_excluded("docs", is_dir=True)
+    assert not path_filter.is_excluded("docs/a.pdf", size=100)
+    assert path_filter.is_excluded("docs/a.pdf", size=101)
+    assert path_filter.is_excluded("docs/a.txt", size=1)
+
+
+def test_restore_patterns():
+    patterns = expand_patterns(["/uploads/customer-123/", "docs/*.pdf", "archive/2020/**", "archive/*/index.txt"])
+
+    assert patterns == [
+        "uploads/customer-123",
+        "uploads/customer-123/*",
+        "docs/*.pdf",
+        "archive/2020/**",
+        "archive/*/index.txt",
+    ]
+    assert get_base_dirs(patterns) == ["archive", "docs", "uploads/customer-123"]
+    assert get_base_dirs(["*.pdf", "docs/*"]) == [""]
+
+
+def test_backup_and_restore_filtered(tmpdir, settings, config_writer):
+    media = tmpdir.mkdir("media")
+    settings.MEDIA_ROOT = str(media)
+    media.join("keep.txt").write("keep")
+    media.join("big.bin").write("x" * 100)
+    media.mkdir("thumbnails").join("thumb.jpg").write("thumb")
+    media.mkdir("docs").join("report.txt").write("report")
+    config_writer(
+        files={
+            "directories": ["MEDIA_ROOT"],
+            "overwrite_existing_directory": True,
+            "filters": {"MEDIA_ROOT": {"exclude": ["thumbnails"], "max_file_size": 10}},
+        }
+    )
+    config_path = str(tmpdir.join("config.yml"))
+
+    backup = Backup.from_config(config_path)
+    backup.full(db=False)
+
+    copy = os.path.join(backup.files_dir, "media")
+    assert sorted(os.listdir(copy)) == ["docs", "keep.txt"]
+    assert os.listdir(os.path.join(copy, "docs")) == ["report.txt"]
+
+    # files that got into the backup before filters were configured are not restored
+    with open(os.path.join(copy, "old.tmp"), "w") as old:
+        old.write("temporary")
+    config_writer(
+        base_dir=str(tmpdir.join("backups")),
+        files={
+            "directories": ["MEDIA_ROOT"],
+            "overwrite_existing_directory": True,
+            "filters": {"MEDIA_ROOT": {"exclude": ["*.tmp"]}},
+        },
+    )
+    restore = Backup.prepare_restore(config_path, backup.base_dir)
+    restore.restore(db=False)
+
+    assert sorted(os.listdir(str(media))) == ["docs", "keep.txt"]
+
+
+def test_restore_matching_paths(tmpdir, settings, config_writer, mocker):
+    media = tmpdir.mkdir("media")
+    settings.MEDIA_ROOT = str(media)
+    uploads = media.mkdir("uploads")
+    uploads.mkdir("customer-123").mkdir("invoices").join("1.pdf").write("invoice")
+    uploads.join("customer-123", "notes.txt").write("notes")
+    uploads.mkdir("customer-456").join("contract.pdf").write("contract")
+    config_writer()
+    config_path = str(tmpdir.join("config.yml"))
+
+    backup = Backup.from_config(config_path)
+    backup.full(db=False)
+
+    uploads.join("customer-123").remove()
+    uploads.join("customer-456", "contract.pdf").write("newer contract")
+    media.join("added.txt").write("added")
+    walk = mocker.spy(backup_module, "walk_tree")
+
+    restore = Backup.prepare_restore(config_path, backup.base_dir)
+    restore.restore(db=False, paths=["uploads/customer-123/**"])
+
+    assert uploads.join("customer-123", "invoices", "1.pdf").read() == "invoice"
+    assert uploads.join("customer-123", "notes.txt").read() == "notes"
+    assert uploads.join("customer-456", "contract.pdf").read() == "newer contract"
+    assert media.join("added.txt").exists()
+    # only the matching subtree is walked
+    assert [call.args for call in walk.call_args_list] == [
+        (os.path.join(restore.files_dir, "media", "uploads", "customer-123"),)
+    ]
+
+    uploads.join("customer-123", "notes.txt").remove()
+    restore.restore(db=False, paths=["uploads/customer-123/notes.txt"])
+    assert uploads.join("customer-123", "notes.txt").read() == "notes"
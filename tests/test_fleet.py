@@ -0,0 +1,103 @@
+import json
+import textwrap
+
+import yaml
+
+from ctrl_z.fleet import FleetRunner, Job, main
+
+FAKE_CLI = textwrap.dedent(
+    """
+    import json, os, sys, time
+
+    config_file = sys.argv[sys.argv.index("--config-file") + 1]
+    with open(config_file) as infile:
+        config = json.load(infile)
+
+    start = time.time()
+    time.sleep(config.get("sleep", 0))
+    with open(config["output"], "w") as outfile:
+        json.dump({"start": start, "end": time.time(), "argv": sys.argv[1:],
+                   "settings": os.environ.get("DJANGO_SETTINGS_MODULE")}, outfile)
+    print("backing up", config["output"])
+    sys.exit(config.get("exit_code", 0))
+    """
+)
+
+
+def _make_job(tmpdir, name, **config):
+    cli = tmpdir.join("cli.py")
+    if not cli.check():
+        cli.write(FAKE_CLI)
+    config["output"] = str(tmpdir.join(f"{name}.json"))
+    config_file = tmpdir.join(f"{name}.yml")
+    config_file.write(json.dumps(config))
+    return Job(cli=str(cli), config_file=str(config_file), name=name)
+
+
+def test_run_concurrently_with_limit(tmpdir):
+    jobs = [_make_job(tmpdir, f"site-{i}", sleep=0.3) for i in range(4)]
+    runner = FleetRunner(jobs, max_parallel=2)
+
+    results = runner.run()
+
+    assert all(result.succeeded for result in results)
+    runs = [json.loads(tmpdir.join(f"site-{i}.json").read()) for i in range(4)]
+    # never more than two backups running at the same time
+    for run in runs:
+        overlapping = [other for other in runs if other["start"] < run["end"] and other["end"] > run["start"]]
+        assert len(overlapping) <= 2
+    assert runs[0]["argv"][-1] == "backup"
+
+
+def test_combined_report(tmpdir):
+    jobs = [_make_job(tmpdir, "ok"), _make_job(tmpdir, "broken", exit_code=3)]
+    runner = FleetRunner(jobs)
+
+    report = runner.report(runner.run())
+
+    assert report.startswith("1/2 backups succeeded")
+    assert "ok: OK" in report
+    assert "broken: FAILED (3)" in report
+    assert "Output of broken" in report
+    assert "Output of ok" not in report
+
+
+def test_main_fleet_file(tmpdir):
+    job = _make_job(tmpdir, "site")
+    fleet_file = tmpdir.join("fleet.yml")
+    fleet_file.write(
+        yaml.dump(
+            {
+                "max_parallel": 1,
+                "jobs": [
+                    {
+                        "name": job.name,
+                        "cli": job.cli,
+                        "config_file": job.config_file,
+                        "settings": "site.settings",
+                        "args": ["--no-files"],
+                    }
+                ],
+            }
+        )
+    )
+    report_file = tmpdir.join("report.txt")
+
+    exit_code = main([str(fleet_file), "--report-file", str(report_file)])
+
+    assert exit_code == 0
+    assert report_file.read().startswith("1/1 backups succeeded")
+    run = json.loads(tmpdir.join("site.json").read())
+    assert run["settings"] == "site.settings"
+    assert run["argv"][-2:] == ["backup", "--no-files"]
+
+
+def test_niceness_and_ionice_prefix_the_command(tmpdir, mocker):
+    mocker.patch("ctrl_z.fleet.shutil.which", return_value="/usr/bin/tool")
+    job = _make_job(tmpdir, "site")
+    runner = FleetRunner([job], niceness=10, ionice="idle")
+
+    command = runner._get_command(job, "backup")
+
+    assert command[:6] == ["nice", "-n", "10", "ionice", "-c", "3"]
+    assert command[6:] == job.get_command("backup")
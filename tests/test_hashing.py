@@ -0,0 +1,101 @@
+import hashlib
+import os
+import time
+
+from ctrl_z import Backup, hashing
+from ctrl_z.hashing import HashCache, hash_tree, read_manifest, write_manifest
+
+
+def test_hash_tree(tmpdir):
+    root = tmpdir.mkdir("root")
+    root.join("a.txt").write("a")
+    root.mkdir("sub").join("b.txt").write("b")
+
+    digests = hash_tree(str(root))
+
+    assert digests == {
+        "a.txt": hashlib.sha256(b"a").hexdigest(),
+        os.path.join("sub", "b.txt"): hashlib.sha256(b"b").hexdigest(),
+    }
+
+
+def test_cache_only_rehashes_changed_files(tmpdir, mocker):
+    root = tmpdir.mkdir("root")
+    root.join("a.txt").write("a")
+    root.join("b.txt").write("b")
+    cache_path = str(tmpdir.join("cache.sqlite3"))
+
+    with HashCache(cache_path) as cache:
+        hash_tree(str(root), cache=cache)
+
+    root.join("b.txt").write("changed")
+    spy = mocker.spy(hashing, "hash_file")
+
+    with HashCache(cache_path) as cache:
+        digests = hash_tree(str(root), cache=cache)
+
+    assert spy.call_count == 1
+    assert digests["b.txt"] == hashlib.sha256(b"changed").hexdigest()
+    assert digests["a.txt"] == hashlib.sha256(b"a").hexdigest()
+
+
+def test_shared_cache(tmpdir, mocker):
+    tmpdir.join("a.txt").write("a")
+    tmpdir.join("b.txt").write("b")
+    stat_a, stat_b = os.stat(str(tmpdir.join("a.txt"))), os.stat(str(tmpdir.join("b.txt")))
+    cache_path = str(tmpdir.join("cache.sqlite3"))
+    mocker.patch("ctrl_z.hashing.TIMEOUT", 0.1)
+
+    # the writes of concurrent users of the cache don't lock each other out
+    with HashCache(cache_path, batch_size=1) as first, HashCache(cache_path, batch_size=1) as second:
+        first.set(stat_a, "digest-a")
+        second.set(stat_b, "digest-b")
+        first.set(stat_b, "digest-b")
+
+    # digests of files that are gone are pruned
+    mocker.patch("ctrl_z.hashing.time.time", return_value=time.time() + hashing.PRUNE_AFTER + 60)
+    with HashCache(cache_path) as cache:
+        assert cache.get(stat_a) == "digest-a"
+    with HashCache(cache_path) as cache:
+        assert cache.get(stat_a) == "digest-a"
+        assert cache.get(stat_b) is None
+
+
+def test_manifest_roundtrip(tmpdir):
+    digests = {"a b.txt": "abc", "sub/c.txt": "def"}
+    path = str(tmpdir.join("manifest.sha256"))
+
+    write_manifest(path, digests)
+
+    assert read_manifest(path) == digests
+
+
+def test_backup_and_delta_restore(tmpdir, settings, config_writer):
+    media = tmpdir.mkdir("media")
+    settings.MEDIA_ROOT = str(media)
+    media.join("unchanged.txt").write("same")
+    media.join("modified.txt").write("original")
+    config_writer(files={"directories": ["MEDIA_ROOT"], "overwrite_existing_directory": True, "checksums": True})
+    config_path = str(tmpdir.join("config.yml"))
+
+    backup = Backup.from_config(config_path)
+    backup.full(db=False)
+
+    assert os.path.exists(os.path.join(backup.files_dir, "media.sha256"))
+
+    media.join("modified.txt").write("modified")
+    media.mkdir("new").join("added.txt").write("added")
+    # symlinks are left alone, and never followed
+    outside = tmpdir.mkdir("outside")
+    outside.join("other.txt").write("other")
+    os.symlink(str(outside), str(media.join("linked")))
+    unchanged_mtime = os.stat(str(media.join("unchanged.txt"))).st_mtime_ns
+
+    restore = Backup.prepare_restore(config_path, backup.base_dir)
+    restore.restore(db=False)
+
+    assert media.join("modified.txt").read() == "original"
+    assert not media.join("new").check()
+    assert outside.join("other.txt").read() == "other"
+    # untouched, not copied again
+    assert os.stat(str(media.join("unchanged.txt"))).st_mtime_ns == unchanged_mtime
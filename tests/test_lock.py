@@ -0,0 +1,148 @@
+import fcntl
+import json
+import os
+import socket
+import subprocess
+import threading
+import time
+from datetime import datetime, timedelta, timezone
+
+import pytest
+
+from ctrl_z import Backup
+from ctrl_z.lock import (
+    LockBrokenError, LockError, backup_lock, is_stale, read_holder
+)
+
+
+def test_lock_excludes_other_runs(tmpdir):
+    base_dir = str(tmpdir.join("backups", "2026-10-19-daily"))
+
+    with backup_lock(base_dir) as path:
+        assert path == str(tmpdir.join("backups", ".ctrl-z.lock"))
+        assert read_holder(path)["pid"] == os.getpid()
+        with pytest.raises(LockError, match=f"PID {os.getpid()}"):
+            with backup_lock(str(tmpdir.join("backups", "2026-10-19-weekly"))):
+                pass
+        with backup_lock(base_dir, mode="skip") as skipped:
+            assert skipped is None
+
+    # released and emptied
+    assert read_holder(path) is None
+    with backup_lock(base_dir):
+        pass
+
+
+def test_wait_for_lock(tmpdir):
+    base_dir = str(tmpdir.join("backups", "2026-10-19-daily"))
+    acquired, release = threading.Event(), threading.Event()
+
+    def wait_and_hold():
+        with backup_lock(base_dir, mode="wait"):
+            acquired.set()
+            release.wait(5)
+
+    with backup_lock(base_dir):
+        waiter = threading.Thread(target=wait_and_hold)
+        waiter.start()
+        assert not acquired.wait(0.2)
+    assert acquired.wait(5)
+
+    try:
+        with pytest.raises(LockError):
+            with backup_lock(base_dir, mode="wait", timeout=0.1):
+                pass
+    finally:
+        release.set()
+        waiter.join()
+
+
+def test_cleanup_of_dead_run(tmpdir, caplog):
+    process = subprocess.Popen(["true"])
+    process.wait()
+    lock_path = tmpdir.mkdir("backups").join(".ctrl-z.lock")
+    holder = {"pid": process.pid, "host": socket.gethostname(), "started": "then", "heartbeat": "then"}
+    lock_path.write(json.dumps(holder))
+
+    with backup_lock(str(tmpdir.join("backups", "2026-10-19-daily"))):
+        assert read_holder(str(lock_path))["pid"] == os.getpid()
+
+    assert f"PID {process.pid}" in caplog.text
+
+
+def _heartbeat(age):
+    return (datetime.now(timezone.utc) - timedelta(seconds=age)).isoformat(timespec="seconds")
+
+
+@pytest.mark.parametrize("age,broken", [(10, False), (600, True)])
+def test_stale_lock_of_other_host(tmpdir, age, broken):
+    lock_path = str(tmpdir.mkdir("backups").join(".ctrl-z.lock"))
+    holder = {"pid": 1, "host": "crashed.example.com", "started": "then", "heartbeat": _heartbeat(age)}
+    with open(lock_path, "w") as lock_file:
+        lock_file.write(json.dumps(holder))
+    # a lock that is never released, like one of an NFS client that crashed
+    fd = os.open(lock_path, os.O_RDWR)
+    fcntl.flock(fd, fcntl.LOCK_EX)
+
+    try:
+        if broken:
+            with backup_lock(str(tmpdir.join("backups", "2026-10-19-daily")), stale_after=300):
+                assert read_holder(lock_path)["pid"] == os.getpid()
+        else:
+            with pytest.raises(LockError, match="crashed.example.com"):
+                with backup_lock(str(tmpdir.join("backups", "2026-10-19-daily")), stale_after=300):
+                    pass
+    finally:
+        os.close(fd)
+
+
+def test_is_stale():
+    assert not is_stale(None, 300)
+    assert not is_stale({}, 300)
+    # only the heartbeat counts for other hosts, not the age of the file
+    assert not is_stale({"pid": 1, "host": "other.example.com"}, 300)
+    assert not is_stale({"pid": 1, "host": "other.example.com", "heartbeat": "then"}, 300)
+    assert is_stale({"pid": 1, "host": "other.example.com", "heartbeat": _heartbeat(600)}, 300)
+    assert not is_stale({"pid": "1", "host": socket.gethostname()}, 300)
+
+
+def test_unreadable_lock_is_not_broken(tmpdir):
+    lock_path = str(tmpdir.mkdir("backups").join(".ctrl-z.lock"))
+    with open(lock_path, "w") as lock_file:
+        lock_file.write("{not json")
+    fd = os.open(lock_path, os.O_RDWR)
+    fcntl.flock(fd, fcntl.LOCK_EX)
+    os.utime(lock_path, (0, 0))
+
+    try:
+        with pytest.raises(LockError, match="an unknown run"):
+            with backup_lock(str(tmpdir.join("backups", "2026-10-19-daily")), stale_after=300):
+                pass
+    finally:
+        os.close(fd)
+
+
+def test_broken_lock_aborts(tmpdir):
+    base_dir = str(tmpdir.join("backups", "2026-10-19-daily"))
+    broken = threading.Event()
+
+    with pytest.raises(LockBrokenError):
+        with backup_lock(base_dir, heartbeat=0.05, broken=broken) as path:
+            # another run replaced the lock file, considering this run dead
+            os.replace(path, f"{path}.old")
+            open(path, "w").close()
+            assert broken.wait(5)
+
+
+def test_backup_holds_the_lock(tmpdir, settings, config_writer):
+    settings.MEDIA_ROOT = str(tmpdir.mkdir("media"))
+    config_writer(lock={"mode": "skip"})
+    backup = Backup.from_config(str(tmpdir.join("config.yml")))
+
+    with backup_lock(backup.base_dir):
+        assert backup.full(db=False) is None
+    assert not os.path.exists(backup.base_dir)
+
+    # rotate runs under the lock of full
+    backup.full(db=False)
+    assert os.path.exists(backup.files_dir)
@@ -0,0 +1,77 @@
+"""
+Peak memory use must not grow with the size of the trees and outputs.
+
+Measured with tracemalloc, so only Python allocations count - which is where
+unbounded buffering would show up. Every directory is still listed as a whole,
+so the trees grow in depth rather than in width.
+"""
+import tracemalloc
+
+from ctrl_z import Backup
+from ctrl_z.hashing import hash_tree
+from ctrl_z.streams import BoundedBuffer, run_command
+
+# allowed growth of the peak for 100 times the input
+MARGIN = 256 * 1024
+
+
+def _peak(function, *args, **kwargs) -> int:
+    tracemalloc.start()
+    try:
+        function(*args, **kwargs)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def _make_tree(root, depth):
+    """
+    Make a tree of 10 subdirectories per level, with 5 files in every directory.
+    """
+    for i in range(5):
+        root.join(f"file{i}.txt").write(f"content {root.basename} {i}")
+    if depth > 0:
+        for i in range(10):
+            _make_tree(root.mkdir(f"dir{i}"), depth - 1)
+
+
+def test_command_output_is_bounded():
+    small = _peak(run_command, ["sh", "-c", "head -c 1000000 /dev/zero; head -c 1000000 /dev/zero >&2"])
+    large = _peak(run_command, ["sh", "-c", "head -c 100000000 /dev/zero; head -c 100000000 /dev/zero >&2"])
+
+    assert large < small + MARGIN
+
+
+def test_file_restore_is_bounded(tmpdir, settings, config_writer):
+    peaks = []
+    # 55 and 5555 files
+    for depth in (1, 3):
+        media = tmpdir.mkdir(f"media{depth}")
+        settings.MEDIA_ROOT = str(media)
+        _make_tree(media, depth)
+        config_writer(base_dir=str(tmpdir.join(f"backups{depth}")))
+        backup = Backup.from_config(str(tmpdir.join("config.yml")))
+        backup.files()
+
+        restore = Backup.prepare_restore(str(tmpdir.join("config.yml")), backup.base_dir)
+        peaks.append(_peak(restore.restore_files))
+        assert media.join("dir9", "file4.txt").exists()
+
+    assert peaks[1] < peaks[0] + MARGIN
+
+
+def test_hashing_keeps_only_the_digests(tmpdir):
+    small, large = tmpdir.mkdir("small"), tmpdir.mkdir("large")
+    _make_tree(small, 1)
+    _make_tree(large, 3)
+
+    # the digests themselves are the result, about 300 bytes per file
+    assert _peak(hash_tree, str(large), workers=1) < _peak(hash_tree, str(small), workers=1) + 5500 * 300 + MARGIN
+
+
+def test_bounded_buffer_keeps_head_and_tail():
+    buffer = BoundedBuffer(limit=8)
+    for chunk in (b"ab", b"cdef", b"ghij"):
+        assert buffer.write(chunk) == len(chunk)
+
+    assert buffer.getvalue() == b"abcd\n[... 2 bytes omitted ...]\nghij"
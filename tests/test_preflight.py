@@ -0,0 +1,86 @@
+import gzip
+import os
+
+import pytest
+
+from ctrl_z import Backup
+from ctrl_z.backup import BackupError, RestorePlan
+
+from .test_encryption import KEY, _fake_binary
+
+
+def _write_config(tmpdir, config_writer, restored_dump, **overrides):
+    config_writer(
+        pg_dump_binary=_fake_binary(tmpdir, "pg_dump", 'echo "dump of $PGDATABASE"'),
+        # --list fails for the corrupt dumps written below
+        pg_restore_binary=_fake_binary(
+            tmpdir,
+            "pg_restore",
+            f'if [ "$1" = "--list" ]; then ! cat ${{2:+"$2"}} | grep -q corrupt; else cat > {restored_dump}; fi',
+        ),
+        dropdb_binary=_fake_binary(tmpdir, "dropdb", f"touch {tmpdir.join('dropped')}"),
+        createdb_binary=_fake_binary(tmpdir, "createdb", "true"),
+        **overrides,
+    )
+    return str(tmpdir.join("config.yml"))
+
+
+def test_truncated_encrypted_dump_fails_before_drop(tmpdir, settings, config_writer, monkeypatch):
+    monkeypatch.setenv("CTRL_Z_ENCRYPTION_KEY", KEY)
+    settings.MEDIA_ROOT = str(tmpdir.mkdir("media"))
+    config_path = _write_config(
+        tmpdir,
+        config_writer,
+        tmpdir.join("restored.dump"),
+        encryption={"enabled": True},
+        database={"test_function": "tests.test_encryption.always_ok"},
+    )
+    backup = Backup.from_config(config_path)
+    backup.full(skip_db=["secondary"], files=False)
+    (dump,) = os.listdir(backup.db_dir)
+    dump_path = os.path.join(backup.db_dir, dump)
+    with open(dump_path, "r+b") as dump_file:
+        dump_file.truncate(os.path.getsize(dump_path) - 1)
+
+    restore = Backup.prepare_restore(config_path, backup.base_dir)
+    with pytest.raises(BackupError, match="pre-restore check"):
+        restore.restore(skip_db=["secondary"], files=False)
+
+    assert not tmpdir.join("dropped").exists()
+
+
+def test_check_compressed_dump(tmpdir, config_writer):
+    config_path = _write_config(
+        tmpdir,
+        config_writer,
+        tmpdir.join("restored.dump"),
+        database={"compression": {"default": {"external": "gzip -c", "decompress": "gzip -d -c"}}},
+    )
+    backup = Backup.from_config(config_path)
+    compression = backup._get_compression("default")
+    valid, corrupt, truncated = (str(tmpdir.join(name)) for name in ("valid.gz", "corrupt.gz", "truncated.gz"))
+    for path, content in [(valid, b"dump"), (corrupt, b"corrupt dump"), (truncated, b"dump" * 1000)]:
+        with gzip.open(path, "wb") as outfile:
+            outfile.write(content)
+    with open(truncated, "r+b") as outfile:
+        outfile.truncate(20)
+
+    assert backup._check_dump(RestorePlan("default", {}, valid, compression)) is None
+    assert "exited with code 1" in backup._check_dump(RestorePlan("default", {}, corrupt, compression))
+    assert "gzip failed" in backup._check_dump(RestorePlan("default", {}, truncated, compression))
+
+
+def test_preflight_reports_all_failures(tmpdir, config_writer):
+    config_path = _write_config(tmpdir, config_writer, tmpdir.join("restored.dump"))
+    backup = Backup.from_config(config_path)
+    plans = []
+    for name, content in [("first", "corrupt"), ("second", "dump"), ("third", "corrupt")]:
+        tmpdir.join(name).write(content)
+        plans.append(RestorePlan(name, {}, str(tmpdir.join(name))))
+
+    with pytest.raises(BackupError) as excinfo:
+        backup.preflight(plans)
+
+    assert "first" in str(excinfo.value)
+    assert "second" not in str(excinfo.value)
+    assert "third" in str(excinfo.value)
@@ -0,0 +1,38 @@
+import json
+import subprocess
+
+from ctrl_z.profiling import Profiler, get_profiler, wait
+
+
+def test_wait_records_resource_usage():
+    with Profiler() as profiler:
+        assert get_profiler() is profiler
+        with profiler.phase("databases"):
+            process = subprocess.Popen(["sh", "-c", "head -c 1000000 /dev/zero | gzip > /dev/null; exit 3"])
+            assert wait(process) == 3
+    assert get_profiler() is None
+
+    (record,) = profiler.processes
+    assert record["command"] == "sh"
+    assert record["phase"] == "databases"
+    assert record["returncode"] == 3
+    assert record["max_rss"] > 0
+
+
+def test_wait_without_profiler():
+    process = subprocess.Popen(["true"])
+
+    assert wait(process) == 0
+
+
+def test_write_bundle(tmpdir):
+    profiler = Profiler()
+    with profiler.phase("files"):
+        sorted(range(1000), reverse=True)
+
+    path = profiler.write(str(tmpdir))
+
+    assert tmpdir.join("profile", "01-files.prof").exists()
+    with open(f"{path}/summary.json", "r") as summary:
+        assert json.load(summary)["phases"][0]["name"] == "files"
+    assert "== files:" in tmpdir.join("profile", "summary.txt").read()
@@ -0,0 +1,82 @@
+import io
+import logging
+
+from ctrl_z.progress import OutputFollower, Progress, count_toc_entries
+from ctrl_z.walk import walk_tree
+
+
+class FakeTTY(io.StringIO):
+    def isatty(self):
+        return True
+
+
+def test_render_and_eta(mocker):
+    mocker.patch("ctrl_z.progress.time.monotonic", side_effect=[0, 10, 10, 10])
+    progress = Progress("Copying media", total_items=4, total_bytes=4096, interval=0)
+
+    progress.update(1, 1024)
+
+    assert progress.render() == "Copying media: 1/4 files, 1.0 KiB/4.0 KiB, 102 B/s, ETA 0:00:30"
+
+
+def test_periodic_log_lines(mocker, caplog):
+    mocker.patch("ctrl_z.progress.time.monotonic", side_effect=[0, 5, 31, 31, 31])
+    progress = Progress("Restoring db", unit="TOC entries", interval=30)
+
+    with caplog.at_level(logging.INFO, logger="ctrl_z.progress"):
+        progress.update()
+        progress.update()
+
+    assert [record.getMessage() for record in caplog.records] == ["Restoring db: 2 TOC entries, 0.1 TOC entries/s"]
+
+
+def test_tty_line():
+    stream = FakeTTY()
+    progress = Progress("Copying media", stream=stream)
+    progress.last_output = -1
+
+    progress.update(1, 10)
+    progress.finish()
+
+    assert stream.getvalue().startswith("\rCopying media: 1 files, 10 B")
+    assert stream.getvalue().endswith("\n")
+
+
+def test_output_follower():
+    stderr = io.BytesIO(
+        b'pg_restore: connecting to database for restore\n'
+        b'pg_restore: creating TABLE "public.foo"\n'
+        b'pg_restore: processing data for table "public.foo"\n'
+        b'pg_restore: error: could not execute query: ERROR:  relation "foo" already exists\n'
+        b"Command was: CREATE TABLE public.foo ();\n"
+    )
+    progress = Progress("Restoring db", unit="TOC entries", interval=0)
+
+    follower = OutputFollower(stderr, progress)
+    follower.start()
+    follower.join()
+
+    assert progress.items == 2
+    assert follower.output == (
+        b'pg_restore: error: could not execute query: ERROR:  relation "foo" already exists\n'
+        b"Command was: CREATE TABLE public.foo ();\n"
+    )
+
+
+def test_count_toc_entries():
+    listing = (
+        b";\n; Archive created at 2018-06-27 02:00:00 UTC\n;\n"
+        b"215; 1259 16386 TABLE public foo ctrlz\n"
+        b"2140; 0 16386 TABLE DATA public foo ctrlz\n"
+    )
+
+    assert count_toc_entries(io.BytesIO(listing)) == 2
+
+
+def test_track_walked_entries(tmpdir):
+    tmpdir.join("a.txt").write("a" * 10)
+    tmpdir.mkdir("sub").join("b.txt").write("b" * 5)
+    progress = Progress("Copying", stream=io.StringIO(), interval=0)
+
+    assert len(list(progress.track(walk_tree(str(tmpdir))))) == 3
+    assert (progress.items, progress.bytes) == (2, 15)
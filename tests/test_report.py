@@ -0,0 +1,53 @@
+import gzip
+import logging
+import os
+
+from ctrl_z import Backup, configure_logging
+from ctrl_z.report import ReportHandler
+
+logger = logging.getLogger("ctrl_z.tests")
+
+
+def test_report_handler_bounded():
+    handler = ReportHandler(tail_lines=3, max_errors=2)
+
+    for i in range(10):
+        handler.handle(logger.makeRecord("ctrl_z", logging.INFO, __file__, 1, "line %d", (i,), None))
+    for i in range(5):
+        handler.handle(logger.makeRecord("ctrl_z", logging.ERROR, __file__, 1, "error %d", (i,), None))
+
+    assert list(handler.tail) == ["error 2", "error 3", "error 4"]
+    assert list(handler.errors) == ["error 3", "error 4"]
+    assert handler.counts == {"INFO": 10, "ERROR": 5}
+
+
+def test_report_mail(tmpdir, config_writer, mailoutbox):
+    config_writer(report={"enabled": True, "to": ["root@localhost"], "tail_lines": 2})
+    backup = Backup.from_config(str(tmpdir.join("config.yml")))
+
+    # output of a previous run in the same backup directory
+    os.makedirs(backup.base_dir)
+    with open(os.path.join(backup.base_dir, "backup.log"), "w") as previous:
+        previous.write("previous run\n")
+
+    configure_logging(backup.config)
+    run_logger = logging.getLogger("ctrl_z.backup")
+    run_logger.info("first")
+    run_logger.error("something broke")
+    run_logger.info("last")
+
+    backup.report(has_errors=True)
+
+    assert len(mailoutbox) == 1
+    message = mailoutbox[0]
+    assert "failed" in message.subject
+    assert "Status: FAILED" in message.body
+    assert "something broke" in message.body
+    assert "first" not in message.body
+
+    ((filename, content, mimetype),) = message.attachments
+    assert filename == "backup.log.gz"
+    assert mimetype == "application/gzip"
+    log_content = gzip.decompress(content).decode()
+    assert "first" in log_content
+    assert "previous run" not in log_content
@@ -6,7 +6,9 @@ from django.db import connection
 import pytest
 
 # aliased, otherwise it's picked up as a test function by pytest
-from ctrl_z.db_restore import test_migrations_table as check_migrations
+from ctrl_z.db_restore import (
+    check_row_counts, get_row_counts, test_migrations_table as check_migrations
+)
 
 
 @pytest.mark.django_db(databases=["secondary"])
@@ -33,3 +35,16 @@ def test_table_does_not_exist():
         cursor.execute("DROP TABLE django_migrations;")
 
     assert check_migrations() is False
+
+
+@pytest.mark.django_db
+def test_row_counts():
+    with connection.cursor() as cursor:
+        # the counts are estimated from the statistics
+        cursor.execute("ANALYZE")
+    counts = get_row_counts()
+
+    assert counts["public.django_migrations"] > 0
+    assert check_row_counts(row_counts=counts) is True
+    assert check_row_counts(row_counts={**counts, "public.missing": 1}) is False
+    assert check_row_counts(row_counts={**counts, "public.django_migrations": 1000}) is False
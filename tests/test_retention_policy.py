@@ -1,6 +1,8 @@
 """
 Test that the backup retention policy is correctly implemented.
 """
+from datetime import datetime
+
 from freezegun import freeze_time
 
 from ctrl_z.retention import RetentionPolicy
@@ -74,3 +76,54 @@ def test_do_not_touch_other_directories(tmpdir):
 
     remaining = sorted([local.basename for local in base.listdir()])
     assert remaining == ["2018-01-01", "2018-01-01-yearly", "no-touchy"]
+
+
+@freeze_time("2018-06-27 10:15")  # it's Wednesday
+def test_hourly_rotation(tmpdir):
+    base = tmpdir.mkdir("backups")
+    base.mkdir("2018-06-26-daily")  # should be kept
+    base.mkdir("2018-06-26-1500-hourly")  # should be gone
+    base.mkdir("2018-06-27-daily")  # should be kept
+    base.mkdir("2018-06-27-0830-hourly")  # should be gone
+    base.mkdir("2018-06-27-0915-hourly")  # should be kept
+    base.mkdir("2018-06-27-1000-hourly")  # should be kept
+    policy = RetentionPolicy(day_of_week=0, days_to_keep=2, weeks_to_keep=0, hours_to_keep=2)
+
+    policy.rotate(base=str(base))
+
+    remaining = sorted(local.basename for local in base.listdir())
+    assert remaining == [
+        "2018-06-26-daily",
+        "2018-06-27-0915-hourly",
+        "2018-06-27-1000-hourly",
+        "2018-06-27-daily",
+    ]
+
+
+@freeze_time("2018-06-27 10:15")
+def test_hourly_base_dir(tmpdir):
+    base = tmpdir.mkdir("backups")
+    policy = RetentionPolicy(day_of_week=0, days_to_keep=7, weeks_to_keep=4, hours_to_keep=12)
+
+    assert policy.get_base_dir(str(base)) == str(base.join("2018-06-27-daily"))
+
+    base.mkdir("2018-06-27-daily")
+
+    assert policy.get_base_dir(str(base)) == str(base.join("2018-06-27-1015-hourly"))
+
+
+@freeze_time("2018-06-27")
+def test_monthly_rotation(tmpdir):
+    base = tmpdir.mkdir("backups")
+    base.mkdir("2018-03-01-monthly")  # should be gone
+    base.mkdir("2018-04-01-monthly")  # should be kept
+    base.mkdir("2018-05-01-monthly")  # should be kept
+    base.mkdir("2018-06-01-monthly")  # should be kept
+    base.mkdir("2018-06-25-weekly")  # should be gone
+    policy = RetentionPolicy(day_of_week=0, days_to_keep=1, weeks_to_keep=0, day_of_month=1, months_to_keep=3)
+
+    policy.rotate(base=str(base))
+
+    remaining = sorted(local.basename for local in base.listdir())
+    assert remaining == ["2018-04-01-monthly", "2018-05-01-monthly", "2018-06-01-monthly"]
+    assert policy.get_suffix(datetime(2018, 7, 1)) == "monthly"
@@ -0,0 +1,93 @@
+import errno
+import os
+
+import pytest
+
+from ctrl_z import Backup
+from ctrl_z.backup import BackupError
+from ctrl_z.retry import RetryPolicy
+
+
+def test_retryable_errors():
+    policy = RetryPolicy.from_config("files", {"messages": ["try again"]})
+
+    assert policy.is_retryable(OSError(errno.ESTALE, "Stale file handle"))
+    assert not policy.is_retryable(OSError(errno.ENOENT, "No such file or directory"))
+    # as copytree reports them
+    assert policy.is_retryable(Exception([("a", "b", "[Errno 5] Input/output error")]))
+    assert policy.is_retryable(BackupError("Server busy, Try Again later"))
+    try:
+        try:
+            raise OSError(errno.EIO, "Input/output error")
+        except OSError as exc:
+            raise BackupError("copy failed") from exc
+    except BackupError as exc:
+        assert policy.is_retryable(exc)
+
+    database = RetryPolicy.from_config("database", None)
+    assert database.is_retryable(BackupError("pg_dump: error: could not connect to server: Connection refused"))
+    assert not database.is_retryable(BackupError('pg_dump: error: relation "foo" does not exist'))
+
+    with pytest.raises(ValueError):
+        RetryPolicy(errors=["EWHATEVER"])
+
+
+def test_retries_are_opt_in():
+    assert RetryPolicy.from_config("database", None).attempts == 1
+    assert RetryPolicy.from_config("files", {}).attempts == 1
+    assert RetryPolicy.from_config("files", {"attempts": 3}).attempts == 3
+
+
+def test_backoff(mocker):
+    sleep = mocker.patch("ctrl_z.retry.time.sleep")
+    cleanup = mocker.Mock()
+    function = mocker.Mock(side_effect=[OSError(errno.EIO, "I/O error")] * 3 + ["done"])
+    policy = RetryPolicy(attempts=4, backoff=1, max_backoff=3, errors=["EIO"])
+
+    assert policy.call(function, "arg", description="copy", cleanup=cleanup) == "done"
+    assert [call.args[0] for call in sleep.call_args_list] == [1, 2, 3]
+    assert cleanup.call_count == 3
+    function.assert_called_with("arg")
+
+    function = mocker.Mock(side_effect=OSError(errno.EIO, "I/O error"))
+    with pytest.raises(OSError):
+        RetryPolicy(attempts=2, errors=["EIO"]).call(function)
+    assert function.call_count == 2
+
+    function = mocker.Mock(side_effect=OSError(errno.ENOENT, "No such file"))
+    with pytest.raises(OSError):
+        RetryPolicy(attempts=2, errors=["EIO"]).call(function)
+    assert function.call_count == 1
+
+
+def test_only_the_failed_directory_is_retried(tmpdir, settings, config_writer, mocker):
+    media = tmpdir.mkdir("media")
+    media.join("file.txt").write("content")
+    settings.MEDIA_ROOT = str(media)
+    # the partial copy would be skipped, not replaced
+    config_writer(
+        files={"directories": ["MEDIA_ROOT"], "overwrite_existing_directory": False},
+        retry={"files": {"attempts": 3}},
+    )
+    mocker.patch("ctrl_z.retry.time.sleep")
+    backup = Backup.from_config(str(tmpdir.join("config.yml")))
+    backup.create_directories()
+    backup_directory = Backup._backup_directory
+    calls = []
+
+    def stale_once(self, directory, **kwargs):
+        calls.append(directory)
+        if len(calls) == 1:
+            # a partial copy, removed before the retry
+            os.makedirs(os.path.join(self.files_dir, "media"))
+            raise OSError(errno.ESTALE, "Stale file handle")
+        return backup_directory(self, directory, **kwargs)
+
+    mocker.patch.object(Backup, "_backup_directory", stale_once)
+
+    backup.files()
+
+    assert calls == [str(media), str(media)]
+    assert os.path.exists(os.path.join(backup.files_dir, "media", "file.txt"))
+    (unit,) = backup.summary.units
+    assert unit["status"] == "succeeded"
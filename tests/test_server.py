@@ -0,0 +1,121 @@
+import http.client
+import json
+import os
+import socket
+import stat
+import warnings
+from datetime import datetime
+
+import pytest
+
+from ctrl_z.config import Config
+from ctrl_z.server import ScheduleEntry, Server
+
+
+class UnixHTTPConnection(http.client.HTTPConnection):
+    def __init__(self, path):
+        super().__init__("localhost")
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+TOKEN = "secret-token"
+
+
+def _request(path, method, url, body=None, token=TOKEN, content_type="application/json"):
+    headers = {"Content-Type": content_type}
+    if token:
+        headers["Authorization"] = f"Bearer {token}"
+    connection = UnixHTTPConnection(path)
+    connection.request(method, url, body=json.dumps(body) if body is not None else None, headers=headers)
+    response = connection.getresponse()
+    return response.status, json.loads(response.read())
+
+
+def test_schedule_entries():
+    now = datetime(2026, 10, 19, 3, 0)
+
+    assert ScheduleEntry(at="02:30").next_run(now) == datetime(2026, 10, 20, 2, 30)
+    assert ScheduleEntry(at="23:00").next_run(now) == datetime(2026, 10, 19, 23, 0)
+    assert ScheduleEntry(every=90, files=False).next_run(now) == datetime(2026, 10, 19, 4, 30)
+    with pytest.raises(ValueError):
+        ScheduleEntry()
+    with pytest.raises(ValueError, match="Unknown backup options: fies"):
+        ScheduleEntry(at="02:30", fies=False)
+
+
+def test_invalid_schedule(tmpdir, config_writer):
+    config_writer(serve={"schedule": [{"every": 60, "db_only": True}]})
+    config_path = str(tmpdir.join("config.yml"))
+
+    with pytest.raises(ValueError, match="Invalid schedule entry"):
+        Server(config_path, Config.from_file(config_path))
+
+
+def test_queue_and_status(tmpdir, settings, config_writer, monkeypatch):
+    monkeypatch.setenv("CTRL_Z_SERVE_TOKEN", TOKEN)
+    with warnings.catch_warnings():
+        warnings.filterwarnings("ignore", category=UserWarning)
+        settings.DATABASES = {}
+    media = tmpdir.mkdir("media")
+    media.join("file.txt").write("content")
+    settings.MEDIA_ROOT = str(media)
+    socket_path = str(tmpdir.join("ctrl-z.sock"))
+    config_writer(serve={"socket": socket_path, "schedule": [{"at": "02:30"}]})
+    config_path = str(tmpdir.join("config.yml"))
+
+    server = Server(config_path, Config.from_file(config_path))
+    server.start()
+    try:
+        assert stat.S_IMODE(os.stat(socket_path).st_mode) == 0o600
+        status, error = _request(socket_path, "POST", "/backup", {"db": False}, token=None)
+        assert status == 401
+        status, error = _request(socket_path, "POST", "/backup", {"db": False}, token="wrong")
+        assert status == 401
+        status, error = _request(socket_path, "POST", "/backup", {"db": False}, content_type="text/plain")
+        assert status == 415
+        assert server.queued == []
+
+        status, job = _request(socket_path, "POST", "/backup", {"db": False})
+        assert status == 202
+        assert job["status"] == "queued"
+        status, error = _request(socket_path, "POST", "/restore", {"files": False})
+        assert status == 400
+        assert "backup_dir" in error["error"]
+
+        assert server.process_next(timeout=5).status == "succeeded"
+
+        status, body = _request(socket_path, "GET", "/status")
+        assert status == 200
+        assert body["current"] is None
+        assert body["queued"] == []
+        assert [run["status"] for run in body["history"]] == ["succeeded"]
+        assert body["next_run"].endswith("02:30:00")
+    finally:
+        server.stop()
+        server.shutdown()
+
+    (backup_dir,) = tmpdir.join("backups").listdir(lambda path: path.isdir())
+    assert backup_dir.join("files", "media", "file.txt").exists()
+
+
+def test_requests_without_token(tmpdir, config_writer, monkeypatch):
+    monkeypatch.delenv("CTRL_Z_SERVE_TOKEN", raising=False)
+    socket_path = str(tmpdir.join("ctrl-z.sock"))
+    config_writer(serve={"socket": socket_path})
+    config_path = str(tmpdir.join("config.yml"))
+
+    server = Server(config_path, Config.from_file(config_path))
+    server.start()
+    try:
+        status, error = _request(socket_path, "POST", "/backup", {"db": False})
+        assert status == 403
+        assert server.queued == []
+        status, _body = _request(socket_path, "GET", "/status")
+        assert status == 200
+    finally:
+        server.stop()
+        server.shutdown()
@@ -0,0 +1,78 @@
+import os
+
+import pytest
+
+from ctrl_z import Backup
+from ctrl_z.snapshot import SnapshotError, freeze_directory, get_snapshot_path
+
+from .test_drivers import _sqlite_db, _sqlite_rows
+from .test_encryption import _fake_binary
+
+# the engines are switched per test
+pytestmark = pytest.mark.filterwarnings("ignore:Overriding setting DATABASES")
+
+
+def test_hardlink_freeze(tmpdir):
+    media = tmpdir.mkdir("media")
+    media.join("kept.txt").write("kept")
+    media.join("deleted.txt").write("deleted")
+
+    with freeze_directory(str(media)) as path:
+        media.join("deleted.txt").remove()
+        media.join("added.txt").write("added")
+
+        assert sorted(os.listdir(path)) == ["deleted.txt", "kept.txt"]
+        assert os.stat(os.path.join(path, "kept.txt")).st_ino == media.join("kept.txt").stat().ino
+
+    assert not os.path.exists(path)
+
+
+def test_command_freeze(tmpdir):
+    media = tmpdir.mkdir("media")
+    media.join("file.txt").write("content")
+    # a stale snapshot of a crashed run
+    tmpdir.mkdir("media.ctrl-z-snapshot")
+
+    with freeze_directory(str(media), command="cp -r {source} {snapshot}", release="rm -r {snapshot}") as path:
+        assert path == get_snapshot_path(str(media))
+        assert os.listdir(path) == ["file.txt"]
+    assert not os.path.exists(path)
+
+    with pytest.raises(SnapshotError):
+        with freeze_directory(str(media), command="false"):
+            pass
+
+
+def test_dump_of_exported_snapshot(tmpdir, config_writer):
+    config_writer(
+        pg_dump_binary=_fake_binary(
+            tmpdir, "pg_dump", 'for arg; do case $arg in -f*) out=${arg#-f};; esac; done; echo "$@" > $out'
+        )
+    )
+    backup = Backup.from_config(str(tmpdir.join("config.yml")))
+    backup.create_directories()
+
+    backup._backup_database("default", {"NAME": "ctrlz", "USER": "ctrlz", "PASSWORD": "ctrlz"}, "00000003-1B")
+
+    (dump,) = os.listdir(backup.db_dir)
+    with open(os.path.join(backup.db_dir, dump)) as infile:
+        assert "--snapshot=00000003-1B" in infile.read()
+
+
+def test_consistent_backup(tmpdir, settings, config_writer):
+    media = tmpdir.mkdir("media")
+    media.join("file.txt").write("content")
+    settings.MEDIA_ROOT = str(media)
+    database = tmpdir.join("db.sqlite3")
+    _sqlite_db(database, ["a"])
+    settings.DATABASES = {"default": {"ENGINE": "django.db.backends.sqlite3", "NAME": str(database)}}
+    config_writer(snapshot={"enabled": True})
+    config_path = str(tmpdir.join("config.yml"))
+
+    backup = Backup.from_config(config_path)
+    backup.full()
+
+    assert os.listdir(backup.db_dir) == ["default.db.sqlite3.backup"]
+    assert _sqlite_rows(os.path.join(backup.db_dir, "default.db.sqlite3.backup")) == ["a"]
+    assert os.path.exists(os.path.join(backup.files_dir, "media", "file.txt"))
+    assert not os.path.exists(get_snapshot_path(str(media)))
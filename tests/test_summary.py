@@ -0,0 +1,112 @@
+import json
+from io import StringIO
+
+import pytest
+
+from ctrl_z import Backup
+from ctrl_z._cli import CLI
+from ctrl_z.lock import backup_lock
+from ctrl_z.summary import EXIT_LOCKED, EXIT_PARTIAL_FAILURE
+
+from .test_drivers import _sqlite_db
+from .test_encryption import _fake_binary
+
+# the engines are switched per test
+pytestmark = pytest.mark.filterwarnings("ignore:Overriding setting DATABASES")
+
+
+def _setup(tmpdir, settings, config_writer, **overrides):
+    media = tmpdir.mkdir("media")
+    media.join("file.txt").write("content")
+    settings.MEDIA_ROOT = str(media)
+    databases = {}
+    for name in ("default", "broken"):
+        database = tmpdir.join(f"{name}.sqlite3")
+        _sqlite_db(database, ["a"])
+        databases[name] = {"ENGINE": "django.db.backends.sqlite3", "NAME": str(database)}
+    settings.DATABASES = databases
+    config_writer(**overrides)
+    return str(tmpdir.join("config.yml"))
+
+
+def test_partial_failure(tmpdir, settings, config_writer, mocker, mailoutbox):
+    config_path = _setup(tmpdir, settings, config_writer)
+    backup_database = Backup._backup_database
+
+    def fail_broken(self, alias, *args):
+        if alias == "broken":
+            raise RuntimeError("disk full")
+        return backup_database(self, alias, *args)
+
+    mocker.patch.object(Backup, "_backup_database", fail_broken)
+    stdout = StringIO()
+
+    with pytest.raises(SystemExit) as excinfo:
+        CLI()(args=["--summary", "-", "backup"], config_file=config_path, stdout=stdout, stderr=StringIO())
+
+    assert excinfo.value.code == EXIT_PARTIAL_FAILURE
+    summary = json.loads(stdout.getvalue())
+    assert summary["kind"] == "backup"
+    assert summary["status"] == "partial"
+    assert summary["error"] == "Failed to back up: database 'broken'"
+    units = {unit["name"]: unit for unit in summary["units"]}
+    assert units["default"]["status"] == "succeeded"
+    assert units["default"]["bytes"] > 0
+    assert units["broken"]["status"] == "failed"
+    assert units["broken"]["error"] == "disk full"
+    # the files are still backed up
+    assert units[str(tmpdir.join("media"))]["status"] == "succeeded"
+    assert {phase["name"]: phase["status"] for phase in summary["phases"]} == {
+        "rotate": "succeeded",
+        "databases": "partial",
+        "files": "succeeded",
+    }
+
+
+def test_dump_error(tmpdir, settings, config_writer):
+    config_path = _setup(
+        tmpdir,
+        settings,
+        config_writer,
+        mysqldump_binary=_fake_binary(tmpdir, "mysqldump", 'echo "mysqldump: Got error: 1045" >&2; exit 2'),
+    )
+    settings.DATABASES["broken"] = {"ENGINE": "django.db.backends.mysql", "NAME": "shop", "USER": "shop"}
+    stdout = StringIO()
+
+    with pytest.raises(SystemExit) as excinfo:
+        CLI()(args=["--summary", "-", "backup"], config_file=config_path, stdout=stdout, stderr=StringIO())
+
+    assert excinfo.value.code == EXIT_PARTIAL_FAILURE
+    units = {unit["name"]: unit for unit in json.loads(stdout.getvalue())["units"]}
+    assert units["broken"]["status"] == "failed"
+    assert units["broken"]["error"] == "mysqldump: Got error: 1045"
+
+
+def test_lock_contention(tmpdir, settings, config_writer):
+    config_path = _setup(tmpdir, settings, config_writer)
+    summary_path = tmpdir.join("summary.json")
+
+    with backup_lock(str(tmpdir.join("backups", "2026-10-19-daily"))):
+        with pytest.raises(SystemExit) as excinfo:
+            CLI()(args=["--summary", str(summary_path), "backup"], config_file=config_path, stderr=StringIO())
+
+    assert excinfo.value.code == EXIT_LOCKED
+    summary = json.loads(summary_path.read())
+    assert summary["status"] == "locked"
+    assert summary["units"] == []
+
+
+def test_success(tmpdir, settings, config_writer, mailoutbox):
+    config_path = _setup(
+        tmpdir, settings, config_writer, report={"enabled": True, "to": ["root@localhost"], "tail_lines": 2}
+    )
+    summary_path = tmpdir.join("summary.json")
+
+    CLI()(args=["--summary", str(summary_path), "backup"], config_file=config_path, stderr=StringIO())
+
+    summary = json.loads(summary_path.read())
+    assert summary["status"] == "succeeded"
+    assert [unit["status"] for unit in summary["units"]] == ["succeeded"] * 3
+    (message,) = mailoutbox
+    assert message.subject.endswith(" succeeded")
+    assert "{now}" not in message.subject
@@ -0,0 +1,125 @@
+import argparse
+import os
+from io import StringIO
+
+import pytest
+
+from ctrl_z import Backup
+from ctrl_z._cli import CLI
+from ctrl_z.hashing import hash_tree
+from ctrl_z.retention import RetentionPolicy
+from ctrl_z.tiers import (
+    Tier, TierError, find_backup, list_backups, migrate, move_backup
+)
+
+POLICY = RetentionPolicy()
+
+
+def _backup_dir(base, name):
+    backup_dir = base.mkdir(name)
+    backup_dir.mkdir("db")
+    backup_dir.mkdir("files").mkdir("media").join("file.txt").write(name)
+    return backup_dir
+
+
+def test_move_verifies_the_copy(tmpdir, mocker):
+    backup_dir = _backup_dir(tmpdir.mkdir("backups"), "2020-01-05-weekly")
+    tier = Tier(str(tmpdir.join("archive")))
+    # an interrupted move
+    tmpdir.mkdir("archive").mkdir("2020-01-05-weekly.partial").join("leftover").write("")
+
+    dest = move_backup(str(backup_dir), tier)
+
+    assert dest == str(tmpdir.join("archive", "2020-01-05-weekly"))
+    assert os.listdir(str(tmpdir.join("archive"))) == ["2020-01-05-weekly"]
+    assert tmpdir.join("archive", "2020-01-05-weekly", "files", "media", "file.txt").read() == "2020-01-05-weekly"
+    assert not backup_dir.exists()
+
+    corrupted = _backup_dir(tmpdir.join("backups"), "2020-01-12-weekly")
+    # the digests of the copy differ
+    mocker.patch("ctrl_z.tiers.hash_tree", side_effect=lambda root, **kwargs: (hash_tree(root, **kwargs), root))
+    with pytest.raises(TierError):
+        move_backup(str(corrupted), tier)
+    assert corrupted.join("files", "media", "file.txt").exists()
+    assert not tmpdir.join("archive", "2020-01-12-weekly.partial").exists()
+
+
+def test_migrate_to_slowest_accepting_tier(tmpdir):
+    base = tmpdir.mkdir("backups")
+    for name in ["2020-01-01-monthly", "2020-01-05-weekly", "2020-01-06-daily", "2099-01-04-weekly"]:
+        _backup_dir(base, name)
+    tiers = [Tier(str(tmpdir.join("archive"))), Tier(str(tmpdir.join("cold")), suffixes=["monthly"])]
+
+    moved = migrate(str(base), tiers, POLICY, exclude=str(base.join("2020-01-05-weekly")))
+
+    assert moved == [str(tmpdir.join("cold", "2020-01-01-monthly"))]
+    assert sorted(os.listdir(str(base))) == ["2020-01-05-weekly", "2020-01-06-daily", "2099-01-04-weekly"]
+
+    moved = migrate(str(base), tiers, POLICY)
+
+    assert moved == [str(tmpdir.join("archive", "2020-01-05-weekly"))]
+    assert [name for name, path in list_backups(str(base), tiers, POLICY)] == [
+        "2020-01-01-monthly",
+        "2020-01-05-weekly",
+        "2020-01-06-daily",
+        "2099-01-04-weekly",
+    ]
+    found = find_backup("2020-01-01-monthly", str(base), tiers, POLICY)
+    assert found == str(tmpdir.join("cold", "2020-01-01-monthly"))
+    assert find_backup("2020-01-02-daily", str(base), tiers, POLICY) is None
+
+
+def test_rotate_prunes_tiers(tmpdir, config_writer):
+    archive = tmpdir.mkdir("archive")
+    _backup_dir(archive, "2000-01-02-weekly")
+    config_writer(tiers=[{"path": str(archive)}])
+
+    Backup.from_config(str(tmpdir.join("config.yml"))).rotate()
+
+    assert archive.listdir() == []
+
+
+def test_rotate_keeps_moves_in_progress(tmpdir, config_writer):
+    archive = tmpdir.mkdir("archive")
+    _backup_dir(archive, "2000-01-02-weekly.partial")
+    config_writer(tiers=[{"path": str(archive)}])
+
+    Backup.from_config(str(tmpdir.join("config.yml"))).rotate()
+
+    assert [path.basename for path in archive.listdir()] == ["2000-01-02-weekly.partial"]
+
+
+def test_restore_by_name(tmpdir, settings, config_writer):
+    archive = tmpdir.mkdir("archive")
+    backup_dir = _backup_dir(archive, "2020-01-05-weekly")
+    config_path = str(tmpdir.join("config.yml"))
+    config_writer(tiers=[{"path": str(archive)}])
+    settings.MEDIA_ROOT = str(tmpdir.join("media"))
+
+    stdout = StringIO()
+    CLI()(args=["list_backups"], config_file=config_path, stdout=stdout, stderr=StringIO())
+    assert stdout.getvalue().startswith(f"2020-01-05-weekly\t{backup_dir}\n")
+
+    CLI()(args=["restore", "2020-01-05-weekly", "--no-db"], config_file=config_path, stderr=StringIO())
+    assert tmpdir.join("media", "file.txt").read() == "2020-01-05-weekly"
+
+    with pytest.raises(argparse.ArgumentTypeError):
+        CLI()(args=["restore", "2020-01-12-weekly"], config_file=config_path, stderr=StringIO())
+
+
+def test_backup_migrates_in_the_background(tmpdir, settings, config_writer, mocker):
+    base = tmpdir.mkdir("backups")
+    _backup_dir(base, "2020-01-05-weekly")
+    config_writer(base_dir=str(base), tiers=[{"path": str(tmpdir.join("archive"))}])
+    # keep the old backup around
+    mocker.patch.object(Backup, "rotate")
+    media = tmpdir.mkdir("media")
+    media.join("file.txt").write("content")
+    settings.MEDIA_ROOT = str(media)
+
+    backup = Backup.from_config(str(tmpdir.join("config.yml")))
+    backup.full(db=False)
+
+    assert tmpdir.join("archive", "2020-01-05-weekly", "files", "media", "file.txt").exists()
+    assert os.path.exists(os.path.join(backup.files_dir, "media", "file.txt"))
+    assert not base.join("2020-01-05-weekly").exists()
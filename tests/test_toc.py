@@ -0,0 +1,146 @@
+import pytest
+
+from ctrl_z import Backup
+from ctrl_z.backup import BackupError
+from ctrl_z.toc import RestoreProfile, select_entries
+
+from .test_encryption import KEY, _fake_binary
+
+LISTING = """;
+; Archive created at 2026-10-19 02:30:00 UTC
+;     dbname: app
+;
+; Selected TOC Entries:
+;
+215; 1259 16386 TABLE public django_session app
+;	depends on: 5
+216; 1259 16392 TABLE public auth_user app
+;	depends on: 5
+217; 1259 16398 TABLE public audit_log app
+;	depends on: 5
+218; 1259 16404 VIEW public recent_sessions app
+;	depends on: 215
+3350; 0 16386 TABLE DATA public django_session app
+;	depends on: 215
+3351; 0 16392 TABLE DATA public auth_user app
+;	depends on: 216
+3352; 0 16398 TABLE DATA public audit_log app
+;	depends on: 217
+3200; 2606 16410 CONSTRAINT public django_session django_session_pkey app
+;	depends on: 215
+3201; 2606 16412 CONSTRAINT public audit_log audit_log_pkey app
+;	depends on: 217
+3202; 1259 16414 INDEX public django_session_expire_date app
+;	depends on: 215
+3203; 2606 16416 FK CONSTRAINT public auth_user auth_user_last_log_fk app
+;	depends on: 216 3201
+3204; 2606 16418 FK CONSTRAINT public audit_log audit_log_user_fk app
+;	depends on: 217 216
+"""
+
+
+def _restored(selection):
+    return [line.split(";")[0] for line in selection.lines if line[0].isdigit()]
+
+
+def test_select_entries():
+    profile = RestoreProfile.from_config({"full": ["auth_*"], "skip": ["public.django_session"]})
+
+    selection = select_entries(LISTING.encode().splitlines(True), profile)
+
+    # the session table and everything depending on it are left out, the
+    # foreign key would fail on the audit log without data
+    assert _restored(selection) == ["216", "217", "3351", "3201", "3204"]
+    assert selection.entries == 5
+    assert selection.dropped == 7
+    assert selection.tables == {
+        "public.django_session": "skip",
+        "public.auth_user": "full",
+        "public.audit_log": "schema_only",
+    }
+
+
+def test_select_entries_dependency_order():
+    # pg_restore does not list the table of a foreign key first
+    listing = LISTING.replace(";\tdepends on: 216 3201", ";\tdepends on: 3201 216").replace(
+        ";\tdepends on: 217 216", ";\tdepends on: 216 217"
+    )
+    profile = RestoreProfile.from_config({"full": ["auth_*"], "skip": ["public.django_session"]})
+
+    selection = select_entries(listing.encode().splitlines(True), profile)
+
+    assert _restored(selection) == ["216", "217", "3351", "3201", "3204"]
+
+
+def test_profile_config():
+    profile = RestoreProfile.from_config({"schema_only": ["audit_*"], "skip": ["*_session"]})
+
+    assert profile.get_mode("public", "auth_user") == "full"
+    assert profile.get_mode("public", "audit_log") == "schema_only"
+    assert profile.get_mode("public", "django_session") == "skip"
+    assert profile.get_expected_row_counts(
+        {"public.auth_user": 10, "public.audit_log": 1000, "public.django_session": 5}
+    ) == {"public.auth_user": 10, "public.audit_log": 0}
+
+    with pytest.raises(ValueError, match="Sampling"):
+        RestoreProfile.from_config({"sample": {"orders": 0.1}})
+    with pytest.raises(ValueError, match="schema"):
+        RestoreProfile.from_config({"schema": ["audit_log"]})
+
+
+def _write_config(tmpdir, config_writer, **overrides):
+    listing = tmpdir.join("listing.txt")
+    listing.write(LISTING)
+    used_list = tmpdir.join("used.list")
+    config_writer(
+        pg_dump_binary=_fake_binary(
+            tmpdir, "pg_dump", 'echo "dump"; for arg; do case "$arg" in -f*) echo "dump" > "${arg#-f}";; esac; done'
+        ),
+        pg_restore_binary=_fake_binary(
+            tmpdir,
+            "pg_restore",
+            f'if [ "$1" = "--list" ]; then cat {listing}; exit; fi\n'
+            f'for arg; do case "$arg" in --use-list=*) cp "${{arg#--use-list=}}" {used_list};; esac; done',
+        ),
+        dropdb_binary=_fake_binary(tmpdir, "dropdb", f"touch {tmpdir.join('dropped')}"),
+        createdb_binary=_fake_binary(tmpdir, "createdb", "true"),
+        database={"test_function": "tests.test_encryption.always_ok"},
+        **overrides,
+    )
+    return str(tmpdir.join("config.yml"))
+
+
+@pytest.mark.parametrize("encrypted", [False, True])
+def test_restore_with_profile(tmpdir, settings, config_writer, monkeypatch, encrypted):
+    monkeypatch.setenv("CTRL_Z_ENCRYPTION_KEY", KEY)
+    settings.MEDIA_ROOT = str(tmpdir.mkdir("media"))
+    config_path = _write_config(
+        tmpdir,
+        config_writer,
+        encryption={"enabled": encrypted},
+        restore_profiles={"staging": {"default": {"schema_only": ["audit_log", "django_*"]}}},
+    )
+    backup = Backup.from_config(config_path)
+    backup.full(skip_db=["secondary"], files=False)
+
+    restore = Backup.prepare_restore(config_path, backup.base_dir)
+    restore.restore(skip_db=["secondary"], files=False, profile="staging")
+
+    used = tmpdir.join("used.list").read().splitlines()
+    assert "3351; 0 16392 TABLE DATA public auth_user app" in used
+    assert ";3350; 0 16386 TABLE DATA public django_session app" in used
+    assert ";3203; 2606 16416 FK CONSTRAINT public auth_user auth_user_last_log_fk app" in used
+    assert "3204; 2606 16418 FK CONSTRAINT public audit_log audit_log_user_fk app" in used
+
+
+def test_unknown_profile_fails_before_drop(tmpdir, settings, config_writer):
+    settings.MEDIA_ROOT = str(tmpdir.mkdir("media"))
+    config_path = _write_config(tmpdir, config_writer)
+    backup = Backup.from_config(config_path)
+    backup.full(skip_db=["secondary"], files=False)
+
+    restore = Backup.prepare_restore(config_path, backup.base_dir)
+    with pytest.raises(BackupError, match="Unknown restore profile 'staging'"):
+        restore.restore(skip_db=["secondary"], files=False, profile="staging")
+
+    assert not tmpdir.join("dropped").exists()
@@ -0,0 +1,53 @@
+import pytest
+
+from ctrl_z import Backup
+from ctrl_z.backup import BackupError, RestorePlan
+from ctrl_z.db_restore import compare_row_counts
+
+CHECKED = []
+
+
+def record_check(using, **context):
+    CHECKED.append((using, context["row_counts"]))
+    return using != "secondary"
+
+
+def always_ok(using):
+    return True
+
+
+def test_compare_row_counts():
+    expected = {"public.a": 1000, "public.b": 10, "public.c": 5}
+    actual = {"public.a": 1200, "public.b": 50}
+
+    assert compare_row_counts(expected, actual) == [
+        "table public.a has 1200 rows, expected 1000",
+        "table public.c is missing",
+    ]
+    assert compare_row_counts(expected, actual, tolerance=0.25) == ["table public.c is missing"]
+    assert compare_row_counts(expected, actual, tolerance=0.25, slack=0) == [
+        "table public.b has 50 rows, expected 10",
+        "table public.c is missing",
+    ]
+
+
+def test_verify_all_aliases(tmpdir, config_writer):
+    row_counts_file = tmpdir.join("default.rowcounts.json")
+    row_counts_file.write('{"public.a": 1}')
+    config_writer(
+        database={
+            "test_function": "tests.test_verification.always_ok",
+            "checks": ["tests.test_verification.record_check"],
+        }
+    )
+    backup = Backup.from_config(str(tmpdir.join("config.yml")))
+    plans = [
+        RestorePlan("default", {"NAME": "first"}, "first.custom", row_counts_file=str(row_counts_file)),
+        RestorePlan("secondary", {"NAME": "second"}, "second.custom"),
+    ]
+    CHECKED.clear()
+
+    with pytest.raises(BackupError, match="second"):
+        backup.verify_databases(plans)
+
+    assert sorted(CHECKED) == [("default", {"public.a": 1}), ("secondary", None)]
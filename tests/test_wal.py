@@ -0,0 +1,181 @@
+import io
+import os
+import tarfile
+from datetime import datetime, timezone
+
+import pytest
+import yaml
+
+from ctrl_z import Backup
+from ctrl_z.backup import BackupError
+from ctrl_z.config import DEFAULT_CONFIG_FILE, Config
+from ctrl_z.lock import backup_lock
+from ctrl_z.wal import (
+    archive_segment, lsn_to_segment, main, parse_start_point, prune_archive,
+    write_info
+)
+
+
+def test_partial_sections_get_defaults(tmpdir):
+    with open(DEFAULT_CONFIG_FILE) as infile:
+        options = yaml.safe_load(infile)
+    options.update(
+        base_dir=str(tmpdir),
+        wal={"enabled": True},
+        encryption={"key_file": "/etc/ctrl-z.key"},
+        snapshot=None,
+        lock={"mode": "wait"},
+    )
+
+    config = Config(**options)
+
+    assert config.wal == {"enabled": True, "archive_dir": "wal"}
+    assert config.encryption["enabled"] is False
+    assert config.encryption["key_file"] == "/etc/ctrl-z.key"
+    assert config.snapshot["enabled"] is False
+    assert config.lock["stale_after"] == 300
+
+
+def test_lsn_to_segment():
+    assert lsn_to_segment("0/2000028", 1) == "000000010000000000000002"
+    assert lsn_to_segment("1A/FF000060", 3) == "000000030000001A000000FF"
+
+
+def test_parse_start_point():
+    output = (
+        "pg_basebackup: initiating base backup, waiting for checkpoint to complete\n"
+        "pg_basebackup: checkpoint completed\n"
+        "pg_basebackup: write-ahead log start point: 0/5000028 on timeline 2\n"
+    )
+
+    assert parse_start_point(output) == ("0/5000028", 2)
+
+
+def test_archive_segment(tmpdir):
+    segment = tmpdir.join("000000010000000000000002")
+    segment.write("wal content")
+    archive_dir = str(tmpdir.join("archive"))
+
+    assert main(["archive", str(segment), archive_dir]) == 0
+    # retries by PostgreSQL are fine
+    archive_segment(str(segment), archive_dir)
+
+    assert os.listdir(archive_dir) == ["000000010000000000000002"]
+
+    segment.write("different content")
+    with pytest.raises(FileExistsError):
+        archive_segment(str(segment), archive_dir)
+
+
+def test_prune_archive(tmpdir):
+    archive_dir = tmpdir.mkdir("archive")
+    for name in [
+        "000000010000000000000001",
+        "000000010000000000000002.00000028.backup",
+        "000000010000000000000003",
+        "000000010000000000000004",
+        "00000002.history",
+    ]:
+        archive_dir.join(name).write("")
+
+    removed = prune_archive(str(archive_dir), "000000010000000000000003")
+
+    assert removed == 2
+    assert sorted(os.listdir(str(archive_dir))) == [
+        "000000010000000000000003",
+        "000000010000000000000004",
+        "00000002.history",
+    ]
+
+
+def _make_base_backup(backup_dir, finished, segment=2):
+    path = backup_dir.join("basebackup", "localhost.5432")
+    path.ensure(dir=True)
+    with tarfile.open(str(path.join("base.tar.gz")), "w:gz") as tar:
+        content = b"16\n"
+        info = tarfile.TarInfo("PG_VERSION")
+        info.size = len(content)
+        tar.addfile(info, io.BytesIO(content))
+    write_info(
+        str(path),
+        cluster="localhost.5432",
+        start_lsn=f"0/{segment}000028",
+        timeline=1,
+        start_segment=f"00000001000000000000000{segment}",
+        finished=finished,
+    )
+
+
+def test_restore_cluster(tmpdir, config_writer):
+    backups = tmpdir.mkdir("backups")
+    backup_dir = backups.mkdir("2018-06-27-daily")
+    _make_base_backup(backup_dir, "2018-06-27T02:00:00+00:00")
+    config_writer(base_dir=str(backups))
+    backup = Backup.prepare_restore(str(tmpdir.join("config.yml")), str(backup_dir))
+    pgdata = tmpdir.join("pgdata")
+
+    backup.restore_cluster(str(pgdata), target_time=datetime(2018, 6, 27, 14, 30, tzinfo=timezone.utc))
+
+    assert pgdata.join("PG_VERSION").read() == "16\n"
+    assert pgdata.join("recovery.signal").check()
+    conf = pgdata.join("postgresql.auto.conf").read()
+    assert "recovery_target_time = '2018-06-27 14:30:00+00:00'" in conf
+    assert os.path.join(str(backups), "wal", "localhost.5432") in conf
+
+
+def test_restore_cluster_holds_the_lock(tmpdir, config_writer):
+    backups = tmpdir.mkdir("backups")
+    backup_dir = backups.mkdir("2018-06-27-daily")
+    _make_base_backup(backup_dir, "2018-06-27T02:00:00+00:00")
+    config_writer(base_dir=str(backups), lock={"mode": "skip"})
+    backup = Backup.prepare_restore(str(tmpdir.join("config.yml")), str(backup_dir))
+    pgdata = tmpdir.join("pgdata")
+
+    with backup_lock(backup.base_dir):
+        assert backup.restore_cluster(str(pgdata)) is None
+    assert backup.lock_skipped
+    assert not pgdata.check()
+
+
+def test_restore_cluster_target_before_backup(tmpdir, config_writer):
+    backups = tmpdir.mkdir("backups")
+    backup_dir = backups.mkdir("2018-06-27-daily")
+    _make_base_backup(backup_dir, "2018-06-27T02:00:00+00:00")
+    config_writer(base_dir=str(backups))
+    backup = Backup.prepare_restore(str(tmpdir.join("config.yml")), str(backup_dir))
+
+    with pytest.raises(BackupError):
+        backup.restore_cluster(str(tmpdir.join("pgdata")), target_time=datetime(2018, 6, 27, tzinfo=timezone.utc))
+
+
+def test_rotation_prunes_wal_archive(tmpdir, config_writer):
+    backups = tmpdir.mkdir("backups")
+    _make_base_backup(backups.mkdir("2018-06-27-daily"), "2018-06-27T02:00:00+00:00")
+    archive_dir = backups.mkdir("wal").mkdir("localhost.5432")
+    archive_dir.join("000000010000000000000001").write("")
+    archive_dir.join("000000010000000000000002").write("")
+    config_writer(base_dir=str(backups), wal={"enabled": True, "archive_dir": "wal"})
+    backup = Backup.prepare_restore(str(tmpdir.join("config.yml")), str(backups.join("2018-06-28-daily")))
+
+    backup.prune_wal_archive()
+
+    assert os.listdir(str(archive_dir)) == ["000000010000000000000002"]
+
+
+def test_wal_pruning_counts_tiers(tmpdir, config_writer):
+    backups = tmpdir.mkdir("backups")
+    _make_base_backup(backups.mkdir("2018-06-28-daily"), "2018-06-28T02:00:00+00:00", segment=3)
+    # an older backup, moved to a slower tier
+    archive = tmpdir.mkdir("archive")
+    _make_base_backup(archive.mkdir("2018-06-25-weekly"), "2018-06-25T02:00:00+00:00", segment=2)
+    archive_dir = backups.mkdir("wal").mkdir("localhost.5432")
+    for segment in range(1, 4):
+        archive_dir.join(f"00000001000000000000000{segment}").write("")
+    config_writer(
+        base_dir=str(backups), wal={"enabled": True, "archive_dir": "wal"}, tiers=[{"path": str(archive)}]
+    )
+    backup = Backup.prepare_restore(str(tmpdir.join("config.yml")), str(backups.join("2018-06-28-daily")))
+
+    backup.prune_wal_archive()
+
+    assert sorted(os.listdir(str(archive_dir))) == ["000000010000000000000002", "000000010000000000000003"]
@@ -0,0 +1,108 @@
+import json
+import os
+import stat
+
+import ctrl_z.backup as backup_module
+from ctrl_z import Backup
+from ctrl_z.fastcopy import fast_copy
+from ctrl_z.filters import PathFilter
+from ctrl_z.hashing import hash_tree
+from ctrl_z.walk import iter_copy_tree, measure, walk_tree
+
+
+def _make_tree(root):
+    root.join("top.txt").write("top")
+    docs = root.mkdir("docs")
+    docs.join("a.pdf").write("a" * 10)
+    docs.mkdir("nested").join("b.pdf").write("b" * 20)
+    root.mkdir("thumbnails").join("thumb.jpg").write("thumb")
+    os.mkfifo(str(root.join("fifo")))
+    os.symlink(str(root.join("missing")), str(root.join("broken")))
+
+
+def test_walk_tree(tmpdir):
+    _make_tree(tmpdir)
+
+    entries = list(walk_tree(str(tmpdir), path_filter=PathFilter(exclude=["thumbnails"]), workers=2))
+
+    relpaths = [entry.relpath for entry in entries]
+    assert sorted(relpaths) == ["docs", "docs/a.pdf", "docs/nested", "docs/nested/b.pdf", "top.txt"]
+    # directories before their contents
+    assert relpaths.index("docs/nested") < relpaths.index("docs/nested/b.pdf")
+    assert measure(entries) == (3, 33)
+
+
+def test_copy_and_hash_in_one_walk(tmpdir, mocker):
+    source = tmpdir.mkdir("source")
+    _make_tree(source)
+    scandir = mocker.spy(os, "scandir")
+
+    copied = iter_copy_tree(walk_tree(str(source)), str(tmpdir.join("copy")))
+    digests = hash_tree(str(source), entries=copied)
+
+    # every directory is listed once
+    assert scandir.call_count == 4
+    assert sorted(digests) == ["docs/a.pdf", "docs/nested/b.pdf", "thumbnails/thumb.jpg", "top.txt"]
+    assert hash_tree(str(tmpdir.join("copy"))) == digests
+
+    # into an existing directory
+    tmpdir.join("copy", "top.txt").write("changed")
+    list(iter_copy_tree(walk_tree(str(source)), str(tmpdir.join("copy"))))
+    assert tmpdir.join("copy", "top.txt").read() == "top"
+
+
+def test_copy_read_only_directories(tmpdir):
+    source = tmpdir.mkdir("source")
+    source.mkdir("readonly").mkdir("nested").join("file.txt").write("content")
+    for path in (source.join("readonly", "nested"), source.join("readonly")):
+        path.chmod(0o555)
+    modes = []
+
+    def copy(src, dst):
+        # the directory is still writable for non-root users
+        modes.append(stat.S_IMODE(os.stat(os.path.dirname(dst)).st_mode))
+        fast_copy(src, dst)
+
+    try:
+        list(iter_copy_tree(walk_tree(str(source)), str(tmpdir.join("copy")), copy_function=copy))
+
+        assert len(modes) == 1 and modes[0] & stat.S_IWUSR
+        assert tmpdir.join("copy", "readonly", "nested", "file.txt").read() == "content"
+        for relpath in ("readonly", "readonly/nested"):
+            assert stat.S_IMODE(os.stat(str(tmpdir.join("copy", relpath))).st_mode) == 0o555
+    finally:
+        for root in (source, tmpdir.join("copy")):
+            for path in (root.join("readonly"), root.join("readonly", "nested")):
+                if path.check():
+                    path.chmod(0o755)
+
+
+def test_walk_subtree_without_symlinks(tmpdir):
+    _make_tree(tmpdir)
+    os.symlink(str(tmpdir.join("top.txt")), str(tmpdir.join("docs", "link.txt")))
+    os.symlink(str(tmpdir.join("thumbnails")), str(tmpdir.join("docs", "linked")))
+
+    entries = walk_tree(str(tmpdir.join("docs")), prefix="docs", follow_symlinks=False)
+
+    assert sorted(entry.relpath for entry in entries) == ["docs/a.pdf", "docs/nested", "docs/nested/b.pdf"]
+
+
+def test_backup_and_restore_walk_once(tmpdir, settings, config_writer, mocker):
+    media = tmpdir.mkdir("media")
+    settings.MEDIA_ROOT = str(media)
+    _make_tree(media)
+    config_writer()
+    config_path = str(tmpdir.join("config.yml"))
+    walk = mocker.spy(backup_module, "walk_tree")
+
+    backup = Backup.from_config(config_path)
+    backup.full(db=False)
+    assert walk.call_count == 1
+    # the totals of the restore progress
+    with open(os.path.join(backup.files_dir, "media.totals")) as infile:
+        assert json.load(infile) == {"files": 4, "bytes": 38}
+
+    restore = Backup.prepare_restore(config_path, backup.base_dir)
+    restore.restore(db=False)
+    assert walk.call_count == 2
+    assert media.join("docs", "nested", "b.pdf").read() == "b" * 20